@@ -3,15 +3,20 @@ import os
 import time
 from enum import Enum, unique
 from textwrap import dedent
-import pkg_resources
-from snakemake import snakemake
 from .capturing import Capturing
 
 
 NOW = datetime.datetime.fromtimestamp(time.time()).strftime('%Y%m%d_%H%M%S')
 
 
-ETC_DIR = pkg_resources.resource_filename("minos", "etc")
+try:
+	from importlib.resources import files as resource_files
+	ETC_DIR = str(resource_files("minos") / "etc")
+except ImportError:
+	# python < 3.9
+	import pkg_resources
+	ETC_DIR = pkg_resources.resource_filename("minos", "etc")
+
 DEFAULT_HPC_CONFIG_FILE = os.path.join(ETC_DIR, "hpc_config.json")
 DEFAULT_CONFIG_FILE = os.path.join(ETC_DIR, "minos_config.yaml")
 
@@ -155,6 +160,9 @@ def loadPreCmd(*args):
 def run_snakemake(snakefile, out_dir, cfg_file, exe_env, dryrun=False, unlock=False):
 	"""Helper function for calling external_process pipeline.  This helps us deal with all the different options that we
 	might want to switch between running in dryrun and regular mode."""
+	# snakemake is only imported when a pipeline is run, it dominates the start-up time otherwise
+	from snakemake import snakemake
+
 	res = False
 	if dryrun:
 		print("Dry run requested.  Will not execute tasks.")
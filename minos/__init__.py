@@ -1,9 +1,30 @@
-import pkg_resources
-
 __title__ = "minos"
 __author__ = "Christian Schudoma (cschu), Gemy Kaithakottil"
 __email__ = "christian.schudoma@earlham.ac.uk"
 __license__ = "MIT"
 __copyright__ = "Copyright 2019-2020 Earlham Institute"
-__version__ = pkg_resources.require("minos")[0].version
 
+import sys
+
+
+def _get_version():
+	try:
+		from importlib.metadata import version
+	except ImportError:
+		# python < 3.8
+		import pkg_resources
+		return pkg_resources.get_distribution("minos").version
+	return version("minos")
+
+
+def __getattr__(name):
+	# the version is looked up on first access only, so that importing
+	# minos.scripts.* (console scripts, snakemake run blocks) stays cheap
+	if name == "__version__":
+		return _get_version()
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+if sys.version_info < (3, 7):
+	# module __getattr__ (PEP 562) is not available, look the version up on import
+	__version__ = _get_version()
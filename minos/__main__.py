@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 import sys
+import os
 import argparse
 from os.path import join, dirname
 import glob
+import pathlib
 import shutil
 from minos import __version__
-from minos.minos_configure import *
-from eicore.snakemake_helper import *
+from eicore.snakemake_helper import NOW, DEFAULT_CONFIG_FILE, DEFAULT_HPC_CONFIG_FILE, make_exeenv_arg_group
 from minos.busco_configure import BUSCO_LEVELS
 
 
@@ -118,10 +119,14 @@ def main():
     print("Runmode is", args.runmode)
     if args.runmode == "configure":
         if run_configuration_file is None or args.force_reconfiguration:
+            from minos.minos_configure import MinosRunConfiguration
             MinosRunConfiguration(args).run()
         elif run_configuration_file is not None:
             print("Configuration file {} already present. Please set --force-reconfiguration/-f to override this.".format(run_configuration_file))
     elif args.runmode == "run":
+        import yaml
+        from eicore.snakemake_helper import ExecutionEnvironment, run_snakemake
+
         snake = join(dirname(__file__), "zzz", "minos_run.smk")
 
         if run_configuration_file is None:
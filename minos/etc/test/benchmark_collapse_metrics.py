@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+""" Benchmark of collapse_metrics.MetricCollapser: the python engine (read_metrics, one dict per transcript)
+against the numpy engine (read_metrics_columnar), on a tsv and an npz metrics matrix.
+Checks that both engines write the same collapsed metrics. """
+import argparse
+import filecmp
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from minos.scripts.collapse_metrics import MetricCollapser
+from minos.scripts.metrics_matrix import MetricsMatrixWriter
+
+
+METRICS_INFO = [
+	("mikado.protein", "prot1"), ("mikado.protein", "prot2"), ("mikado.transcript", "tx1"),
+	("blast", "hom1"), ("blast", "hom2"), ("repeat", "rm"), ("cpc", "cpc"),
+	("expression", "kallisto1"), ("busco", "busco_proteins"),
+]
+METRICS_HEADER = [
+	"tid", "prot1_aF1", "prot2_aF1", "tx1_aF1", "hom1_qCov", "hom1_tCov", "hom2_qCov", "hom2_tCov",
+	"rm_cov", "cpc", "kallisto1", "busco_proteins",
+]
+VALUES = ["0.0000"] * 8 + ["0.2500", "0.3000", "0.4000", "0.6000", "0.8000", "1.0000", "0.2999", "0.6123", "0.9000", "nan"]
+
+
+def input_paths(tmpdir):
+	paths = {name: os.path.join(tmpdir, name) for name in ("gff", "metrics_info", "short_cds", "tpm", "tsv", "npz")}
+	paths["tsv"], paths["npz"] = paths["tsv"] + ".tsv", paths["npz"] + ".npz"
+	return paths
+
+
+def write_inputs(tmpdir, n_transcripts, seed=42):
+	""" Transcripts of n_transcripts * 2 / 3 genes. Every 17th transcript is missing from the gff,
+	every 11th is an ncRNA and every 3rd has no expression data. """
+	rnd = random.Random(seed)
+	paths = input_paths(tmpdir)
+	tids = ["minos_t{:08d}".format(i) for i in range(n_transcripts)]
+	genes = [rnd.randrange(max(1, n_transcripts * 2 // 3)) for tid in tids]
+
+	with open(paths["gff"], "w") as gff_out:
+		print("##gff-version 3", file=gff_out)
+		for i, (tid, gene) in enumerate(zip(tids, genes)):
+			if i % 17:
+				ftype = "ncRNA" if i % 11 == 0 else "mRNA"
+				print("chr1", "minos", ftype, 1 + i, 100 + i, ".", "+", ".", "ID={0};Parent=minos_g{1};Name={0}".format(tid, gene), sep="\t", file=gff_out)
+
+	with open(paths["metrics_info"], "w") as info_out:
+		for metric_type, metric_id in METRICS_INFO:
+			print(metric_type, metric_id, "x", sep="\t", file=info_out)
+
+	with open(paths["short_cds"], "w") as cds_out, open(paths["tpm"], "w") as tpm_out:
+		print("target_id", "length", "eff_length", "est_counts", "tpm", sep="\t", file=tpm_out)
+		for i, tid in enumerate(tids):
+			print(tid, i % 2, sep="\t", file=cds_out)
+			if i % 3:
+				print(tid, 1000, 800, 10, (i % 7) * 0.5, sep="\t", file=tpm_out)
+
+	writer = MetricsMatrixWriter(METRICS_HEADER, tmpdir=tmpdir)
+	with open(paths["tsv"], "w") as tsv_out:
+		print(*METRICS_HEADER, sep="\t", file=tsv_out)
+		for tid in tids:
+			row = [tid] + [rnd.choice(VALUES) for col in METRICS_HEADER[1:]]
+			print(*row, sep="\t", file=tsv_out)
+			writer.add(row)
+	writer.write(paths["npz"])
+
+	return paths
+
+
+def run_collapser(tmpdir, fmt, engine, config, _out):
+	""" Runs one engine on the inputs in tmpdir and writes the collapsed metrics to _out.
+	Prints the wall-clock time (reading + aggregating + writing) and the peak memory of this process. """
+	with open(config) as config_in:
+		checks = yaml.safe_load(config_in)["collapse_metrics_thresholds"]
+	paths = input_paths(tmpdir)
+	t0 = time.perf_counter()
+	mc = MetricCollapser(paths["gff"], paths["metrics_info"], paths[fmt], paths["short_cds"], [paths["tpm"]], engine=engine)
+	with open(_out, "w") as collapsed_out:
+		mc.write_scores(checks, stream=collapsed_out)
+	print(time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024, sep="\t")
+
+
+def run_engine(tmpdir, fmt, engine, config):
+	""" Runs an engine in its own python process, so that the peak memory is that of this run only
+	(the inputs are also written by a separate process, as a child starts from the parent's peak).
+	Returns the time, the peak memory (MB) and the collapsed metrics file. """
+	_out = os.path.join(tmpdir, "collapsed.{}.{}.tsv".format(fmt, engine))
+	proc = subprocess.run(
+		[sys.executable, os.path.abspath(__file__), "--run", tmpdir, fmt, engine, "--config", config, "--output", _out],
+		stdout=subprocess.PIPE, universal_newlines=True, check=True
+	)
+	elapsed, maxrss = proc.stdout.split()
+	return float(elapsed), int(maxrss), _out
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Benchmarks collapse_metrics (python vs. numpy engine). Each engine runs in its own process.")
+	ap.add_argument("--transcripts", type=int, nargs="+", default=[100000, 1000000, 5000000], help="Number of transcripts (default: %(default)s).")
+	ap.add_argument("--config", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "minos_config.yaml"),
+		help="minos config providing collapse_metrics_thresholds (default: %(default)s).")
+	ap.add_argument("--run", type=str, nargs=3, metavar=("TMPDIR", "FORMAT", "ENGINE"), help=argparse.SUPPRESS)
+	ap.add_argument("--output", type=str, help=argparse.SUPPRESS)
+	ap.add_argument("--write-inputs", type=str, metavar="TMPDIR", help=argparse.SUPPRESS)
+	args = ap.parse_args()
+
+	if args.run is not None:
+		run_collapser(*args.run, args.config, args.output)
+		return
+	if args.write_inputs is not None:
+		write_inputs(args.write_inputs, args.transcripts[0])
+		return
+
+	print("transcripts", "matrix", "python", "numpy", "python maxrss", "numpy maxrss", sep="\t")
+	for n_transcripts in args.transcripts:
+		with tempfile.TemporaryDirectory() as tmpdir:
+			subprocess.run([sys.executable, os.path.abspath(__file__), "--write-inputs", tmpdir, "--transcripts", str(n_transcripts)], check=True)
+			for fmt in ("tsv", "npz"):
+				t_python, rss_python, out_python = run_engine(tmpdir, fmt, "python", args.config)
+				t_numpy, rss_numpy, out_numpy = run_engine(tmpdir, fmt, "numpy", args.config)
+				# compared on disk: a child starts from the peak memory of this process
+				if not filecmp.cmp(out_python, out_numpy, shallow=False):
+					raise ValueError("Error: python and numpy engine write different collapsed metrics for {} transcripts ({})".format(n_transcripts, fmt))
+				print(
+					n_transcripts, fmt, "{:.2f} s".format(t_python), "{:.2f} s".format(t_numpy),
+					"{} MB".format(rss_python), "{} MB".format(rss_numpy), sep="\t", flush=True
+				)
+
+
+if __name__ == "__main__":
+	main()
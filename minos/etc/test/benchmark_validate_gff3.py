@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+""" Benchmark of validate_gff3.validate_transcripts: sweep_containing_exons against the
+all-pairs CDS/UTR x exon scan it replaced. Checks that both report the same warnings. """
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from minos.scripts import validate_gff3
+
+
+def all_pairs_containing_exons(exons, features):
+	""" Reference: every feature is compared against every exon of the transcript. """
+	for start, end in features:
+		yield start, end, [(e_start, e_end) for e_start, e_end in exons if e_start <= start and end <= e_end]
+
+
+def write_gff(gff, n_genes, n_exons, seed=42):
+	""" Single-transcript genes with n_exons exons, CDS on the inner exons and UTRs on the first/last exon.
+	Some CDS are shifted so that the warnings are exercised too. """
+	rnd = random.Random(seed)
+	with open(gff, "w") as gff_out:
+		print("##gff-version 3", file=gff_out)
+		pos = 1
+		for g in range(n_genes):
+			strand = rnd.choice("+-")
+			exons = list()
+			for _ in range(n_exons):
+				start = pos + rnd.randint(50, 200)
+				exons.append((start, start + rnd.randint(50, 300)))
+				pos = exons[-1][1]
+			gid, tid = "gene{}".format(g), "gene{}.1".format(g)
+			row = "chr1\tbench\t{}\t{}\t{}\t.\t" + strand + "\t.\t{}"
+			print(row.format("gene", exons[0][0], exons[-1][1], "ID=" + gid), file=gff_out)
+			print(row.format("mRNA", exons[0][0], exons[-1][1], "ID={};Parent={}".format(tid, gid)), file=gff_out)
+			for i, (start, end) in enumerate(exons):
+				print(row.format("exon", start, end, "ID={}.exon{};Parent={}".format(tid, i, tid)), file=gff_out)
+			utr5, utr3 = ("five_prime_UTR", "three_prime_UTR") if strand == "+" else ("three_prime_UTR", "five_prime_UTR")
+			print(row.format(utr5, exons[0][0], exons[0][0] + 20, "Parent=" + tid), file=gff_out)
+			for i, (start, end) in enumerate(exons):
+				cds_start = exons[0][0] + 21 if i == 0 else start + rnd.choice((0, 0, 0, -5))
+				cds_end = exons[-1][1] - 21 if i == len(exons) - 1 else end
+				print(row.format("CDS", cds_start, cds_end, "ID={}.cds;Parent={}".format(tid, tid)), file=gff_out)
+			print(row.format(utr3, exons[-1][1] - 20, exons[-1][1], "Parent=" + tid), file=gff_out)
+			print("###", file=gff_out)
+
+
+def run_validation(gff, sweep):
+	validate_gff3.sweep_containing_exons = sweep
+	validator = validate_gff3.TranscriptDataValidator(gff)
+	output = io.StringIO()
+	t0 = time.perf_counter()
+	with contextlib.redirect_stdout(output):
+		validator.validate_transcripts()
+	return time.perf_counter() - t0, output.getvalue()
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Benchmarks validate_transcripts (sweep-line vs. all-pairs exon scan).")
+	ap.add_argument("--genes", type=int, default=200)
+	ap.add_argument("--exons", type=int, nargs="+", default=[100, 400, 1000], help="Exons per transcript (default: %(default)s).")
+	args = ap.parse_args()
+
+	sweep = validate_gff3.sweep_containing_exons
+	print("exons/transcript", "all-pairs", "sweep", sep="\t")
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for n_exons in args.exons:
+			gff = os.path.join(tmpdir, "bench.{}.gff3".format(n_exons))
+			write_gff(gff, args.genes, n_exons)
+			t_all_pairs, out_all_pairs = run_validation(gff, all_pairs_containing_exons)
+			t_sweep, out_sweep = run_validation(gff, sweep)
+			if out_all_pairs != out_sweep:
+				raise ValueError("Error: sweep and all-pairs scan report different warnings for {} exons/transcript".format(n_exons))
+			print(n_exons, "{:.2f} s".format(t_all_pairs), "{:.2f} s".format(t_sweep), sep="\t")
+	validate_gff3.sweep_containing_exons = sweep
+
+
+if __name__ == "__main__":
+	main()
@@ -10,7 +10,7 @@ MIKADO=/ei/software/cb/mikado/2.3.3/x86_64/mikado-2.3.3_CBG.img
 RUN_DIR=$1
 TPM_FOR_PICKING="--use-tpm-for-picking"
 
-etc=$(python -c "import pkg_resources; print(pkg_resources.resource_filename(\"minos\", \"etc\"))")
+etc=$(python -c "from eicore.snakemake_helper import ETC_DIR; print(ETC_DIR)")
 SCORING_TEMPLATE=${etc}/scoring_template.yaml
 HPC_CONFIG=${etc}/hpc_config.json
 INPUT_MODELS=list_gtf.txt
@@ -0,0 +1,33 @@
+#!/bin/bash -e
+
+# Start-up time of the minos cli (help and configure help).
+# Reports the wall-clock time per command and the slowest imports (python -X importtime),
+# fails if a command takes longer than MAX_MS (default 100) on average over RUNS (default 5) runs.
+
+MAX_MS=${MAX_MS:-100}
+RUNS=${RUNS:-5}
+PYTHON=${PYTHON:-python}
+
+status=0
+for cmd in "-h" "configure -h" "run -h"; do
+	total=0
+	for ((i = 0; i < RUNS; i++)); do
+		start=$(date +%s%N)
+		$PYTHON -m minos $cmd > /dev/null
+		total=$(( total + $(date +%s%N) - start ))
+	done
+	ms=$(( total / RUNS / 1000000 ))
+	echo "minos $cmd: ${ms} ms"
+	if [[ $ms -gt $MAX_MS ]]; then
+		status=1
+	fi
+done
+
+echo
+echo "slowest imports (cumulative us) for minos -h:"
+$PYTHON -X importtime -m minos -h 2>&1 > /dev/null | grep "^import time:" | sort -t "|" -k 2 -n -r | head -n 15
+
+if [[ $status -ne 0 ]]; then
+	echo "Start-up time above ${MAX_MS} ms."
+fi
+exit $status
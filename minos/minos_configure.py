@@ -82,7 +82,7 @@ class MinosRunConfiguration(dict):
 		self["data"] = {"transcript_models": {row[1]: row[0] for row in csv.reader(open(args.list_file), delimiter="\t")}}
 		self["data"].update(self.smm.get_scoring_data())
 		self.update(yaml.load(open(args.config_file), Loader=yaml.SafeLoader))
-		self["params"]["seqkit"]["codon_table"] = int(args.codon_table)
+		self["params"].setdefault("translate_cds", dict())["codon_table"] = int(args.codon_table)
 
 		with open(os.path.join(args.outdir, args.prefix + ".run_config.yaml"), "wt") as run_config_out:
 			yaml.dump(dict(self.items()), run_config_out, default_flow_style=False, sort_keys=False)
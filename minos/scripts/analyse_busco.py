@@ -10,7 +10,24 @@ def get_busco_categories(max_copy_number=4):
 	return ["Complete_{}{}".format(n, "+" if n == max_copy_number else "") for n in range(1, max_copy_number + 1)] + MAIN_CATEGORIES
 
 
+def read_full_table_rows(table_file):
+	""" Returns the (busco id, status, sequence id) rows of a busco full table. """
+	rows = list()
+	with open(table_file) as table_in:
+		for line in table_in:
+			if line[0] == "#":
+				continue
+			row = line.rstrip("\r\n").split("\t", 3)
+			if row[0]:
+				rows.append((row[0], row[1], row[2] if len(row) > 2 else ""))
+	return rows
+
+
 def read_full_table(table_file, tx2gene=None, is_pick=False, max_copy_number=4):
+	return summarise_full_table(read_full_table_rows(table_file), tx2gene=tx2gene, is_pick=is_pick, max_copy_number=max_copy_number)
+
+
+def summarise_full_table(rows, tx2gene=None, is_pick=False, max_copy_number=4):
 
 	def get_gene_id(seqid, tx2gene=None, is_pick=False):
 		if tx2gene is not None:
@@ -25,9 +42,7 @@ def read_full_table(table_file, tx2gene=None, is_pick=False, max_copy_number=4):
 
 	counts = Counter({cat: 0 for cat in get_busco_categories(max_copy_number=max_copy_number)})
 	complete, missing, fragmented = dict(), set(), dict()
-	for row in csv.reader(open(table_file), delimiter="\t"):
-		if not row or row[0].startswith("#"):
-			continue
+	for row in rows:
 		if row[1] in {"Missing", "Fragmented"}:
 			if row[1] == "Missing":
 				missing.add(row[0])
@@ -1,18 +1,131 @@
+import argparse
+import sys
 
-def split_fasta(fastafile, split_files):
-	out = None
-	for line in open(fastafile):
-		if line.startswith(">"):
-			matches = list({runid for runid in split_files if line[1:].startswith(runid)})
-			if not matches:
-				print("No matching output file for sequence " + line[1:].strip())
-				out = None
-				continue
-			if len(matches) > 1:
-				matches = sorted(matches, key=lambda x:len(x), reverse=True)
-			out = split_files[matches[0]]
-		if out is not None:
-			print(line, end="", file=out, flush=True)
-
-	for f in split_files.values():
-		f.close()
+from minos.scripts.fasta_index import FastaFile
+
+
+class PrefixTrie:
+	""" Character trie over the run ids, finds the longest run id a sequence id starts with in O(len(id)). """
+	_END = None
+
+	def __init__(self, prefixes=()):
+		self.root = dict()
+		for prefix in prefixes:
+			self.add(prefix)
+
+	def add(self, prefix):
+		node = self.root
+		for c in prefix:
+			node = node.setdefault(c, dict())
+		node[PrefixTrie._END] = prefix
+
+	def longest_prefix(self, s):
+		node = self.root
+		match = node.get(PrefixTrie._END)
+		for c in s:
+			node = node.get(c)
+			if node is None:
+				break
+			match = node.get(PrefixTrie._END, match)
+		return match
+
+
+class FastaDemultiplexer:
+	""" Sends each fasta record to the output of the longest run id its header starts with.
+	Output is collected per run and written in blocks of about buffer_size characters. """
+	def __init__(self, split_files, buffer_size=1 << 20):
+		self.split_files = split_files
+		self.trie = PrefixTrie(split_files)
+		self.buffer_size = buffer_size
+		self.buffers = {runid: list() for runid in split_files}
+		self.buffered = dict.fromkeys(split_files, 0)
+		self.runid = None
+		self._rest = ""
+
+	def select(self, header):
+		self.runid = self.trie.longest_prefix(header)
+		if self.runid is None:
+			print("No matching output file for sequence " + header.strip())
+
+	def write(self, text):
+		if self.runid is not None and text:
+			self.buffers[self.runid].append(text)
+			self.buffered[self.runid] += len(text)
+			if self.buffered[self.runid] >= self.buffer_size:
+				self.flush(self.runid)
+
+	def flush(self, runid):
+		self.split_files[runid].write("".join(self.buffers[runid]))
+		self.buffers[runid].clear()
+		self.buffered[runid] = 0
+
+	def feed(self, block):
+		""" Demultiplexes a block of a fasta stream, an incomplete last line is kept for the next block. """
+		data = self._rest + block
+		cut = data.rfind("\n") + 1
+		data, self._rest = data[:cut], data[cut:]
+		self._process(data)
+
+	def _process(self, data):
+		pos = 0
+		while pos < len(data):
+			if data.startswith(">", pos):
+				line_end = data.find("\n", pos)
+				self.select(data[pos + 1:line_end if line_end != -1 else len(data)])
+			next_header = data.find("\n>", pos)
+			end = next_header + 1 if next_header != -1 else len(data)
+			self.write(data[pos:end])
+			pos = end
+
+	def close(self):
+		if self._rest:
+			self._process(self._rest)
+			self._rest = ""
+		for runid, f in self.split_files.items():
+			self.flush(runid)
+			f.close()
+
+
+def split_fasta(fastafile, split_files, buffer_size=1 << 20, tee=None, block_size=1 << 22):
+	""" Splits a fasta file (or stdin: '-') by run id prefixes of the sequence ids into split_files ({runid: open file}).
+	Files are read through the fasta index, only the headers are parsed. From a stream, the input
+	can also be copied to tee, so that splitting can happen in the pass that produces the fasta. """
+	demux = FastaDemultiplexer(split_files, buffer_size=buffer_size)
+	if fastafile == "-":
+		while True:
+			block = sys.stdin.read(block_size)
+			if not block:
+				break
+			if tee is not None:
+				tee.write(block)
+			demux.feed(block)
+	else:
+		with FastaFile(fastafile) as fasta:
+			for i, start, end in fasta.iter_record_ranges():
+				demux.select(fasta.header(i))
+				demux.write(fasta.data[start:end].decode().replace("\r\n", "\n"))
+	demux.close()
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Splits a fasta file into one file per transcript model run, by the run id prefix of the sequence ids.")
+	ap.add_argument("input_fasta", type=str, help="Fasta file, '-' reads from stdin.")
+	ap.add_argument("--output", type=str, nargs="+", required=True, help="RUNID=PATH, sequences starting with RUNID (longest match) are written to PATH.")
+	ap.add_argument("--tee", type=str, help="Copy the input stream to this file.")
+	args = ap.parse_args()
+
+	split_files = dict()
+	for output in args.output:
+		runid, sep, path = output.partition("=")
+		if not sep:
+			raise ValueError("Error: Outputs have to be given as RUNID=PATH, got " + output)
+		split_files[runid] = open(path, "w")
+
+	tee = open(args.tee, "w") if args.tee else None
+	split_fasta(args.input_fasta, split_files, tee=tee)
+	if tee is not None:
+		tee.close()
+
+
+if __name__ == "__main__":
+	main()
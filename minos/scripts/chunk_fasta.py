@@ -0,0 +1,190 @@
+import argparse
+import bisect
+import hashlib
+import math
+import os
+import shutil
+
+from collections import namedtuple
+
+
+FastaRecord = namedtuple("FastaRecord", ["seqid", "offset", "end", "residues", "digest"])
+
+
+def scan_fasta(fasta, digest=False):
+	""" Returns the records of a fasta file in file order, with their byte ranges and residue counts.
+	With digest=True, each record also carries a hash of its sequence. """
+	records = list()
+	seqid, offset, residues, seq_hash, pos = None, None, 0, None, 0
+	with open(fasta, "rb") as fasta_in:
+		for line in fasta_in:
+			if line[:1] == b">":
+				if offset is not None:
+					records.append(FastaRecord(seqid, offset, pos, residues, seq_hash.digest() if digest else None))
+				header = line[1:].split(None, 1)
+				seqid, offset, residues = header[0].decode() if header else "", pos, 0
+				seq_hash = hashlib.blake2b(digest_size=16) if digest else None
+			elif offset is not None:
+				seq = line.strip()
+				residues += len(seq)
+				if digest:
+					seq_hash.update(seq)
+			pos += len(line)
+	if offset is not None:
+		records.append(FastaRecord(seqid, offset, pos, residues, seq_hash.digest() if digest else None))
+	return records
+
+
+def deduplicate_records(records):
+	""" Keeps the first record of each distinct sequence.
+	Returns the unique records and {seqid of kept record: [seqids of its duplicates]}. """
+	unique, duplicates, first_seen = list(), dict(), dict()
+	for record in records:
+		kept = first_seen.get(record.digest)
+		if kept is None:
+			first_seen[record.digest] = record.seqid
+			unique.append(record)
+		else:
+			duplicates.setdefault(kept, list()).append(record.seqid)
+	return unique, duplicates
+
+
+def split_records(records, n_chunks=None, residues_per_chunk=None):
+	""" Splits the records into contiguous groups of roughly equal residue counts.
+	Either the number of chunks or the target number of residues per chunk has to be given.
+	Returns (first, last + 1) record index pairs. """
+	if not records:
+		return list()
+	total = sum(record.residues for record in records)
+	if not n_chunks:
+		if not residues_per_chunk:
+			raise ValueError("Error: Either the number of chunks or the number of residues per chunk needs to be set.")
+		n_chunks = math.ceil(total / residues_per_chunk)
+	n_chunks = max(1, min(n_chunks, len(records)))
+
+	cumulative, running = list(), 0
+	for record in records:
+		running += record.residues
+		cumulative.append(running)
+
+	chunks, first = list(), 0
+	for k in range(1, n_chunks + 1):
+		if k == n_chunks:
+			last = len(records)
+		else:
+			target = total * k / n_chunks
+			# end the chunk at the record closest to the target, leaving at least one record for each remaining chunk
+			last = bisect.bisect_left(cumulative, target) + 1
+			if last > first + 1 and target - cumulative[last - 2] < cumulative[last - 1] - target:
+				last -= 1
+			last = max(first + 1, min(last, len(records) - (n_chunks - k)))
+		chunks.append((first, last))
+		first = last
+	return chunks
+
+
+def copy_range(fasta_in, out, start, end, block_size=1 << 20):
+	fasta_in.seek(start)
+	remaining = end - start
+	while remaining > 0:
+		block = fasta_in.read(min(block_size, remaining))
+		if not block:
+			break
+		out.write(block)
+		remaining -= len(block)
+
+
+def copy_records(fasta_in, out, records):
+	""" Copies the records, adjacent records are copied as one byte range. """
+	start, end = None, None
+	for record in records:
+		if record.offset != end:
+			if start is not None:
+				copy_range(fasta_in, out, start, end)
+			start = record.offset
+		end = record.end
+	if start is not None:
+		copy_range(fasta_in, out, start, end)
+
+
+def write_chunks(fasta, outdir, chunks, records, manifest=None, duplicates=None, prefix="chunk-"):
+	""" Writes the chunks to <outdir>/<prefix><i>.txt (i = 1, 2, ...) and lists them in a manifest
+	(chunk, path, sequences, residues, duplicates). If duplicates are given, the duplicates of the
+	sequences in each chunk are written to <outdir>/<prefix><i>.duplicates.tsv (seqid, duplicate seqid). """
+	manifest = manifest if manifest is not None else os.path.join(outdir, "manifest.tsv")
+	os.makedirs(outdir, exist_ok=True)
+	with open(fasta, "rb") as fasta_in, open(manifest, "w") as manifest_out:
+		print("#chunk", "path", "sequences", "residues", "duplicates", sep="\t", file=manifest_out)
+		for i, (first, last) in enumerate(chunks, start=1):
+			path = os.path.join(outdir, "{}{}.txt".format(prefix, i))
+			with open(path, "wb") as chunk_out:
+				copy_records(fasta_in, chunk_out, records[first:last])
+			n_duplicates = 0
+			if duplicates is not None:
+				with open(os.path.join(outdir, "{}{}.duplicates.tsv".format(prefix, i)), "w") as duplicates_out:
+					for record in records[first:last]:
+						for seqid in duplicates.get(record.seqid, list()):
+							print(record.seqid, seqid, sep="\t", file=duplicates_out)
+							n_duplicates += 1
+			residues = sum(record.residues for record in records[first:last])
+			print(i, path, last - first, residues, n_duplicates, sep="\t", file=manifest_out)
+
+
+def read_chunk_manifest(manifest):
+	""" Returns the chunk ids listed in a chunk manifest. """
+	with open(manifest) as manifest_in:
+		return [line.split("\t")[0] for line in manifest_in if line.strip() and line[0] != "#"]
+
+
+def concatenate_files(files, _out, remove_input=False, keep_header=False):
+	""" Concatenates (chunked) outputs into _out. The data is copied in-kernel (sendfile) where possible.
+	With keep_header=True, the first line is only kept from the first non-empty file. """
+	header_written = False
+	with open(_out, "wb") as concat_out:
+		for f in files:
+			with open(f, "rb") as f_in:
+				start = len(f_in.readline()) if keep_header and header_written else 0
+				size, copied = os.fstat(f_in.fileno()).st_size, start
+				header_written = header_written or size > 0
+				try:
+					while copied < size:
+						sent = os.sendfile(concat_out.fileno(), f_in.fileno(), copied, size - copied)
+						if sent == 0:
+							break
+						copied += sent
+				except (AttributeError, OSError):
+					if copied > start:
+						raise
+				if copied == start:
+					f_in.seek(start)
+					shutil.copyfileobj(f_in, concat_out)
+					concat_out.flush()
+			if remove_input:
+				os.remove(f)
+
+
+def chunk_fasta(fasta, outdir, n_chunks=None, residues_per_chunk=None, manifest=None, deduplicate=False):
+	records = scan_fasta(fasta, digest=deduplicate)
+	duplicates = None
+	if deduplicate:
+		records, duplicates = deduplicate_records(records)
+	chunks = split_records(records, n_chunks=n_chunks, residues_per_chunk=residues_per_chunk)
+	write_chunks(fasta, outdir, chunks, records, manifest=manifest, duplicates=duplicates)
+	return chunks
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Splits a fasta file into chunks of roughly equal numbers of residues.")
+	ap.add_argument("input_fasta", type=str)
+	ap.add_argument("outdir", type=str)
+	ap.add_argument("--n-chunks", type=int, default=0, help="Number of chunks.")
+	ap.add_argument("--residues-per-chunk", type=int, default=0, help="Target number of residues per chunk (used if --n-chunks is not set).")
+	ap.add_argument("--manifest", type=str, help="Path of the chunk manifest [<outdir>/manifest.tsv].")
+	ap.add_argument("--deduplicate", action="store_true", help="Only write the first of identical sequences to the chunks and list the others in <outdir>/chunk-<i>.duplicates.tsv.")
+	args = ap.parse_args()
+
+	chunk_fasta(args.input_fasta, args.outdir, n_chunks=args.n_chunks, residues_per_chunk=args.residues_per_chunk, manifest=args.manifest, deduplicate=args.deduplicate)
+
+
+if __name__ == "__main__":
+	main()
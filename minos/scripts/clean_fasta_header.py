@@ -5,34 +5,62 @@ Script to clean fasta header
 """
 
 # import libraries
+import re
 import sys
 import argparse
 
+from minos.scripts.fasta_index import FastaFile
+
+
+TRAILING_WHITESPACE = re.compile(rb"[ \t\r\f\v]+(?=\n)")
+
 
 class CleanFastaHeader(object):
     def __init__(self, args):
         self.args = args
 
+    def clean_header(self, line):
+        x = line.split(" ")
+        header = x[0]
+        if self.args.add_fields:
+            cols = (y.strip()
+                    for y in self.args.add_fields.split(","))
+            header = header + " " + \
+                " ".join(
+                    i for j in cols for i in x if i.lower().startswith(j.lower()))
+        if self.args.add_columns:
+            cols = (int(y.strip()) -
+                    1 for y in self.args.add_columns.split(","))
+            header = header + " " + " ".join(x[z] for z in cols)
+        return header
+
     def clean_fasta_header(self):
+        if self.args.fasta is not sys.stdin:
+            self.clean_indexed_fasta()
+            return
         for line in self.args.fasta:
             line = line.rstrip()
             if line.startswith(">"):
-                x = line.split(" ")
-                header = x[0]
-                if self.args.add_fields:
-                    cols = (y.strip()
-                            for y in self.args.add_fields.split(","))
-                    header = header + " " + \
-                        " ".join(
-                            i for j in cols for i in x if i.lower().startswith(j.lower()))
-                if self.args.add_columns:
-                    cols = (int(y.strip()) -
-                            1 for y in self.args.add_columns.split(","))
-                    header = header + " " + " ".join(x[z] for z in cols)
-                print(f"{header}")
+                print(f"{self.clean_header(line)}")
             else:
                 print(line)
 
+    def clean_indexed_fasta(self):
+        # only the header lines are parsed, sequence lines are copied from the memory-mapped file
+        out = sys.stdout.buffer
+        with FastaFile(self.args.fasta.name) as fasta:
+            ranges = list(fasta.iter_record_ranges())
+            prefix = fasta.data[:ranges[0][1]] if ranges else fasta.data[:]
+            for line in prefix.decode().splitlines():
+                out.write((line.rstrip() + "\n").encode())
+            for i, start, end in ranges:
+                out.write((self.clean_header(">" + fasta.header(i).rstrip()) + "\n").encode())
+                seq = fasta.data[fasta.records[i].offset:end]
+                if seq and not seq.endswith(b"\n"):
+                    seq += b"\n"
+                out.write(TRAILING_WHITESPACE.sub(b"", seq))
+        out.flush()
+
     def run(self):
         self.clean_fasta_header()
 
@@ -1,6 +1,15 @@
 import argparse
 import sys
 import csv
+import re
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+
+from minos.scripts.gff_reader import read_gff
+from minos.scripts.metrics_matrix import MetricsMatrix
+from minos.scripts.tpm_matrix import TpmMatrix
 
 SCORES = [
 	"protein_score",
@@ -18,12 +27,30 @@ SCORES = [
 # 3 + 9 * 2 + 5 = 26
 HEADER = ["#transcript", "gene", "alias"] + SCORES + [s + "_gene" for s in SCORES] + ["confidence", "repeat_associated", "biotype", "discard", "region"]
 
+def all_of(results):
+	return np.logical_and.reduce(list(results))
+
+
+def any_of(results):
+	return np.logical_or.reduce(list(results))
+
+
+def none_of(results):
+	return np.logical_not(any_of(results))
+
+
 def check_expression(expression, values):
+	""" Evaluates an expression tree as returned by parse_expression.
+	values can hold scalars or (numpy) columns, in which case the result is a boolean column. """
 	def cmp_score(a, b, op):
 		if op == "eq":
 			return a == b
+		if op == "ne":
+			return a != b
 		if op == "lt":
 			return a < b
+		if op == "le":
+			return a <= b
 		if op == "gt":
 			return a > b
 		if op == "ge":
@@ -32,7 +59,7 @@ def check_expression(expression, values):
 
 	if type(expression[0]) is str:
 		a, b, op = expression
-		expression = (values[a], b, op)
+		expression = (values[a], values[b] if type(b) is str else b, op)
 		return cmp_score(*expression)
 	operator = expression[0]
 	return operator(
@@ -40,55 +67,142 @@ def check_expression(expression, values):
 	)
 
 
+EXPRESSION_TOKENS = re.compile(r"\s*(?:\{(\w+)\}|(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|(==|!=|<=|>=|<|>)|([()])|(and|or|not|True|False)\b)")
+COMPARISONS = {"==": "eq", "!=": "ne", "<": "lt", "<=": "le", ">": "gt", ">=": "ge"}
+FLIPPED_COMPARISONS = {"eq": "eq", "ne": "ne", "lt": "gt", "le": "ge", "gt": "lt", "ge": "le"}
+
+
+def parse_expression(expression):
+	""" Parses a threshold expression from the config ("{te_score} >= 0.4 and not {is_complete}")
+	into an expression tree for check_expression. Supports and/or/not, parentheses and
+	(chained) comparisons between metrics and numeric or True/False constants. """
+	tokens, pos = list(), 0
+	expression = expression.strip()
+	while pos < len(expression):
+		match = EXPRESSION_TOKENS.match(expression, pos)
+		if match is None or match.end() == pos:
+			raise ValueError("Error: Cannot parse expression '{}' at position {}".format(expression, pos))
+		metric, number, comparison, paren, keyword = match.groups()
+		if metric is not None:
+			tokens.append(("metric", metric))
+		elif number is not None:
+			tokens.append(("value", float(number)))
+		elif keyword in {"True", "False"}:
+			tokens.append(("value", keyword == "True"))
+		else:
+			tokens.append(("op", comparison or paren or keyword))
+		pos = match.end()
+	tokens.append(("end", None))
+
+	def peek():
+		return tokens[0]
+
+	def take(expected=None):
+		token = tokens.pop(0)
+		if expected is not None and token != ("op", expected):
+			raise ValueError("Error: Cannot parse expression '{}', expected '{}'".format(expression, expected))
+		return token
+
+	def parse_or():
+		terms = [parse_and()]
+		while peek() == ("op", "or"):
+			take()
+			terms.append(parse_and())
+		return terms[0] if len(terms) == 1 else (any_of, *terms)
+
+	def parse_and():
+		terms = [parse_not()]
+		while peek() == ("op", "and"):
+			take()
+			terms.append(parse_not())
+		return terms[0] if len(terms) == 1 else (all_of, *terms)
+
+	def parse_not():
+		if peek() == ("op", "not"):
+			take()
+			return (none_of, parse_not())
+		return parse_comparison()
+
+	def parse_operand():
+		token = take()
+		if token[0] not in {"metric", "value"}:
+			raise ValueError("Error: Cannot parse expression '{}', unexpected '{}'".format(expression, token[1]))
+		return token
+
+	def compare(a, b, op):
+		if a[0] == "metric":
+			return (a[1], b[1], op)
+		if b[0] == "metric":
+			return (b[1], a[1], FLIPPED_COMPARISONS[op])
+		raise ValueError("Error: Cannot parse expression '{}', comparison without metric".format(expression))
+
+	def parse_comparison():
+		if peek() == ("op", "("):
+			take()
+			tree = parse_or()
+			take(")")
+			return tree
+		operands, ops = [parse_operand()], list()
+		while peek()[0] == "op" and peek()[1] in COMPARISONS:
+			ops.append(COMPARISONS[take()[1]])
+			operands.append(parse_operand())
+		if not ops:
+			# bare metric, truth test
+			if operands[0][0] != "metric":
+				raise ValueError("Error: Cannot parse expression '{}', constant without comparison".format(expression))
+			return (operands[0][1], 0, "ne")
+		# chained comparisons (0 < {x} <= 5) are conjunctions
+		terms = [compare(a, b, op) for a, b, op in zip(operands, operands[1:], ops)]
+		return terms[0] if len(terms) == 1 else (all_of, *terms)
+
+	tree = parse_or()
+	if peek()[0] != "end":
+		raise ValueError("Error: Cannot parse expression '{}', unexpected '{}'".format(expression, peek()[1]))
+	return tree
+
+
+def get_expression_metrics(expression):
+	if type(expression[0]) is str:
+		return {expression[0]} | ({expression[1]} if type(expression[1]) is str else set())
+	return set().union(*(get_expression_metrics(exp) for exp in expression[1:]))
+
+
 class TranscriptData(dict):
 	def __init__(self, gff):
 		try:
-			for row in csv.reader(open(gff), delimiter="\t"):
-				if not row[0].startswith("#"):
-					ftype = row[2].strip().lower()
-					if ftype in {"mrna", "ncrna"}:
-						attrib = dict(item.split("=") for item in row[8].strip("; ").split(";"))
-
-						if any(map(lambda x: x is None, (attrib.get("ID"), attrib.get("Parent"), attrib.get("Name")))):
-							raise ValueError("Error: Cannot parse all variables (ID, Parent, Name). Please check entry:\n{}\n".format("\t".join(row)))
-
-						if self.get(attrib["Name"]) is not None:
-							raise ValueError("Error: Potential duplicate entry. Transcript '{}' already processed. Please check.\n{}\n".format(attrib["Name"], "\t".join(row)))
-
-						start, end = map(int, row[3:5])
-						start, end = (start, end) if start < end else (end, start)
-
-						self[attrib["Name"]] = {
-							"id": attrib["ID"],
-							"parent": attrib["Parent"],
-							"alias": attrib["Name"],
-							"region": "{}:{}..{}".format(row[0], start, end),
-							"type": ftype
-						}
+			for feature in read_gff(gff, feature_types={"mRNA", "ncRNA", "mrna", "ncrna"}):
+				ftype = feature.type.strip().lower()
+				if ftype in {"mrna", "ncrna"}:
+					attrib = feature.attributes
+
+					if any(map(lambda x: x is None, (attrib.get("ID"), attrib.get("Parent"), attrib.get("Name")))):
+						raise ValueError("Error: Cannot parse all variables (ID, Parent, Name). Please check entry:\n{}\n".format(feature))
+
+					if self.get(attrib["Name"]) is not None:
+						raise ValueError("Error: Potential duplicate entry. Transcript '{}' already processed. Please check.\n{}\n".format(attrib["Name"], feature))
+
+					start, end = feature.get_coords()
+
+					self[attrib["Name"]] = {
+						"id": attrib["ID"],
+						"parent": attrib["Parent"],
+						"alias": attrib["Name"],
+						"region": "{}:{}..{}".format(feature.seqid, start, end),
+						"type": ftype
+					}
 		except FileNotFoundError:
 			raise FileNotFoundError("Cannot find input gff at " + gff)
 
 class ExpressionData(dict):
-	def read_kallisto(self, tsv):
-		for row in csv.DictReader(open(tsv), delimiter="\t"):
-			prev_tpm = self.get(row["target_id"], 0.0)
-			try:
-				tpm = float(row["tpm"])
-			except:
-				tpm = 0.0
-			self[row["target_id"]] = max(prev_tpm, tpm)
-
-	def __init__(self, *expression_data_files):
-		files_imported = 0
-		for f in expression_data_files:
-			try:
-				self.read_kallisto(f)
-			except FileNotFoundError:
-				print("Warning: could not find kallisto data file at " + f)
-			else:
-				files_imported += 1
-
-		if files_imported == 0:
+	""" Highest tpm per transcript over all kallisto runs. The transcripts x runs
+	tpm matrix is kept as self.tpm (TpmMatrix: max, mean, count_over). """
+	def __init__(self, *expression_data_files, threads=1):
+		self.tpm = TpmMatrix(*expression_data_files, threads=threads)
+		for f in self.tpm.missing:
+			print("Warning: could not find kallisto data file at " + f)
+		self.update(zip(self.tpm.target_ids, self.tpm.max().tolist()))
+
+		if not self.tpm.runs:
 			print("Warning: No kallisto data processed. Assigning kallisto scores to 0.0")
 
 class TranscriptScores:
@@ -110,6 +224,54 @@ class TranscriptScores:
 		self.busco_score = float(metrics["busco_proteins"])
 
 
+# gene scores take the lowest transcript value for these, the highest for all others
+GENE_MIN_SCORES = {"te_score", "short_cds"}
+
+
+def read_matrix_columns(matrix, columns, chunk_size=100000):
+	""" Loads the transcript ids and the requested columns (as float arrays) of the metrics matrix tsv/npz. """
+	columns = tuple(columns)
+	if matrix.endswith(".npz"):
+		metrics = MetricsMatrix(matrix)
+		missing = [col for col in columns if col not in metrics.columns]
+		if missing:
+			raise KeyError(missing[0])
+		return metrics.tids, ["tid"] + metrics.columns, {col: metrics.column(col) for col in columns}
+
+	with open(matrix) as matrix_in:
+		reader = csv.reader(matrix_in, delimiter="\t")
+		header = next(reader)
+		missing = [col for col in ("tid",) + columns if col not in header]
+		if missing:
+			raise KeyError(missing[0])
+		get_columns = itemgetter(*(header.index(col) for col in ("tid",) + columns))
+		tids, chunks = list(), {col: list() for col in columns}
+		while True:
+			rows = [get_columns(row) for row in islice(reader, chunk_size)]
+			if not rows:
+				break
+			values = list(zip(*rows))
+			tids.extend(values[0])
+			for col, col_values in zip(columns, values[1:]):
+				chunks[col].append(np.fromiter(map(float, col_values), dtype=float, count=len(col_values)))
+
+	return tids, header, {col: np.concatenate(chunks[col]) if chunks[col] else np.zeros(0) for col in columns}
+
+
+def first_extreme_rows(values, order, starts, use_min=False):
+	""" For each group (rows order[starts[i]:starts[i + 1]]) returns the row that a sequential
+	max() (or min()) over the group in row order ends up with: the first row holding the extreme value,
+	nan values are skipped unless the group starts with nan. """
+	grouped = values[order]
+	extreme = (np.fmin if use_min else np.fmax).reduceat(grouped, starts)
+	positions = np.arange(len(grouped))
+	group_sizes = np.diff(np.append(starts, len(grouped)))
+	is_extreme = grouped == np.repeat(extreme, group_sizes)
+	selected = np.minimum.reduceat(np.where(is_extreme, positions, len(grouped)), starts)
+	selected = np.where(np.isnan(grouped[starts]) | (selected == len(grouped)), starts, selected)
+	return order[selected]
+
+
 class MetricCollapser:
 	def read_metrics_info(self, tsv):
 		self.metrics_info = dict()
@@ -120,9 +282,38 @@ class MetricCollapser:
 		except FileNotFoundError:
 			raise FileNotFoundError("Cannot find metrics info at " + tsv)
 
+	def get_score_columns(self):
+		""" The metrics matrix columns that the transcript scores are computed from, per score. """
+		return [
+			("protein_score", [m + "_aF1" for m in self.metrics_info.get("mikado.protein", set())]),
+			("transcript_score", [m + "_aF1" for m in self.metrics_info.get("mikado.transcript", set())]),
+			("hom_qcov_score", [m + "_qCov" for m in self.metrics_info.get("blast", set())]),
+			("hom_tcov_score", [m + "_tCov" for m in self.metrics_info.get("blast", set())]),
+			("te_score", [m + "_cov" for m in self.metrics_info.get("repeat", set())]),
+		]
+
+	def iter_npz_metrics(self, matrix):
+		""" Yields the score columns of the transcripts in the gff as dicts, in matrix order.
+		Only these rows of the required columns are read from the memory mapped matrix. """
+		metrics = MetricsMatrix(matrix)
+		columns = sorted({col for score, cols in self.get_score_columns() for col in cols} | {"cpc", "busco_proteins"})
+		missing = [col for col in columns if col not in metrics.columns]
+		if missing:
+			raise KeyError(missing[0])
+		rows = [i for i, tid in enumerate(metrics.tids) if tid in self.transcripts_data]
+		values = [metrics.column(col, rows=rows).tolist() for col in columns]
+		for i, row_values in zip(rows, zip(*values)):
+			row = dict(zip(columns, row_values))
+			row["tid"] = metrics.tids[i]
+			yield row
+
 	def read_metrics(self, matrix):
 		try:
-			for metrics in csv.DictReader(open(matrix), delimiter="\t"):
+			if matrix.endswith(".npz"):
+				rows = self.iter_npz_metrics(matrix)
+			else:
+				rows = csv.DictReader(open(matrix), delimiter="\t")
+			for metrics in rows:
 				tdata = self.transcripts_data.get(metrics["tid"])
 				# print(metrics["tid"], metrics["tid"] in self.transcripts_data)
 				if tdata is not None:
@@ -154,51 +345,152 @@ class MetricCollapser:
 		except FileNotFoundError:
 			raise FileNotFoundError("Cannot find metrics matrix at " + matrix)
 
-	def __init__(self, gff, metrics_info, metrics_matrix, short_cds, expression_data):
+	def read_metrics_columnar(self, matrix):
+		""" Same result as read_metrics, but transcript scores are computed as numpy columns
+		and gene scores are reduced per gene (reduceat over the transcripts grouped by gene).
+		Python's max()/min() keep the first of equal values (e.g. int 0 vs 0.0), so the reductions
+		select the row holding the gene value and the transcript's value is reported as is. """
+		score_metrics = self.get_score_columns()
+		columns = {col for score, cols in score_metrics for col in cols} | {"cpc", "busco_proteins"}
+		try:
+			tids, header, data = read_matrix_columns(matrix, sorted(columns))
+		except FileNotFoundError:
+			raise FileNotFoundError("Cannot find metrics matrix at " + matrix)
+
+		rows, tdata_rows, seen = list(), list(), set()
+		for i, tid in enumerate(tids):
+			tdata = self.transcripts_data.get(tid)
+			if tdata is not None:
+				if tid in seen or tid in self.model_info:
+					raise ValueError("Error: Potential duplicate entry. Transcript '{}' already processed. Please check.\n{}\n".format(tid, "\t".join(header)))
+				seen.add(tid)
+				rows.append(i)
+				tdata_rows.append(tdata)
+		if not rows:
+			return
+		rows = np.array(rows)
+
+		expression_scores = [self.expression_data.get(tdata["id"], 0.0) for tdata in tdata_rows]
+		for tdata, kallisto_score in zip(tdata_rows, expression_scores):
+			if kallisto_score is None:
+				raise ValueError("Error: Could not extract tpm data for transcript {} ({})".format(tdata["alias"], tdata["id"]))
+
+		# (values, python objects) per score, in TranscriptScores order
+		scores = dict()
+		scores["classification"] = (np.zeros(len(rows)), [0] * len(rows))
+		short_cds = [self.short_cds[tdata["id"]] for tdata in tdata_rows]
+		scores["short_cds"] = (np.array(short_cds, dtype=float), short_cds)
+		scores["expression_score"] = (np.array(expression_scores, dtype=float), expression_scores)
+		for score, cols in score_metrics:
+			# max([0] + values): nan never wins and anything not above 0 leaves the int 0
+			values = np.fmax.reduce([np.zeros(len(rows))] + [data[col][rows] for col in cols])
+			scores[score] = (values, [value if value > 0 else 0 for value in values.tolist()])
+		hom_acov = (scores["hom_qcov_score"][0] + scores["hom_tcov_score"][0]) / 2.0
+		scores["hom_acov_score"] = (hom_acov, hom_acov.tolist())
+		for score, col in (("cpc_score", "cpc"), ("busco_score", "busco_proteins")):
+			values = data[col][rows]
+			scores[score] = (values, values.tolist())
+		score_order = ["classification", "short_cds", "expression_score", "protein_score", "transcript_score", "hom_qcov_score", "hom_tcov_score", "hom_acov_score", "te_score", "cpc_score", "busco_score"]
+
+		gene_index = dict()
+		gene_rows = np.array([gene_index.setdefault(tdata["parent"], len(gene_index)) for tdata in tdata_rows])
+		order = np.argsort(gene_rows, kind="stable")
+		starts = np.flatnonzero(np.diff(gene_rows[order], prepend=-1))
+
+		score_objects = [scores[score][1] for score in score_order]
+		for tid, tdata, tscores in zip(map(tids.__getitem__, rows.tolist()), tdata_rows, zip(*score_objects)):
+			tinfo = self.model_info[tid] = dict(tdata)
+			tinfo["gene"] = tinfo.pop("parent")
+			tinfo["tid"] = tid
+			tinfo.update(zip(score_order, tscores))
+
+		gene_scores = dict()
+		for score in score_order:
+			values, objects = scores[score]
+			gene_scores[score] = [objects[row] for row in first_extreme_rows(values, order, starts, use_min=score in GENE_MIN_SCORES).tolist()]
+		for gid, ginfo in zip(gene_index, zip(*(gene_scores[score] for score in score_order))):
+			self.gene_info[gid] = dict(zip(score_order, ginfo))
+
+	def __init__(self, gff, metrics_info, metrics_matrix, short_cds, expression_data, engine="python", threads=1):
 		self.read_metrics_info(metrics_info)
 		self.transcripts_data = TranscriptData(gff)
-		self.expression_data = ExpressionData(*expression_data)
+		self.expression_data = ExpressionData(*expression_data, threads=threads)
 		self.short_cds = dict((row[0], int(row[1])) for row in csv.reader(open(short_cds), delimiter="\t"))
 
 		self.model_info, self.gene_info = dict(), dict()
-		self.read_metrics(metrics_matrix)
+		if engine == "numpy":
+			self.read_metrics_columnar(metrics_matrix)
+		elif engine == "python":
+			self.read_metrics(metrics_matrix)
+		else:
+			raise ValueError("Error: Unknown engine '{}', use 'python' or 'numpy'".format(engine))
+
+	def evaluate_checks(self, checks):
+		""" Evaluates each threshold expression once over the gene-level score columns.
+		Returns {check: {gene: result}}. """
+		expressions = {check: parse_expression(expression) for check, expression in checks.items()}
+		gene_ids = list(self.gene_info)
+		columns = dict()
+		for check, expression in expressions.items():
+			for metric in get_expression_metrics(expression):
+				if metric not in columns:
+					try:
+						columns[metric] = np.array([self.gene_info[gid][metric] for gid in gene_ids], dtype=float)
+					except KeyError:
+						raise ValueError("Error: Unknown metric '{}' in {} check '{}'".format(metric, check, checks[check]))
+
+		return {
+			check: dict(zip(gene_ids, np.broadcast_to(check_expression(expression, columns), len(gene_ids)).tolist()))
+			for check, expression in expressions.items()
+		}
 
 	def write_scores(self, checks, stream=sys.stdout):
 		print(*HEADER, sep="\t", file=stream)
 
+		gene_checks = self.evaluate_checks(checks)
+		# gene scores and checks are shared by all transcripts of a gene, only format them once
+		gene_rows = dict()
+
 		for tid, tinfo in sorted(self.model_info.items(), key=lambda x:x[0]):
-			row = [tinfo["id"], tinfo["gene"], tinfo["alias"]]
-			row.extend(tinfo.get(score, ".") for score in SCORES)
 			gid = tinfo["gene"]
-			gene_scores = list(
-				self.gene_info.get(gid, dict()).get(score, ".") for score in SCORES
-			)
-			if any(score == "." for score in gene_scores):
-				raise ValueError("Error: Cannot find all gene scores:\n{}".format("\n".join(zip(SCORES, gene_scores))))
-			row.extend(gene_scores)
-
-			biotype = "protein_coding_gene"
-			repeat_associated = eval(checks["repeat_associated"].format(**self.gene_info[gid]))
-			if repeat_associated:
-				biotype = "transposable_element_gene"
-			elif eval(checks["predicted_gene"].format(**self.gene_info[gid])):
-				biotype = "predicted_gene"
-
-			high_confidence = eval(checks["hi_confidence"].format(**self.gene_info[gid]))
-			discard = eval(checks["discard"].format(**self.gene_info[gid]))
-
+			gene_row = gene_rows.get(gid)
+			if gene_row is None:
+				gene_scores = list(
+					self.gene_info.get(gid, dict()).get(score, ".") for score in SCORES
+				)
+				if any(score == "." for score in gene_scores):
+					raise ValueError("Error: Cannot find all gene scores:\n{}".format("\n".join(zip(SCORES, gene_scores))))
+
+				biotype = "protein_coding_gene"
+				repeat_associated = gene_checks["repeat_associated"][gid]
+				if repeat_associated:
+					biotype = "transposable_element_gene"
+				elif gene_checks["predicted_gene"][gid]:
+					biotype = "predicted_gene"
+
+				gene_row = gene_rows[gid] = (
+					"\t".join(map(str, gene_scores)),
+					gene_checks["hi_confidence"][gid],
+					str(repeat_associated),
+					biotype,
+					str(gene_checks["discard"][gid])
+				)
+
+			gene_scores, high_confidence, repeat_associated, biotype, discard = gene_row
 			if tinfo["type"] == "ncrna":
 				high_confidence, biotype = False, "predicted_gene"
 
-			row.extend([
+			print(
+				tinfo["id"], tinfo["gene"], tinfo["alias"],
+				*(tinfo.get(score, ".") for score in SCORES),
+				gene_scores,
 				"High" if high_confidence else "Low",
-				str(repeat_associated),
+				repeat_associated,
 				biotype,
-				str(discard),
-				tinfo["region"]
-			])
-
-			print(*row, sep="\t", file=stream)
+				discard,
+				tinfo["region"],
+				sep="\t", file=stream
+			)
 
 
 def main():
@@ -2,8 +2,16 @@ import sys
 import os
 import argparse
 import csv
+import io
+import itertools
+import multiprocessing
+import shutil
+import tempfile
 from collections import Counter
 
+from minos.scripts.gff_index import GffIndex
+from minos.scripts.gff_reader import read_gff
+
 class GffReleaseGenerator():
 	def __init__(self, metrics_tsv):
 		try:
@@ -34,11 +42,70 @@ class GffReleaseGenerator():
 	gff_header = ["seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes"]
 	valid_feature_types = {"gene", "mRNA", "exon", "CDS", "five_prime_UTR", "three_prime_UTR"}
 	
-	def process_gff(self, raw_gff, name_prefix="XYZ_v1", file_prefix="mikado.annotation"):
+	def process_gff(self, raw_gff, name_prefix="XYZ_v1", file_prefix="mikado.annotation", threads=1):
+
+		out_release = os.path.join(os.path.dirname(raw_gff), file_prefix + ".release.unsorted.gff3")
+		out_browser = os.path.join(os.path.dirname(raw_gff), file_prefix + ".release_browser.unsorted.gff3")
+
+		if threads > 1:
+			return self.__process_gff_parallel(raw_gff, name_prefix, out_release, out_browser, threads)
+
+		with open(raw_gff + ".old_new_id_relation.txt", "wt") as logfile, open(out_release, "wt") as out_rel, open(out_browser, "wt") as out_brw:
+			print(*["#New_Gene_ID", "New_mRNA_ID", "Old_Gene_ID", "Old_mRNA_ID"], sep="\t", file=logfile)
+
+			try:
+				self._rewrite_features(read_gff(raw_gff, keep_comments=True), name_prefix, 0, out_rel, out_brw, logfile)
+			except FileNotFoundError:
+				raise FileNotFoundError("Error: Could not find gff file at {}".format(raw_gff))
 
-		gene_counter = 0
+	def __process_gff_parallel(self, raw_gff, name_prefix, out_release, out_browser, threads):
+		""" Splits the gff on gene block boundaries, counts the kept genes per chunk and
+		derives each chunk's gene counter offset from a prefix sum over the counts.
+		The chunks are then rewritten independently and concatenated in order. """
+		try:
+			index = GffIndex(raw_gff)
+		except FileNotFoundError:
+			raise FileNotFoundError("Error: Could not find gff file at {}".format(raw_gff))
+
+		chunks = index.split(threads)
+
+		with tempfile.TemporaryDirectory(dir=os.path.dirname(out_release) or ".") as tmpdir:
+			with multiprocessing.Pool(threads, initializer=_init_worker, initargs=(self, index, name_prefix)) as pool:
+				kept_genes = pool.map(_count_kept_genes, chunks)
+				gene_offsets = [0] + list(itertools.accumulate(kept_genes))[:-1]
+				chunk_files = [
+					[os.path.join(tmpdir, "chunk{}.{}".format(i, suffix)) for suffix in ("release", "browser", "relation")]
+					for i in range(len(chunks))
+				]
+				results = pool.map(_rewrite_chunk, zip(chunks, gene_offsets, chunk_files))
+
+			# gene and transcript ids have only been checked for duplicates within a chunk
+			seen_genes, seen_transcripts = set(), set()
+			for chunk_genes, chunk_transcripts, _ in results:
+				for gid in chunk_genes:
+					if gid in seen_genes:
+						raise ValueError("Error: Duplicated gene id enocuntered in the input gff '{}'".format(gid))
+					seen_genes.add(gid)
+				for tid, new_transcript in chunk_transcripts:
+					if tid in seen_transcripts:
+						raise ValueError("Error: Duplicated transcript id '{}' ({})".format(tid, new_transcript))
+					seen_transcripts.add(tid)
+
+			with open(raw_gff + ".old_new_id_relation.txt", "wt") as logfile, open(out_release, "wt") as out_rel, open(out_browser, "wt") as out_brw:
+				print(*["#New_Gene_ID", "New_mRNA_ID", "Old_Gene_ID", "Old_mRNA_ID"], sep="\t", file=logfile)
+				self._rewrite_features(read_gff(index.read_header().split("\n"), keep_comments=True), name_prefix, 0, out_rel, out_brw, logfile)
+
+				for (_, _, debug_messages), (rel_chunk, brw_chunk, log_chunk) in zip(results, chunk_files):
+					sys.stderr.write(debug_messages)
+					for chunk, out in ((rel_chunk, out_rel), (brw_chunk, out_brw), (log_chunk, logfile)):
+						with open(chunk) as chunk_in:
+							shutil.copyfileobj(chunk_in, out)
+
+	def _rewrite_features(self, rows, name_prefix, gene_counter, out_rel, out_brw, logfile, debug_out=None):
+		debug_out = sys.stderr if debug_out is None else debug_out
 		new_genes = dict()
 		new_transcripts = dict()
+		feature_counter = Counter()
 
 		def get_attrib(key, attributes, feature):
 			try:
@@ -46,120 +113,140 @@ class GffReleaseGenerator():
 			except:
 				raise ValueError("Fatal Error: Cannot parse {} {} field.".format(feature, key))
 
-		out_release = os.path.join(os.path.dirname(raw_gff), file_prefix + ".release.unsorted.gff3")
-		out_browser = os.path.join(os.path.dirname(raw_gff), file_prefix + ".release_browser.unsorted.gff3")
+		for row in rows:
+			if isinstance(row, str):
+				print(row, file=out_rel)
+				print(row, file=out_brw)
+			else:
+				attrib = row.attributes
 
-		with open(raw_gff + ".old_new_id_relation.txt", "wt") as logfile, open(out_release, "wt") as out_rel, open(out_browser, "wt") as out_brw:
-			print(*["#New_Gene_ID", "New_mRNA_ID", "Old_Gene_ID", "Old_mRNA_ID"], sep="\t", file=logfile)
-			feature_counter = Counter()
-
-			try:			
-				for row in csv.DictReader(open(raw_gff), delimiter="\t", fieldnames=self.gff_header):
-					if row["seqid"].startswith("#"):
-						print(*(c for c in row.values() if c is not None), sep="\t", file=out_rel)
-						print(*(c for c in row.values() if c is not None), sep="\t", file=out_brw)
-					else:
-						start, end = int(row["start"]), int(row["end"])
-						start, end = (start, end) if start < end else (end, start)
-						attrib = dict(item.split("=") for item in row["attributes"].strip(";").split(";"))
-
-						row["source"] = name_prefix
-
-						if row["type"] == "gene":
-							gid = get_attrib("ID", attrib, row["type"])
-
-							ginfo = self.gene_metrics_info.get(gid, None)
-							if ginfo is None:
-								raise ValueError("Error: Gene '{}' is not in the metrics file.\n{}\n".format(gid, "\t".join(row.values())))
+				row.source = name_prefix
+
+				if row.type == "gene":
+					gid = get_attrib("ID", attrib, row.type)
+
+					ginfo = self.gene_metrics_info.get(gid, None)
+					if ginfo is None:
+						raise ValueError("Error: Gene '{}' is not in the metrics file.\n{}\n".format(gid, row))
+			
+					if eval(ginfo["discard"]):
+						print("Debug: Gene discarded '{}'".format(gid), file=debug_out)
+						continue
+
+					gene_counter += 10
+					new_gene_id = "{}_{:07d}".format(name_prefix, gene_counter)
 					
-							if eval(ginfo["discard"]):
-								print("Debug: Gene discarded '{}'".format(gid), file=sys.stderr)
-								continue
-
-							gene_counter += 10
-							new_gene_id = "{}_{:07d}".format(name_prefix, gene_counter)
-							
-							if new_genes.get(gid, None) is not None:
-								raise ValueError("Error: Duplicated gene id enocuntered in the input gff '{}'".format(gid))
-							new_genes[gid] = new_gene_id
-							
-							row["attributes"] = "ID={0};Name={0};biotype={1};confidence={2}".format(new_gene_id, ginfo["biotype"], ginfo["confidence"])
-
-							print(*row.values(), sep="\t", file=out_rel)
-							print(*row.values(), sep="\t", file=out_brw)
-
-						elif row["type"] == "mRNA":
-							tid = get_attrib("ID", attrib, row["type"])
-							gid = get_attrib("Parent", attrib, row["type"])
-
-							# note = eval(get_attrib("Note", attrib, row["type"]))
-							note = get_attrib("Note", attrib, row["type"]).split(",")
-							note = dict(item.split(":") for item in note if item.count(":") == 1)
-							is_primary = note.get("primary") is not None and eval(note.get("primary"))
-							region = "{}:{}..{}".format(row["seqid"], start, end)
-
-							tinfo = self.transcript_metrics_info.get(tid, None)
-							if tinfo is None:
-								raise ValueError("Error: Transcript '{}' is not in the metrics file.\n{}\n".format(tid, "\t".join(row.values())))
-
-							if eval(tinfo["discard"]):
-								print("Debug: Transcript discarded '{}'".format(tid), file=sys.stderr)
-								continue
-
-							try:
-								# Gemy's original:
-								# my ($count_mRNA) = $mrna =~ /\S+\D\S+\D+(\d+)/; 
-								# get the last 1 from mikado.109676G2.1, I might need to change this for different annotation
-								primary_suffix_check = tid.split(".")[-1]
-							except:
-								raise ValueError("Error: Cannot extract suffix count from transcript id ({}).".format(tid))
-
-							new_gene = new_genes.get(gid, None)
-							if new_gene is None:
-								raise ValueError("Error: No gene feature for transcript id {} (gene={}).".format(tid, gid))
-
-							new_transcript = "{}.{}".format(new_gene, primary_suffix_check)
-							if new_transcripts.get(tid, None) is not None:
-								raise ValueError("Error: Duplicated transcript id '{}' ({})".format(tid, new_transcript))
-
-							new_transcripts[tid] = new_transcript
-							feature_counter = Counter()
-
-							attribs = "ID={0};Parent={1};Name={0};Note={1}".format(new_transcript, new_gene)
-							# browser gff has different attributes
-							row["attributes"] = attribs + "|{}|conf:{}|rep:{}".format(tinfo["biotype"], tinfo["confidence"], is_primary)
-							print(*row.values(), sep="\t", file=out_brw)
-							# release gff
-							row["attributes"] = attribs + ";confidence={};representative={}".format(tinfo["confidence"], is_primary)
-							print(*row.values(), sep="\t", file=out_rel)
-
-							print(new_gene, new_transcript, gid, tid, sep="\t", file=logfile)
-
-						elif row["type"] in self.valid_feature_types:
-						
-							feature_counter[row["type"]] += 1
-
-							tid = get_attrib("Parent", attrib, row["type"])
-							tinfo = self.transcript_metrics_info.get(tid, None)
-							if tinfo is None:
-								raise ValueError("Error: Transcript '{}' is not in the metrics file.\n{}\n".format(tid, "\t".join(row.values())))
-
-							if eval(tinfo["discard"]):
-								print("Debug: {} parent transcript discarded '{}'".format(row["type"], tid), file=sys.stderr)
-								continue
-
-							new_transcript = new_transcripts.get(tid, None)
-							if new_transcript is not None:
-								new_feature_id = "{}.{}{}".format(new_transcript, row["type"], feature_counter[row["type"]])
-								row["attributes"] = "ID={};Parent={}".format(new_feature_id, new_transcript)
-								print(*row.values(), sep="\t", file=out_rel)
-								print(*row.values(), sep="\t", file=out_brw)
-
-						else:
-							print("WARN: Unknown feature type '{}'\n{}\n".format(row["type"], "\t".join(row.values())), file=sys.stderr)
+					if new_genes.get(gid, None) is not None:
+						raise ValueError("Error: Duplicated gene id enocuntered in the input gff '{}'".format(gid))
+					new_genes[gid] = new_gene_id
+					
+					row.attributes = "ID={0};Name={0};biotype={1};confidence={2}".format(new_gene_id, ginfo["biotype"], ginfo["confidence"])
 
-			except FileNotFoundError:
-				raise FileNotFoundError("Error: Could not find gff file at {}".format(raw_gff))
+					print(row, file=out_rel)
+					print(row, file=out_brw)
+
+				elif row.type == "mRNA":
+					tid = get_attrib("ID", attrib, row.type)
+					gid = get_attrib("Parent", attrib, row.type)
+
+					# note = eval(get_attrib("Note", attrib, row.type))
+					note = get_attrib("Note", attrib, row.type).split(",")
+					note = dict(item.split(":") for item in note if item.count(":") == 1)
+					is_primary = note.get("primary") is not None and eval(note.get("primary"))
+					region = "{}:{}..{}".format(row.seqid, *row.get_coords())
+
+					tinfo = self.transcript_metrics_info.get(tid, None)
+					if tinfo is None:
+						raise ValueError("Error: Transcript '{}' is not in the metrics file.\n{}\n".format(tid, row))
+
+					if eval(tinfo["discard"]):
+						print("Debug: Transcript discarded '{}'".format(tid), file=debug_out)
+						continue
+
+					try:
+						# Gemy's original:
+						# my ($count_mRNA) = $mrna =~ /\S+\D\S+\D+(\d+)/; 
+						# get the last 1 from mikado.109676G2.1, I might need to change this for different annotation
+						primary_suffix_check = tid.split(".")[-1]
+					except:
+						raise ValueError("Error: Cannot extract suffix count from transcript id ({}).".format(tid))
+
+					new_gene = new_genes.get(gid, None)
+					if new_gene is None:
+						raise ValueError("Error: No gene feature for transcript id {} (gene={}).".format(tid, gid))
+
+					new_transcript = "{}.{}".format(new_gene, primary_suffix_check)
+					if new_transcripts.get(tid, None) is not None:
+						raise ValueError("Error: Duplicated transcript id '{}' ({})".format(tid, new_transcript))
+
+					new_transcripts[tid] = new_transcript
+					feature_counter = Counter()
+
+					attribs = "ID={0};Parent={1};Name={0};Note={1}".format(new_transcript, new_gene)
+					# browser gff has different attributes
+					row.attributes = attribs + "|{}|conf:{}|rep:{}".format(tinfo["biotype"], tinfo["confidence"], is_primary)
+					print(row, file=out_brw)
+					# release gff
+					row.attributes = attribs + ";confidence={};representative={}".format(tinfo["confidence"], is_primary)
+					print(row, file=out_rel)
+
+					print(new_gene, new_transcript, gid, tid, sep="\t", file=logfile)
+
+				elif row.type in self.valid_feature_types:
+				
+					feature_counter[row.type] += 1
+
+					tid = get_attrib("Parent", attrib, row.type)
+					tinfo = self.transcript_metrics_info.get(tid, None)
+					if tinfo is None:
+						raise ValueError("Error: Transcript '{}' is not in the metrics file.\n{}\n".format(tid, row))
+
+					if eval(tinfo["discard"]):
+						print("Debug: {} parent transcript discarded '{}'".format(row.type, tid), file=debug_out)
+						continue
+
+					new_transcript = new_transcripts.get(tid, None)
+					if new_transcript is not None:
+						new_feature_id = "{}.{}{}".format(new_transcript, row.type, feature_counter[row.type])
+						row.attributes = "ID={};Parent={}".format(new_feature_id, new_transcript)
+						print(row, file=out_rel)
+						print(row, file=out_brw)
+
+				else:
+					print("WARN: Unknown feature type '{}'\n{}\n".format(row.type, row), file=debug_out)
+
+		return new_genes, new_transcripts
+
+
+# worker state for the parallel mode, set once per process by _init_worker
+_worker_generator, _worker_index, _worker_name_prefix = None, None, None
+
+
+def _init_worker(generator, index, name_prefix):
+	global _worker_generator, _worker_index, _worker_name_prefix
+	_worker_generator, _worker_index, _worker_name_prefix = generator, index, name_prefix
+
+
+def _count_kept_genes(chunk):
+	start, end = chunk[:2]
+	kept = 0
+	for row in read_gff(_worker_index.iter_range(start, end), feature_types={"gene"}):
+		ginfo = _worker_generator.gene_metrics_info.get(row.get_attrib("ID"))
+		# unknown genes are reported when the chunk is rewritten
+		if ginfo is not None and not eval(ginfo["discard"]):
+			kept += 1
+	return kept
+
+
+def _rewrite_chunk(args):
+	(start, end, _, _), gene_offset, (rel_chunk, brw_chunk, log_chunk) = args
+	debug_out = io.StringIO()
+	with open(rel_chunk, "wt") as out_rel, open(brw_chunk, "wt") as out_brw, open(log_chunk, "wt") as logfile:
+		new_genes, new_transcripts = _worker_generator._rewrite_features(
+			read_gff(_worker_index.iter_range(start, end), keep_comments=True),
+			_worker_name_prefix, gene_offset * 10, out_rel, out_brw, logfile, debug_out=debug_out
+		)
+	return list(new_genes), list(new_transcripts.items()), debug_out.getvalue()
 
 
 def main():
@@ -168,12 +255,14 @@ def main():
 	ap.add_argument("collapsed_metrics", type=str)
 	ap.add_argument("--annotation-version", type=str, default="EIv1")
 	ap.add_argument("--genus-identifier", type=str, default="XYZ")
+	ap.add_argument("--threads", type=int, default=1, help="Rewrite the input in parallel gene block chunks. Requires the input to be grouped by gene (### separated).")
 	args = ap.parse_args()
 
 
 	gff_rg = GffReleaseGenerator(args.collapsed_metrics).process_gff(
 		args.input_gff, 
-		name_prefix="{}_{}".format(args.genus_identifier, args.annotation_version)
+		name_prefix="{}_{}".format(args.genus_identifier, args.annotation_version),
+		threads=args.threads
 	)
 	
 	
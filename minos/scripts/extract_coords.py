@@ -1,10 +1,9 @@
-import csv
-import re
+from minos.scripts.gff_reader import read_gff, read_gtf
 
 def extract_coords(_in, _out, filetype="gtf"):
-	regex = re.compile('transcript_id "?([^";]+)"?;' if filetype == "gtf" else 'ID\s?=\s?"?([^";]+)"?;')
+	features, id_attrib = (read_gtf(_in), "transcript_id") if filetype == "gtf" else (read_gff(_in), "ID")
 	with open(_out, "w") as coords_out:
-		for row in csv.reader(open(_in), delimiter="\t"):
-			if row and not row[0].startswith("#") and "rna" in row[2].lower():
-				tid = regex.search(row[8]).group(1)
-				print(tid, "{seq}:{start}..{end}".format(seq=row[0], start=row[3], end=row[4]), sep="\t", flush=True, file=coords_out)
+		for feature in features:
+			if "rna" in feature.type.lower():
+				tid = feature.attributes[id_attrib].strip('"')
+				print(tid, "{seq}:{start}..{end}".format(seq=feature.seqid, start=feature.start, end=feature.end), sep="\t", file=coords_out)
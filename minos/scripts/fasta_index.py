@@ -0,0 +1,241 @@
+import argparse
+import mmap
+import os
+import sys
+
+from collections import namedtuple
+
+
+FaiRecord = namedtuple("FaiRecord", ["name", "length", "offset", "linebases", "linewidth"])
+
+
+def sequence_bytes(record):
+	""" Number of bytes of a sequence in a file with fixed line widths (last newline included). """
+	if not record.linebases:
+		return 0
+	full_lines, rest = divmod(record.length, record.linebases)
+	return full_lines * record.linewidth + (rest + record.linewidth - record.linebases if rest else 0)
+
+
+def read_fai(fai):
+	with open(fai) as fai_in:
+		return [
+			FaiRecord(row[0], int(row[1]), int(row[2]), int(row[3]), int(row[4]))
+			for row in (line.rstrip("\n").split("\t") for line in fai_in)
+			if row[0]
+		]
+
+
+def write_fai(records, fai):
+	# written to a temporary file first, other jobs may be reading the index
+	with open(fai + ".tmp", "w") as fai_out:
+		for record in records:
+			print(*record, sep="\t", file=fai_out)
+	os.replace(fai + ".tmp", fai)
+
+
+def read_fresh_fai(fasta, fai):
+	""" Returns the records of an up to date index, or None if there is none.
+	The index has to be newer than the fasta and its last record has to end at the end of the fasta
+	(so that an index of a since rewritten file with an older mtime is not used). """
+	try:
+		fasta_stat, fai_stat = os.stat(fasta), os.stat(fai)
+		if fai_stat.st_mtime_ns < fasta_stat.st_mtime_ns:
+			return None
+		records = read_fai(fai)
+	except FileNotFoundError:
+		return None
+	except (ValueError, IndexError):
+		print("WARN: Ignoring malformed fasta index at {}".format(fai), file=sys.stderr)
+		return None
+
+	if not records:
+		return records if not fasta_stat.st_size else None
+	last = records[-1]
+	end = last.offset + sequence_bytes(last)
+	# the newline at the end of the file may be missing
+	return records if fasta_stat.st_size in (end, end - (last.linewidth - last.linebases)) else None
+
+
+def open_mmap(fasta):
+	with open(fasta, "rb") as fasta_in:
+		if not os.fstat(fasta_in.fileno()).st_size:
+			return b""
+		return mmap.mmap(fasta_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_header_positions(data):
+	""" Yields the start of each header line ('>' at the start of a line). """
+	if data[:1] == b">":
+		yield 0
+	pos = data.find(b"\n>")
+	while pos != -1:
+		yield pos + 1
+		pos = data.find(b"\n>", pos + 1)
+
+
+def scan_ids(fasta):
+	""" Returns the sequence ids of a fasta file in file order.
+	Reads the .fai if there is an up to date one, otherwise only the header lines are parsed. """
+	records = read_fresh_fai(fasta, fasta + ".fai")
+	if records is not None:
+		return [record.name for record in records]
+	data = open_mmap(fasta)
+	try:
+		ids = list()
+		for start in iter_header_positions(data):
+			end = data.find(b"\n", start)
+			header = data[start + 1:end if end != -1 else len(data)].split(None, 1)
+			ids.append(header[0].decode() if header else "")
+		return ids
+	finally:
+		if isinstance(data, mmap.mmap):
+			data.close()
+
+
+class FastaFile:
+	""" Memory-mapped fasta file with a samtools-compatible index (<fasta>.fai).
+	An up to date .fai is reused, otherwise the index is built in one pass (and written with save_index=True).
+	Sequences with irregular line widths are still indexed (by their byte range),
+	in that case no .fai is written as samtools would reject the file. """
+	suffix = ".fai"
+
+	def __init__(self, fasta, index_file=None, save_index=False):
+		self.fasta = fasta
+		self.index_file = index_file if index_file is not None else fasta + FastaFile.suffix
+		if not os.path.exists(fasta):
+			raise FileNotFoundError("Error: Cannot find input fasta at " + fasta)
+		self.data = open_mmap(fasta)
+		self.records, self._irregular_ends = read_fresh_fai(fasta, self.index_file), dict()
+
+		if self.records is None:
+			self.records = list()
+			self.build()
+			if save_index and not self._irregular_ends:
+				try:
+					write_fai(self.records, self.index_file)
+				except OSError:
+					print("WARN: Cannot write fasta index to {}".format(self.index_file), file=sys.stderr)
+
+		self._index = dict()
+		for i, record in enumerate(self.records):
+			self._index.setdefault(record.name, i)
+
+	def build(self):
+		data = self.data
+		headers = list(iter_header_positions(data))
+		for i, start in enumerate(headers):
+			header_end = data.find(b"\n", start)
+			seq_start = header_end + 1 if header_end != -1 else len(data)
+			seq_end = headers[i + 1] if i + 1 < len(headers) else len(data)
+			header = data[start + 1:seq_start].split(None, 1)
+			name = header[0].decode() if header else ""
+
+			seq = data[seq_start:seq_end]
+			length = len(seq) - seq.count(b"\n") - seq.count(b"\r")
+			first_line_end = seq.find(b"\n")
+			# a single sequence line without newline at the end of the file counts as newline terminated
+			linewidth = first_line_end + 1 if first_line_end != -1 else len(seq) + 1
+			linebases = len(seq[:linewidth].rstrip(b"\r\n"))
+			record = FaiRecord(name, length, seq_start, linebases, linewidth) if length else FaiRecord(name, 0, seq_start, 0, 0)
+			if not self.is_regular(record, seq):
+				self._irregular_ends[i] = seq_end
+			self.records.append(record)
+
+	@staticmethod
+	def is_regular(record, seq):
+		""" All lines but the last one have the same width, as required for the .fai. """
+		if not record.length:
+			return not seq.strip()
+		n_lines = -(-record.length // record.linebases)
+		# the newline at the end of the file may be missing
+		return (
+			sequence_bytes(record) in (len(seq), len(seq) + record.linewidth - record.linebases)
+			and seq.count(b"\n") in (n_lines, n_lines - 1)
+			and seq[record.linewidth - 1::record.linewidth].count(b"\n") == len(seq) // record.linewidth
+		)
+
+	def close(self):
+		if isinstance(self.data, mmap.mmap):
+			self.data.close()
+
+	def __getstate__(self):
+		# pickled (e.g. for worker processes) without the mmap, the index is not built again
+		state = dict(self.__dict__)
+		del state["data"]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.data = open_mmap(self.fasta)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def __len__(self):
+		return len(self.records)
+
+	def __contains__(self, name):
+		return name in self._index
+
+	def ids(self):
+		""" Sequence ids in file order, taken from the index. """
+		return [record.name for record in self.records]
+
+	def _sequence_range(self, i):
+		record = self.records[i]
+		end = self._irregular_ends.get(i)
+		if end is None:
+			end = min(record.offset + sequence_bytes(record), len(self.data))
+		return record.offset, end
+
+	def sequence(self, i):
+		""" Sequence of the i-th record. """
+		start, end = self._sequence_range(i)
+		return self.data[start:end].replace(b"\n", b"").replace(b"\r", b"").decode()
+
+	def fetch(self, name):
+		""" Returns the sequence of the first record with this id. """
+		try:
+			return self.sequence(self._index[name])
+		except KeyError:
+			raise KeyError("Error: Cannot find sequence {} in {}".format(name, self.fasta))
+
+	def header_start(self, i):
+		return self.data.rfind(b"\n", 0, self.records[i].offset - 1) + 1
+
+	def header(self, i):
+		""" Full header line (without '>') of the i-th record. """
+		start, end = self.header_start(i), self.records[i].offset
+		return self.data[start + 1:end].rstrip(b"\r\n").decode()
+
+	def iter_sequences(self):
+		""" Yields (id, sequence) in file order. """
+		for i, record in enumerate(self.records):
+			yield record.name, self.sequence(i)
+
+	def iter_record_ranges(self):
+		""" Yields (i, start, end) byte ranges of the records (header up to the next header),
+		which tile the file from the first header on. """
+		starts = [self.header_start(i) for i in range(len(self.records))]
+		for i, start in enumerate(starts):
+			yield i, start, starts[i + 1] if i + 1 < len(starts) else len(self.data)
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Builds a samtools-compatible index (<fasta>.fai) for a fasta file.")
+	ap.add_argument("input_fasta", type=str)
+	ap.add_argument("--fetch", type=str, help="Print the sequence with this id.")
+	args = ap.parse_args()
+
+	with FastaFile(args.input_fasta, save_index=True) as fasta:
+		if args.fetch is not None:
+			print(">" + args.fetch)
+			print(fasta.fetch(args.fetch))
+
+
+if __name__ == "__main__":
+	main()
@@ -1,8 +1,78 @@
 import os
-import glob
-import csv
-from minos.scripts.analyse_busco import read_full_table, read_tx2gene, get_busco_categories
-from collections import Counter
+import sys
+import multiprocessing
+
+from minos.scripts.analyse_busco import read_full_table_rows, summarise_full_table, read_tx2gene, get_busco_categories
+
+
+
+def find_full_table(run_dir):
+	""" Returns the first run_*/full* file of a busco run directory (as glob, without sorting). """
+	try:
+		runs = [entry.path for entry in os.scandir(run_dir) if entry.name.startswith("run_") and entry.is_dir()]
+	except FileNotFoundError:
+		runs = list()
+	for run in runs:
+		for entry in os.scandir(run):
+			if entry.name.startswith("full"):
+				return entry.path
+	raise IndexError("Error: Cannot find busco full table in " + run_dir)
+
+
+def read_cache(cache_file):
+	""" Reads the cached (busco id, status, sequence id) rows of busco full tables.
+	Returns {path: (size, mtime_ns, rows)}. """
+	cache, rows = dict(), None
+	try:
+		with open(cache_file) as cache_in:
+			for line in cache_in:
+				row = line.rstrip("\n").split("\t")
+				if row[0] == "#table":
+					rows = list()
+					cache[row[1]] = int(row[2]), int(row[3]), rows
+				elif rows is not None and row[0][:1] != "#":
+					rows.append(tuple(row))
+	except (FileNotFoundError, IndexError, ValueError):
+		return dict()
+	return cache
+
+
+def write_cache(cache, cache_file):
+	with open(cache_file + ".tmp", "w") as cache_out:
+		print("##busco_full_tables", file=cache_out)
+		for path, (size, mtime, rows) in cache.items():
+			print("#table", path, size, mtime, sep="\t", file=cache_out)
+			cache_out.writelines("\t".join(row) + "\n" for row in rows)
+	os.replace(cache_file + ".tmp", cache_file)
+
+
+def read_full_tables(tables, threads=1, cache_file=None):
+	""" Returns {path: rows} for busco full tables. Tables are read from the cache if their size and mtime
+	did not change, the others are parsed (in parallel with threads > 1) and added to the cache. """
+	cache = read_cache(cache_file) if cache_file is not None else dict()
+	stats = {table: os.stat(table) for table in tables}
+	stale = [
+		table for table, stat in stats.items()
+		if cache.get(table, (None, None))[:2] != (stat.st_size, stat.st_mtime_ns)
+	]
+
+	if threads > 1 and len(stale) > 1:
+		with multiprocessing.Pool(min(threads, len(stale))) as pool:
+			parsed = pool.map(read_full_table_rows, stale)
+	else:
+		parsed = list(map(read_full_table_rows, stale))
+
+	for table, rows in zip(stale, parsed):
+		cache[table] = stats[table].st_size, stats[table].st_mtime_ns, rows
+
+	if stale and cache_file is not None:
+		try:
+			write_cache({table: cache[table] for table in tables}, cache_file)
+		except OSError:
+			print("WARN: Cannot write busco table cache to {}".format(cache_file), file=sys.stderr)
+
+	return {table: cache[table][2] for table in tables}
+
 
 class BuscoTableGenerator:
 	REVIEW_TABLE_HEADER = ["Busco ID", "Transcript ID", "Busco Status", "Coordinates", "prepare TID (C or D)", "prepare TID coordinates"]
@@ -17,28 +87,42 @@ class BuscoTableGenerator:
 		self.txcoords_prepare = dict(line.strip().split("\t") for line in open(txcoords_prepare))
 		self.txcoords_pick = dict(line.strip().split("\t") for line in open(txcoords_pick))
 
-	def parse_rundata(self, busco_run_path):
+	@staticmethod
+	def find_runs(busco_run_path):
+		""" Returns (run directory, run id, busco stage) of the busco runs in file system order. """
+		runs = list()
+		for stage in os.scandir(busco_run_path):
+			if not stage.is_dir():
+				continue
+			d = stage.name
+			if d.endswith("_final") or d == "genome":
+				runs.append((os.path.join(stage.path, d), d, d))
+			else:
+				for run in os.scandir(stage.path):
+					if run.name != "input" and not run.name.startswith(".") and run.is_dir():
+						runs.append((run.path, "{}/{}".format(d, run.name), d))
+		return runs
+
+	def parse_rundata(self, busco_run_path, threads=1, cache_file=None):
 		missing_busco_proteins_list, missing_busco_transcripts_list = list(), list()
-		for d in os.listdir(busco_run_path):
+		runs = [(run_dir, runid, d, find_full_table(run_dir)) for run_dir, runid, d in BuscoTableGenerator.find_runs(busco_run_path)]
+		tables = read_full_tables([f for *_, f in runs], threads=threads, cache_file=cache_file)
+
+		for dd, runid, d, f in runs:
 			if d.endswith("_final") or d == "genome":
-				f = glob.glob(os.path.join(busco_run_path, d, d, "run_*", "full*"))[0]
-				self.run_tables[d], complete_buscos, _, fragmented_buscos = read_full_table(f, is_pick=d.endswith("_final"))
+				self.run_tables[d], complete_buscos, _, fragmented_buscos = summarise_full_table(tables[f], is_pick=d.endswith("_final"))
 				if d == "proteins_final":
 					self.complete_busco_proteins_final = complete_buscos
 					self.fragmented_busco_proteins[d] = fragmented_buscos
 			else:
-				for dd in glob.glob(os.path.join(busco_run_path, d, "*")):
-					if os.path.basename(dd) != "input":
-						f = glob.glob(os.path.join(dd, "run_*", "full*"))[0]
-						runid = "{}/{}".format(d, os.path.basename(dd))
-						self.run_tables[runid], complete_buscos, missing_buscos, fragmented_buscos = read_full_table(f, self.tx2gene)
-						if os.path.basename(d).startswith("proteins"):
-							self.complete_busco_proteins[dd] = complete_buscos
-							missing_busco_proteins_list.append(missing_buscos)
-							self.fragmented_busco_proteins[dd] = fragmented_buscos
-						else:
-							self.complete_busco_transcripts[dd] = complete_buscos
-							missing_busco_transcripts_list.append(missing_buscos)
+				self.run_tables[runid], complete_buscos, missing_buscos, fragmented_buscos = summarise_full_table(tables[f], self.tx2gene)
+				if d.startswith("proteins"):
+					self.complete_busco_proteins[dd] = complete_buscos
+					missing_busco_proteins_list.append(missing_buscos)
+					self.fragmented_busco_proteins[dd] = fragmented_buscos
+				else:
+					self.complete_busco_transcripts[dd] = complete_buscos
+					missing_busco_transcripts_list.append(missing_buscos)
 
 		if len(missing_busco_proteins_list) > 0:
 			self.missing_busco_proteins.update(
@@ -47,7 +131,12 @@ class BuscoTableGenerator:
 			self.missing_busco_transcripts.update(
                             missing_busco_transcripts_list[0].intersection(*missing_busco_transcripts_list))
 
-	def __init__(self, tx2gene_data_dir, txcoords_prepare, txcoords_pick, busco_run_path):
+		# inverted index busco id -> [(protein run, complete/duplicated transcript ids)]
+		for dd, complete_buscos in self.complete_busco_proteins.items():
+			for bid, hits in complete_buscos.items():
+				self.busco_protein_index.setdefault(bid, list()).append((dd, [tid for tid, gid in hits]))
+
+	def __init__(self, tx2gene_data_dir, txcoords_prepare, txcoords_pick, busco_run_path, threads=1, cache_file=None):
 		self.import_tx2gene_data(tx2gene_data_dir)
 		self.import_txcoords(txcoords_prepare, txcoords_pick)
 
@@ -56,28 +145,24 @@ class BuscoTableGenerator:
 		self.complete_busco_proteins_final = dict()
 		self.missing_busco_proteins, self.missing_busco_transcripts = set(), set()
 		self.fragmented_busco_proteins = dict()
+		self.busco_protein_index = dict()
 
-		self.parse_rundata(busco_run_path)
+		self.parse_rundata(busco_run_path, threads=threads, cache_file=cache_file)
 
 	def write_review_table(self, prefix):
-		review_proteins = set()
-		for protein_set in self.complete_busco_proteins.values():
-			review_proteins.update(protein_set)
-		review_proteins.difference_update(self.complete_busco_proteins_final)
+		review_proteins = set(self.busco_protein_index).difference(self.complete_busco_proteins_final)
 
 		with open(prefix + ".review_table", "w") as review_out:
-			print(*BuscoTableGenerator.REVIEW_TABLE_HEADER, sep="\t", flush=True, file=review_out)
+			print(*BuscoTableGenerator.REVIEW_TABLE_HEADER, sep="\t", file=review_out)
 
 			for bid in sorted(review_proteins):
 				tid = ",".join(self.fragmented_busco_proteins["proteins_final"].get(bid, list()))
 				busco_status = "fragmented" if tid else "missing"
 				tid_coords = self.txcoords_pick.get(tid, None)
-				prepare_tids, prepare_coords = list(), list()
-				for protein_set in self.complete_busco_proteins.values():
-					prepare_tids.extend(item[0] for item in protein_set.get(bid, list()))
+				prepare_tids = [ptid for dd, tids in self.busco_protein_index[bid] for ptid in tids]
 				prepare_coords = [self.txcoords_prepare.get(ptid, None) for ptid in prepare_tids]
 				row = [bid, tid, busco_status, tid_coords, ",".join(prepare_tids), ",".join(prepare_coords)]
-				print(*row, sep="\t", flush=True, file=review_out)
+				print(*row, sep="\t", file=review_out)
 
 	def write_raw_data(self, prefix):
 		with open(prefix + ".raw", "w") as raw_out:
@@ -95,9 +180,7 @@ class BuscoTableGenerator:
 
 				print(cat_lbl, *(v[cat] for v in self.run_tables.values()), sep="\t", flush=True, file=table_out)
 
-			complete_busco_proteins_, complete_busco_transcripts_ = set(), set()
-			for set_ in self.complete_busco_proteins.values():
-				complete_busco_proteins_.update(set_)
+			complete_busco_proteins_, complete_busco_transcripts_ = set(self.busco_protein_index), set()
 			for set_ in self.complete_busco_transcripts.values():
 				complete_busco_transcripts_.update(set_)
 
@@ -1,20 +1,22 @@
 import csv
 from collections import Counter
 
+from minos.scripts.gff_reader import read_gff
+
 def generate_final_table(seq_table, bt_conf_table, stats_table, final_table, summary):
 	colheaders = ["Confidence", "Biotype", "InFrameStop", "Partialness"]
 	pt_cats = {".": "complete", "5_3": "fragment", "3": "3prime_partial", "5": "5prime_partial"}
 
 	if_pt = dict((row[7], row[12:14]) for row in csv.reader(open(seq_table), delimiter="\t"))
 	genes, transcripts = dict(), dict()
-	for row in csv.reader(open(bt_conf_table), delimiter="\t"):
-		if not row[0].startswith("#"):
-			if row[2].lower() in {"gene", "mrna", "ncrna"}:
-				attrib = dict(item.split("=") for item in row[8].strip().split(";"))
-				if row[2].lower() == "gene":
-					genes[attrib["ID"]] = (attrib["biotype"], attrib["confidence"])
-				else:
-					transcripts[attrib["ID"]] = (genes.get(attrib["Parent"], (None, None))[0], attrib["confidence"])
+	for feature in read_gff(bt_conf_table, feature_types={"gene", "mRNA", "ncRNA", "mrna", "ncrna"}):
+		ftype = feature.type.lower()
+		if ftype in {"gene", "mrna", "ncrna"}:
+			attrib = feature.attributes
+			if ftype == "gene":
+				genes[attrib["ID"]] = (attrib["biotype"], attrib["confidence"])
+			else:
+				transcripts[attrib["ID"]] = (genes.get(attrib["Parent"], (None, None))[0], attrib["confidence"])
 
 	r = csv.reader(open(stats_table), delimiter="\t")
 	head = ["#{}.{}".format(c, col) for c, col in enumerate(next(r), start=1)]
@@ -4,6 +4,12 @@ import csv
 import argparse
 import yaml
 import collections
+import heapq
+import multiprocessing
+import tempfile
+
+from minos.scripts.metrics_matrix import MetricsMatrixWriter
+from minos.scripts.tpm_matrix import read_tpm_column
 
 
 def read_metrics_info(f):
@@ -35,8 +41,11 @@ def clean_na(x):
 		return 0.0
 
 
-def read_mikado_refmap(f, seen=set()):
-	model_info = {"nmetrics": None}
+def check_mikado_refmap(f, missing):
+	if missing:
+		raise ValueError("Error: Mikado run ({}) has less transcripts than previously processed run ({} missing transcript(s): {}). Please check your mikado inputs.".format(f, len(missing), ",".join(sorted(missing)[:3]) + ", ..."))
+
+def iter_mikado_refmap(f, seen=set()):
 	for i, row in enumerate(csv.reader(open(f), delimiter="\t")):
 		if i > 0 and not row[0].startswith("#"):
 			tid = row[0]
@@ -45,17 +54,17 @@ def read_mikado_refmap(f, seen=set()):
 
 			nF1, jF1, eF1 = map(clean_na, (row[6], row[9], row[12]))
 			aF1 = sum((nF1, jF1, eF1)) / 3
-			model_info[tid] = collections.OrderedDict(zip(("nF1", "jF1", "eF1", "aF1"), map(_round_perc_frac, (nF1, jF1, eF1, aF1))))
+			yield tid, collections.OrderedDict(zip(("nF1", "jF1", "eF1", "aF1"), map(_round_perc_frac, (nF1, jF1, eF1, aF1))))
 
+def read_mikado_refmap(f, seen=set()):
+	model_info = {"nmetrics": None}
+	model_info.update(iter_mikado_refmap(f, seen=seen))
 	if seen:
-		delta = seen.difference(model_info)
-		if delta:
-			raise ValueError("Error: Mikado run ({}) has less transcripts than previously processed run ({} missing transcript(s): {}). Please check your mikado inputs.".format(f, len(delta), ",".join(sorted(delta)[:3]) + ", ..."))
+		check_mikado_refmap(f, seen.difference(model_info))
 
 	return model_info
 
-def read_blast(f, seen=set()):
-	model_info = {"nmetrics": 2}
+def iter_blast(f, seen=set()):
 	for i, row in enumerate(csv.reader(open(f), delimiter="\t")):
 		if not row[0].startswith("#"):
 			tid = row[0]
@@ -63,48 +72,55 @@ def read_blast(f, seen=set()):
 				raise ValueError("Error: This is a blast run ({}) but transcript {} occurs for the first time. Please check your mikado/blast inputs.".format(f, tid))
 
 			qCov, tCov = map(clean_na, (row[17], row[18]))
-			model_info[tid] = collections.OrderedDict(zip(("qCov", "tCov"), map(_round_perc_frac, (qCov, tCov))))
-			
+			yield tid, collections.OrderedDict(zip(("qCov", "tCov"), map(_round_perc_frac, (qCov, tCov))))
+
+def read_blast(f, seen=set()):
+	model_info = {"nmetrics": 2}
+	model_info.update(iter_blast(f, seen=seen))
 	return model_info
 
-def read_cpc(f, seen=set()):
-	model_info = {"nmetrics": None}
+def iter_cpc(f, seen=set()):
 	for i, row in enumerate(csv.reader(open(f), delimiter="\t")):
 		if i > 0 and not row[0].startswith("#"):
 			tid = row[0]
 			if seen and tid not in seen:
 				raise ValueError("Error: This is a cpc run ({}) but transcript {} occurs for the first time. Please check your mikado/cpc inputs.".format(f, tid))
 			
-			model_info[tid] = collections.OrderedDict({"cpc": _round_frac(clean_na(row[6]))})
+			yield tid, collections.OrderedDict({"cpc": _round_frac(clean_na(row[6]))})
 
+def read_cpc(f, seen=set()):
+	model_info = {"nmetrics": None}
+	model_info.update(iter_cpc(f, seen=seen))
 	return model_info
 
-def read_kallisto(f, seen=set()):
-	model_info = {"nmetrics": None}
-	for i, row in enumerate(csv.reader(open(f), delimiter="\t")):
-		if i > 0 and not row[0].startswith("#"):
-			tid = row[0]
-			if seen and tid not in seen:
-				raise ValueError("Error: This is a kallisto run ({}) but transcript {} occurs for the first time. Please check your mikado/kallisto inputs.".format(f, tid))
+def iter_kallisto(f, seen=set()):
+	target_ids, tpm = read_tpm_column(f)
+	for tid, value in zip(target_ids, tpm.tolist()):
+		if seen and tid not in seen:
+			raise ValueError("Error: This is a kallisto run ({}) but transcript {} occurs for the first time. Please check your mikado/kallisto inputs.".format(f, tid))
 
-			model_info[tid] = collections.OrderedDict({"tpm": _round_frac(clean_na(row[4]))})
+		yield tid, collections.OrderedDict({"tpm": _round_frac(value)})
 
+def read_kallisto(f, seen=set()):
+	model_info = {"nmetrics": None}
+	model_info.update(iter_kallisto(f, seen=seen))
 	return model_info
 
-def read_rm_repeats(f, seen=set()):
-	model_info = {"nmetrics": 1}
+def iter_rm_repeats(f, seen=set()):
 	for i, row in enumerate(csv.reader(open(f), delimiter="\t")):
 		if row and not row[0].startswith("#"):
 			tid = row[0]
 			if seen and tid not in seen:
 				raise ValueError("Error: This is a repeat modeler run ({}) but transcript {} occurs for the first time. Please check your mikado/rm inputs.".format(f, tid))
 
-			model_info[tid] = collections.OrderedDict({"cov": _round_frac(clean_na(row[3]))})
+			yield tid, collections.OrderedDict({"cov": _round_frac(clean_na(row[3]))})
 
+def read_rm_repeats(f, seen=set()):
+	model_info = {"nmetrics": 1}
+	model_info.update(iter_rm_repeats(f, seen=seen))
 	return model_info
 
-def read_busco(f, seen=set(), score_complete=1, score_fragmented=0.25):
-	model_info = {"nmetrics": 1}
+def iter_busco(f, seen=set(), score_complete=1, score_fragmented=0.25):
 	for i, row in enumerate(csv.reader(open(f), delimiter="\t")):
 		if row and not row[0].startswith("#"):
 			if row[1] != "Missing":
@@ -113,47 +129,69 @@ def read_busco(f, seen=set(), score_complete=1, score_fragmented=0.25):
 					raise ValueError("Error: This is a busco run ({}) but transcript {} occurs for the first time. Please check your mikado/rm inputs.".format(f, tid))
 
 				score = score_complete if row[1] in {"Duplicated", "Complete"} else score_fragmented if row[1] == "Fragmented" else 0
-				model_info[tid] = collections.OrderedDict({"busco": _round_frac(clean_na(score))})
+				yield tid, collections.OrderedDict({"busco": _round_frac(clean_na(score))})
 
+def read_busco(f, seen=set(), score_complete=1, score_fragmented=0.25):
+	model_info = {"nmetrics": 1}
+	model_info.update(iter_busco(f, seen=seen, score_complete=score_complete, score_fragmented=score_fragmented))
 	return model_info
 
 
 MCLASS_INFO = collections.OrderedDict([
-	("mikado", {"metrics": ["nF1", "jF1", "eF1", "aF1"], "parser": read_mikado_refmap}),
-	("blast", {"metrics": ["qCov", "tCov"], "parser": read_blast}),
-	("cpc", {"metrics": [""], "parser": read_cpc}),
-	("expression", {"metrics": [""], "parser": read_kallisto}),
-	("repeat", {"metrics": ["cov"], "parser": read_rm_repeats}),
-	("busco", {"metrics": [""], "parser": read_busco})
-])                                                                                      		
+	("mikado", {"metrics": ["nF1", "jF1", "eF1", "aF1"], "parser": read_mikado_refmap, "reader": iter_mikado_refmap, "nmetrics": None}),
+	("blast", {"metrics": ["qCov", "tCov"], "parser": read_blast, "reader": iter_blast, "nmetrics": 2}),
+	("cpc", {"metrics": [""], "parser": read_cpc, "reader": iter_cpc, "nmetrics": None}),
+	("expression", {"metrics": [""], "parser": read_kallisto, "reader": iter_kallisto, "nmetrics": None}),
+	("repeat", {"metrics": ["cov"], "parser": read_rm_repeats, "reader": iter_rm_repeats, "nmetrics": 1}),
+	("busco", {"metrics": [""], "parser": read_busco, "reader": iter_busco, "nmetrics": 1})
+])
 
 
-def main():
+def get_metrics_runs(metrics_info):
+	return [
+		(mclass, run, metrics_info[mclass][run])
+		for mclass in MCLASS_INFO
+		for run in metrics_info.get(mclass, collections.OrderedDict())
+		if MCLASS_INFO[mclass]["parser"] is not None
+	]
 
-	ap = argparse.ArgumentParser()
-	ap.add_argument("metrics_info", type=str)
-	args = ap.parse_args()
 
-	if not os.path.exists(args.metrics_info):
-		raise ValueError("Error: Could not find metrics info at " + args.metric_info)
+# transcripts of the first run, set in each worker process by _init_worker
+_worker_seen = None
 
-	metrics_info = read_metrics_info(args.metrics_info)
-	metrics_header = generate_metrics_header(metrics_info)
 
-	print(*metrics_header, sep="\t")
+def _init_worker(seen):
+	global _worker_seen
+	_worker_seen = seen
 
+
+def map_runs(function, jobs, seen, threads=1):
+	""" Runs function over the jobs in a process pool of up to threads workers.
+	Results (and the first error) are returned in job order. """
+	if threads > 1 and len(jobs) > 1:
+		with multiprocessing.Pool(min(threads, len(jobs)), initializer=_init_worker, initargs=(seen,)) as pool:
+			return list(pool.imap(function, jobs))
+	_init_worker(seen)
+	return list(map(function, jobs))
+
+
+def _parse_run(job):
+	mclass, f = job
+	return MCLASS_INFO[mclass]["parser"](f, seen=_worker_seen)
+
+
+def write_metrics_matrix(metrics_info, stream=sys.stdout, threads=1, columns_out=None):
+	runs = get_metrics_runs(metrics_info)
 	model_info = collections.OrderedDict()
 	first_run = None
-	seen = set()
-	for mclass in MCLASS_INFO:
-		for run in metrics_info.get(mclass, collections.OrderedDict()):
-			parser = MCLASS_INFO[mclass]["parser"]
-			if parser is not None:
-				if first_run is None:
-					first_run = run
-				model_info[run] = parser(metrics_info[mclass][run], seen=seen)
-				if not seen:
-					seen = set(model_info[run])
+	if runs:
+		# the first run defines the transcript set the other runs are checked against
+		mclass, first_run, f = runs[0]
+		model_info[first_run] = MCLASS_INFO[mclass]["parser"](f, seen=set())
+		seen = set(model_info[first_run])
+		run_infos = map_runs(_parse_run, [(mclass, f) for mclass, run, f in runs[1:]], seen, threads=threads)
+		for (mclass, run, f), run_info in zip(runs[1:], run_infos):
+			model_info[run] = run_info
 
 	for tid in model_info[first_run]:
 		if tid != "nmetrics":
@@ -164,10 +202,135 @@ def main():
 				except KeyError:
 					try:
 						data = ["0.0000" for i in range(model_info[run]["nmetrics"])]
-					except ValueError:
+					except TypeError:
 						raise ValueError("Error: Missing {} values for transcript {}".format(run, tid))
 				row.extend(data)
-			print(*row, sep="\t")
+			print(*row, sep="\t", file=stream)
+			if columns_out is not None:
+				columns_out.add(row)
+
+
+class SortedRunSpool:
+	""" Collects the (rank, values) records of one metrics run in sorted chunk files
+	of at most buffer_size records and streams them back in rank order.
+	Records with the same rank are returned in input order. """
+	def __init__(self, tmpdir, name, buffer_size=1000000):
+		self.tmpdir, self.name, self.buffer_size = tmpdir, name, buffer_size
+		self.buffer, self.chunks = list(), list()
+
+	def add(self, rank, values):
+		self.buffer.append((rank, "\t".join(values)))
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		if self.buffer:
+			self.buffer.sort(key=lambda record: record[0])
+			chunk = os.path.join(self.tmpdir, "{}.{}.tsv".format(self.name, len(self.chunks)))
+			with open(chunk, "wt") as chunk_out:
+				for rank, values in self.buffer:
+					print(rank, values, sep="\t", file=chunk_out)
+			self.chunks.append(chunk)
+			self.buffer = list()
+
+	@staticmethod
+	def read_chunk(chunk):
+		with open(chunk) as chunk_in:
+			for line in chunk_in:
+				rank, values = line.rstrip("\n").split("\t", 1)
+				yield int(rank), values
+
+	def __iter__(self):
+		self.flush()
+		return heapq.merge(*(SortedRunSpool.read_chunk(chunk) for chunk in self.chunks), key=lambda record: record[0])
+
+
+def _spool_run(job):
+	mclass, f, spool_dir, name, buffer_size = job
+	spool = SortedRunSpool(spool_dir, name, buffer_size=buffer_size)
+	covered = bytearray(len(_worker_seen)) if mclass == "mikado" else None
+	for tid, data in MCLASS_INFO[mclass]["reader"](f, seen=_worker_seen):
+		rank = _worker_seen[tid]
+		if covered is not None:
+			covered[rank] = 1
+		spool.add(rank, data.values())
+	if covered is not None:
+		check_mikado_refmap(f, [tid for tid, rank in _worker_seen.items() if not covered[rank]])
+	spool.flush()
+	return spool
+
+
+def merge_metrics_matrix(metrics_info, stream=sys.stdout, tmpdir=None, buffer_size=1000000, threads=1, columns_out=None):
+	""" Low-memory version of write_metrics_matrix. Each run is spooled to disk sorted by the
+	position of its transcripts in the first run, the matrix is then written by a k-way merge join. """
+	runs = get_metrics_runs(metrics_info)
+
+	with tempfile.TemporaryDirectory(dir=tmpdir) as spool_dir:
+		first_rank, tids, spools = dict(), list(), list()
+		if runs:
+			# the first run defines the transcript set the other runs are checked against
+			mclass, run, f = runs[0]
+			spool = SortedRunSpool(spool_dir, "run0", buffer_size=buffer_size)
+			for tid, data in MCLASS_INFO[mclass]["reader"](f, seen=set()):
+				rank = first_rank.setdefault(tid, len(tids))
+				if rank == len(tids):
+					tids.append(tid)
+				spool.add(rank, data.values())
+			spools.append(spool)
+			spools.extend(map_runs(
+				_spool_run,
+				[(mclass, f, spool_dir, "run{}".format(i), buffer_size) for i, (mclass, run, f) in enumerate(runs[1:], start=1)],
+				first_rank, threads=threads
+			))
+
+		streams = [iter(spool) for spool in spools]
+		heads = [next(records, None) for records in streams]
+		for rank, tid in enumerate(tids):
+			row = [tid]
+			for i, (mclass, run, f) in enumerate(runs):
+				data = None
+				# duplicate transcripts: the last record wins, as in write_metrics_matrix
+				while heads[i] is not None and heads[i][0] == rank:
+					data = heads[i][1]
+					heads[i] = next(streams[i], None)
+				if data is None:
+					if MCLASS_INFO[mclass]["nmetrics"] is None:
+						raise ValueError("Error: Missing {} values for transcript {}".format(run, tid))
+					data = "\t".join("0.0000" for i in range(MCLASS_INFO[mclass]["nmetrics"]))
+				row.append(data)
+			print(*row, sep="\t", file=stream)
+			if columns_out is not None:
+				columns_out.add(row)
+
+
+def main():
+
+	ap = argparse.ArgumentParser()
+	ap.add_argument("metrics_info", type=str)
+	ap.add_argument("--low-memory", action="store_true", help="Spool the metrics runs to disk and write the matrix through a k-way merge instead of holding all runs in memory.")
+	ap.add_argument("--tmpdir", type=str, help="Directory for the --low-memory and --npz spool files (default: system temp directory).")
+	ap.add_argument("--threads", type=int, default=1, help="Number of metrics runs parsed in parallel (default: %(default)s)")
+	ap.add_argument("--npz", type=str, help="Also write the matrix as typed columns to this (uncompressed, memory mappable) npz file.")
+	ap.add_argument("--buffer-size", type=int, default=1000000, help="Number of records per run held in memory before they are spooled to disk in --low-memory mode (default: %(default)s)")
+	args = ap.parse_args()
+
+	if not os.path.exists(args.metrics_info):
+		raise ValueError("Error: Could not find metrics info at " + args.metrics_info)
+
+	metrics_info = read_metrics_info(args.metrics_info)
+	metrics_header = generate_metrics_header(metrics_info)
+
+	print(*metrics_header, sep="\t")
+
+	columns_out = MetricsMatrixWriter(metrics_header, tmpdir=args.tmpdir) if args.npz else None
+
+	if args.low_memory:
+		merge_metrics_matrix(metrics_info, tmpdir=args.tmpdir, buffer_size=args.buffer_size, threads=args.threads, columns_out=columns_out)
+	else:
+		write_metrics_matrix(metrics_info, threads=args.threads, columns_out=columns_out)
+
+	if columns_out is not None:
+		columns_out.write(args.npz)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,16 @@
+import argparse
 import csv
 
-def get_blast_tophit(_in, _out, pident_threshold, qcov_threshold):
+
+def iter_blast_tophits(_in, pident_threshold, qcov_threshold):
+	""" Yields the first hit per query (hits come ranked by the aligner) that passes the thresholds,
+	with query and subject coverage appended. Queries must not span several input files. """
 	def calc_coverage_perc(start, end, length):
 		alen = (end - start + 1) if start < end else (start - end + 1)
 		return round(alen/length * 100, 2)
-	with open(_out, "w") as blast_out:
-		seen = set()
-		for row in csv.reader(open(_in), delimiter="\t"):
+	seen = set()
+	with open(_in) as blast_in:
+		for row in csv.reader(blast_in, delimiter="\t"):
 			if row and not row[0].startswith("#") and not row[0] in seen:
 				if len(row) < 17:
 					raise ValueError("Misformatted blastp line (ncols={ncols}) in {blastp_input}. Expected is outfmt 6 (17 cols).".format(
@@ -19,5 +23,48 @@ def get_blast_tophit(_in, _out, pident_threshold, qcov_threshold):
 					raise ValueError("Misformatted blastp line: could not parse integer values from columns 2-7 ({})".format(",".join(row[3:9])))
 				qcov, scov = calc_coverage_perc(qstart, qend, qlen), calc_coverage_perc(sstart, send, slen)
 				if float(row[2]) >= pident_threshold and qcov >= qcov_threshold:
-					print(*row, "{:.2f}".format(qcov), "{:.2f}".format(scov), sep="\t", file=blast_out)
+					yield row + ["{:.2f}".format(qcov), "{:.2f}".format(scov)]
 					seen.add(row[0])
+
+
+def read_duplicates(_in):
+	""" Reads the (seqid, duplicate seqid) pairs written by chunk_fasta --deduplicate. """
+	duplicates = dict()
+	with open(_in) as duplicates_in:
+		for line in duplicates_in:
+			seqid, duplicate = line.rstrip("\n").split("\t")
+			duplicates.setdefault(seqid, list()).append(duplicate)
+	return duplicates
+
+
+def get_blast_tophit(_in, _out, pident_threshold, qcov_threshold, duplicates=None, buffer_size=10000):
+	""" Writes the top hit per query. Identical sequences that were only searched once
+	(duplicates: {searched seqid: [duplicate seqids]}) get a copy of the top hit of the searched sequence. """
+	duplicates = duplicates if duplicates is not None else dict()
+	with open(_out, "w") as blast_out:
+		buffer = list()
+		for row in iter_blast_tophits(_in, pident_threshold, qcov_threshold):
+			line = "\t".join(row[1:]) + "\n"
+			buffer.append(row[0] + "\t" + line)
+			buffer.extend(seqid + "\t" + line for seqid in duplicates.get(row[0], list()))
+			if len(buffer) >= buffer_size:
+				blast_out.writelines(buffer)
+				buffer = list()
+		blast_out.writelines(buffer)
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Selects the top hit per query from blast/diamond outfmt 6 output (17 columns).")
+	ap.add_argument("blast_input", type=str)
+	ap.add_argument("tophit_output", type=str)
+	ap.add_argument("--pident-threshold", type=float, default=0.0)
+	ap.add_argument("--qcov-threshold", type=float, default=0.0)
+	ap.add_argument("--duplicates", type=str, help="Duplicate sequences of the queries (chunk_fasta --deduplicate), their top hits are copied from the searched query.")
+	args = ap.parse_args()
+
+	duplicates = read_duplicates(args.duplicates) if args.duplicates else None
+	get_blast_tophit(args.blast_input, args.tophit_output, args.pident_threshold, args.qcov_threshold, duplicates=duplicates)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,205 @@
+import argparse
+import bisect
+import os
+import sys
+
+from collections import namedtuple
+
+from minos.scripts.gff_reader import TOP_LEVEL_FEATURES, parse_gff_attributes, read_gene_blocks
+
+
+GffIndexEntry = namedtuple("GffIndexEntry", ["seqid", "offset", "length", "genes"])
+
+
+class GffIndex:
+	""" Byte-offset index over the gene/locus blocks of a gff (mikado.loci.gff3,
+	parse_mikado_gff output, release gffs). Each block spans from its first feature up to the
+	first feature of the next block, so header + blocks tile the file without gaps.
+	An index stored next to the gff as <gff>.gffidx is reused unless the gff changed,
+	otherwise the index is built (and written with save_index=True). """
+	suffix = ".gffidx"
+
+	def __init__(self, gff, index_file=None, top_level_features=TOP_LEVEL_FEATURES, save_index=False):
+		self.gff = gff
+		self.index_file = index_file if index_file is not None else gff + GffIndex.suffix
+		self.top_level_features = top_level_features
+		self.header_length = 0
+		self.file_size = 0
+		self.entries = list()
+		self._gene_index = None
+
+		try:
+			stat = os.stat(gff)
+		except FileNotFoundError:
+			raise FileNotFoundError("Error: Cannot find input gff at " + gff)
+
+		if not self.load(stat):
+			self.build()
+			if save_index:
+				try:
+					self.save(stat)
+				except OSError:
+					print("WARN: Cannot write gff index to {}".format(self.index_file), file=sys.stderr)
+
+	def load(self, stat):
+		try:
+			with open(self.index_file) as idx_in:
+				_, size, mtime, header_length = next(idx_in).rstrip("\n").split("\t")
+				if int(size) != stat.st_size or int(mtime) != stat.st_mtime_ns:
+					return False
+				entries = list()
+				for line in idx_in:
+					if line[0] == "#":
+						continue
+					seqid, offset, length, genes = line.rstrip("\n").split("\t")
+					entries.append(GffIndexEntry(seqid, int(offset), int(length), tuple(genes.split(",")) if genes else tuple()))
+		except (FileNotFoundError, StopIteration, ValueError):
+			return False
+
+		self.header_length, self.file_size, self.entries = int(header_length), stat.st_size, entries
+		return True
+
+	def save(self, stat):
+		with open(self.index_file, "w") as idx_out:
+			print("##gffidx", stat.st_size, stat.st_mtime_ns, self.header_length, sep="\t", file=idx_out)
+			print("#seqid", "offset", "length", "genes", sep="\t", file=idx_out)
+			for entry in self.entries:
+				print(entry.seqid, entry.offset, entry.length, ",".join(entry.genes), sep="\t", file=idx_out)
+
+	def build(self):
+		""" Single binary pass over the gff, block boundaries follow read_gene_blocks. """
+		blocks = list()
+		seqid, offset, genes, block_level, closed = None, None, list(), None, False
+
+		pos = 0
+		with open(self.gff, "rb") as gff_in:
+			for line in gff_in:
+				line_start, pos = pos, pos + len(line)
+				if line[:1] == b"#":
+					if line.startswith(b"###") and offset is not None:
+						closed = True
+					continue
+				if not line.strip():
+					continue
+
+				fields = line.split(b"\t", 9)
+				if len(fields) < 9:
+					raise ValueError("Error when parsing gff line:\n{}\n".format(line.decode()))
+				ftype = fields[2].decode()
+				level = self.top_level_features.get(ftype)
+
+				if offset is not None and (closed or (level is not None and block_level is not None and level <= block_level)):
+					blocks.append((seqid, offset, genes))
+					seqid, offset, genes, block_level = None, None, list(), None
+				closed = False
+
+				if offset is None:
+					seqid, offset = fields[0].decode(), line_start
+				if level is not None:
+					if block_level is None:
+						block_level = level
+					if ftype != "superlocus":
+						gene_id = parse_gff_attributes(fields[8].decode().rstrip("\r\n")).get("ID")
+						if gene_id is not None:
+							genes.append(gene_id)
+
+		if offset is not None:
+			blocks.append((seqid, offset, genes))
+
+		self.file_size = pos
+		self.header_length = blocks[0][1] if blocks else pos
+		ends = [block[1] for block in blocks[1:]] + [pos]
+		self.entries = [GffIndexEntry(seqid, offset, end - offset, tuple(genes)) for (seqid, offset, genes), end in zip(blocks, ends)]
+		self._gene_index = None
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __iter__(self):
+		return iter(self.entries)
+
+	def get_gene(self, gene_id):
+		if self._gene_index is None:
+			self._gene_index = {gid: entry for entry in self.entries for gid in entry.genes}
+		return self._gene_index.get(gene_id)
+
+	def get_seqid(self, seqid):
+		return [entry for entry in self.entries if entry.seqid == seqid]
+
+	def read_header(self):
+		return self.read_range(0, self.header_length)
+
+	def read_range(self, start, end):
+		with open(self.gff, "rb") as gff_in:
+			gff_in.seek(start)
+			return gff_in.read(end - start).decode()
+
+	def iter_range(self, start, end):
+		""" Streams the lines of a byte range, e.g. one of the ranges returned by split(). """
+		with open(self.gff, "rb") as gff_in:
+			gff_in.seek(start)
+			pos = start
+			for line in gff_in:
+				if pos >= end:
+					break
+				pos += len(line)
+				yield line.decode()
+
+	def read_block(self, entry):
+		return self.read_range(entry.offset, entry.offset + entry.length)
+
+	def read_gene(self, gene_id):
+		""" Returns the features of the block that contains gene_id. """
+		entry = self.get_gene(gene_id)
+		if entry is None:
+			raise ValueError("Error: gene '{}' not found in index of {}".format(gene_id, self.gff))
+		return next(read_gene_blocks(self.iter_range(entry.offset, entry.offset + entry.length), top_level_features=self.top_level_features))
+
+	def split(self, n_chunks):
+		""" Splits the blocks into at most n_chunks contiguous byte ranges of roughly equal size.
+		Returns (start, end, first_entry, last_entry + 1) tuples. The file header is not included. """
+		if not self.entries or n_chunks < 1:
+			return list()
+
+		starts = [entry.offset for entry in self.entries]
+		body_size = self.file_size - self.header_length
+		chunks, first = list(), 0
+		for k in range(1, n_chunks + 1):
+			if first == len(starts):
+				break
+			if k == n_chunks:
+				last = len(starts)
+			else:
+				target = self.header_length + body_size * k // n_chunks
+				# cut at the block boundary closest to the target, taking at least one block
+				last = max(first + 1, bisect.bisect_left(starts, target))
+				if last < len(starts) and last > first + 1 and target - starts[last - 1] < starts[last] - target:
+					last -= 1
+			end = starts[last] if last < len(starts) else self.file_size
+			chunks.append((starts[first], end, first, last))
+			first = last
+
+		return chunks
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Builds a byte-offset gene block index (<gff>.gffidx) for a gff.")
+	ap.add_argument("input_gff", type=str)
+	ap.add_argument("--gene", type=str, help="Print the gene block containing this gene ID.")
+	ap.add_argument("--split", type=int, help="Print N balanced byte ranges aligned to gene block boundaries.")
+	args = ap.parse_args()
+
+	index = GffIndex(args.input_gff, save_index=True)
+
+	if args.gene is not None:
+		entry = index.get_gene(args.gene)
+		if entry is None:
+			raise ValueError("Error: gene '{}' not found in {}".format(args.gene, args.input_gff))
+		sys.stdout.write(index.read_block(entry))
+	elif args.split is not None:
+		for start, end, first, last in index.split(args.split):
+			print(start, end, last - first, sep="\t")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,125 @@
+import re
+
+
+GFF_FIELDS = ("seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes")
+
+
+def parse_gff_attributes(attributes):
+	attrib = dict()
+	for item in attributes.strip("; ").split(";"):
+		key, sep, value = item.partition("=")
+		if sep:
+			attrib[key.strip()] = value
+	return attrib
+
+
+GTF_ATTRIBUTE_REGEX = re.compile(r"([^\s;]+)\s+\"?([^\";]*)\"?\s*;?")
+
+
+def parse_gtf_attributes(attributes):
+	return {item.group(1): item.group(2).strip() for item in GTF_ATTRIBUTE_REGEX.finditer(attributes)}
+
+
+class GffFeature:
+	# column 9 is kept as the raw string and only turned into a dict on first access
+	__slots__ = ("seqid", "source", "type", "start", "end", "score", "strand", "phase", "extra", "_raw_attributes", "_attributes")
+
+	parse_attributes = staticmethod(parse_gff_attributes)
+
+	def __init__(self, fields):
+		if len(fields) < 9:
+			raise ValueError("Error when parsing gff line:\n{}\n".format("\t".join(fields)))
+		(self.seqid, self.source, self.type, self.start, self.end,
+			self.score, self.strand, self.phase, self._raw_attributes) = fields[:9]
+		self.extra = fields[9:]
+		self._attributes = None
+
+	@classmethod
+	def from_line(cls, line):
+		return cls(line.split("\t"))
+
+	@property
+	def attributes(self):
+		if self._attributes is None:
+			self._attributes = self.parse_attributes(self._raw_attributes)
+		return self._attributes
+
+	@attributes.setter
+	def attributes(self, attributes):
+		self._raw_attributes, self._attributes = attributes, None
+
+	@property
+	def raw_attributes(self):
+		return self._raw_attributes
+
+	def get_attrib(self, key, default=None):
+		return self.attributes.get(key, default)
+
+	def get_coords(self):
+		start, end = int(self.start), int(self.end)
+		return (start, end) if start < end else (end, start)
+
+	def __str__(self):
+		row = "\t".join((self.seqid, self.source, self.type, self.start, self.end, self.score, self.strand, self.phase, self._raw_attributes))
+		if self.extra:
+			row += "\t" + "\t".join(self.extra)
+		return row
+
+
+class GtfFeature(GffFeature):
+	__slots__ = ()
+	parse_attributes = staticmethod(parse_gtf_attributes)
+
+
+def read_gff(gff, feature_class=GffFeature, feature_types=None, keep_comments=False):
+	""" Streams features from a gff/gtf file (path or open stream).
+	Lines of a type not in feature_types are skipped before a record is built,
+	comment lines are yielded as plain strings if keep_comments is set. """
+	if isinstance(gff, str):
+		with open(gff) as gff_in:
+			yield from read_gff(gff_in, feature_class=feature_class, feature_types=feature_types, keep_comments=keep_comments)
+		return
+
+	for line in gff:
+		line = line.rstrip("\r\n")
+		if not line:
+			continue
+		if line[0] == "#":
+			if keep_comments:
+				yield line
+			continue
+		fields = line.split("\t")
+		if feature_types is not None and len(fields) > 2 and fields[2] not in feature_types:
+			continue
+		yield feature_class(fields)
+
+
+def read_gtf(gtf, feature_types=None, keep_comments=False):
+	return read_gff(gtf, feature_class=GtfFeature, feature_types=feature_types, keep_comments=keep_comments)
+
+
+# top-level features and their nesting level, a block is closed by a feature
+# at the same or a higher level than the one that opened it (superlocus > gene)
+TOP_LEVEL_FEATURES = {"superlocus": 0, "gene": 1, "ncRNA_gene": 1}
+
+
+def read_gene_blocks(gff, feature_class=GffFeature, top_level_features=TOP_LEVEL_FEATURES):
+	""" Groups the features of a gff that is organised in gene blocks (Mikado, genometools)
+	into lists. A block ends at a ### sentinel or at the next top-level feature. """
+	block, block_level = list(), None
+	for feature in read_gff(gff, feature_class=feature_class, keep_comments=True):
+		if isinstance(feature, str):
+			if feature.startswith("###") and block:
+				yield block
+				block, block_level = list(), None
+		else:
+			level = top_level_features.get(feature.type)
+			if level is not None:
+				if block and block_level is not None and level <= block_level:
+					yield block
+					block, block_level = list(), None
+				if block_level is None:
+					block_level = level
+			block.append(feature)
+	if block:
+		yield block
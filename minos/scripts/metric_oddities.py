@@ -1,24 +1,81 @@
 import sys
 import csv
+import multiprocessing
 from collections import Counter
+from operator import itemgetter
+
+import numpy as np
+
+from minos.scripts.collapse_metrics import check_expression, get_expression_metrics, parse_expression
 
 # for testing
 METRIC_ODDITIES = ['{five_utr_length} >= 10000', '{five_utr_num} >= 5', '{three_utr_length} >= 10000', '{three_utr_num} >= 4', 'not {is_complete}', 'not {has_start_codon}', 'not {has_stop_codon}', '{max_exon_length} >= 10000', '{max_intron_length} >= 500000', '{min_exon_length} <= 5', '{min_intron_length} <= 5', '{selected_cds_fraction} <= 0.3', '{canonical_intron_proportion} != 1', '{non_verified_introns_num} >= 1', 'not {only_non_canonical_splicing}', '{proportion_verified_introns} <= 0.5', '{suspicious_splicing}']
 
 
+def to_typed_column(values):
+	""" True/False columns become boolean arrays, everything else is read as float. """
+	try:
+		return np.fromiter(map(float, values), dtype=float, count=len(values))
+	except ValueError:
+		if not set(values).issubset({"True", "False"}):
+			raise
+		return np.fromiter((value == "True" for value in values), dtype=bool, count=len(values))
+
+
+def read_metric_columns(metric_file, metrics):
+	""" Loads tid, original_source and the requested metric columns of a Mikado metrics tsv. """
+	columns = ["tid", "original_source"] + sorted(metrics)
+	with open(metric_file) as metrics_in:
+		reader = csv.reader(metrics_in, delimiter="\t")
+		header = next(reader, list())
+		try:
+			get_columns = itemgetter(*(header.index(col) for col in columns))
+		except ValueError:
+			missing = [col for col in columns if col not in header]
+			raise ValueError("Error: Cannot find column(s) {} in metrics file {}".format(", ".join(missing), metric_file))
+		rows = [get_columns(row) for row in reader]
+
+	values = list(zip(*rows)) if rows else [tuple() for col in columns]
+	data = {"tid": np.array(values[0], dtype=str), "original_source": np.array(values[1], dtype=str)}
+	for col, col_values in zip(columns[2:], values[2:]):
+		try:
+			data[col] = to_typed_column(col_values)
+		except ValueError:
+			raise ValueError("Error: Cannot interpret column {} in metrics file {} as numbers or True/False".format(col, metric_file))
+	return data
+
+
+def count_oddities(columns, oddities, expressions, transcript_data=None):
+	""" Evaluates each oddity over the full columns and counts the hits per original_source. """
+	if transcript_data is not None:
+		keep = np.fromiter((tid in transcript_data for tid in columns["tid"]), dtype=bool, count=len(columns["tid"]))
+		columns = {col: values[keep] for col, values in columns.items()}
+
+	n_rows = len(columns["tid"])
+	# sources in order of first appearance
+	sources, first_seen, source_index = np.unique(columns["original_source"], return_index=True, return_inverse=True)
+	sources, source_order = sources.tolist(), np.argsort(first_seen)
+
+	data = {sources[i]: Counter({oddity: 0 for oddity in oddities}) for i in source_order}
+	for oddity, expression in zip(oddities, expressions):
+		hits = np.broadcast_to(check_expression(expression, columns), n_rows)
+		for i, count in enumerate(np.bincount(source_index.ravel(), weights=hits, minlength=len(sources))):
+			data[sources[i]][oddity] += int(count)
+	return data
+
+
+def parse_metric_file(args):
+	""" Loads a metrics file once and returns the oddity counts for each transcript set. """
+	metric_file, oddities, transcript_sets = args
+	expressions = [parse_expression(oddity) for oddity in oddities]
+	columns = read_metric_columns(metric_file, set().union(*(get_expression_metrics(exp) for exp in expressions)))
+	return [count_oddities(columns, oddities, expressions, transcript_data=tset) for tset in transcript_sets]
+
+
 class MetricOddityParser:
 
 	def parse_metrics(self, metric_file, transcript_data=None):
-		data = dict()
-		for row in csv.DictReader(open(metric_file), delimiter="\t"):
-			if transcript_data is None or row["tid"] in transcript_data:
-				counts = [oddity for oddity in self.oddities if eval(oddity.format(**row))]
-				source = row["original_source"]
-				data.setdefault(
-					source,
-					Counter({oddity: 0 for oddity in self.oddities})
-				).update(counts)
-		return data
+		return parse_metric_file((metric_file, self.oddities, [transcript_data]))[0]
 
 	def calc_stats(self, data, collapse=True):
 		stats = dict()
@@ -34,18 +91,28 @@ class MetricOddityParser:
 			stats[oddity.replace("{", "").replace("}", "")] = row
 		return stats
 
-	def __init__(self, final_metric_file, subloci_metric_file, monoloci_metric_file, oddities, transcript_data=None):
+	def __init__(self, final_metric_file, subloci_metric_file, monoloci_metric_file, oddities, transcript_data=None, threads=1):
 		self.oddities = oddities
-		self.data = self.calc_stats(self.parse_metrics(final_metric_file, transcript_data=transcript_data))
-		self.header = ["metric", "final_set"]
+
+		final_sets = [transcript_data]
 		if transcript_data is not None:
 			hi_conf_pc = {k: v for k, v in transcript_data.items() if v[0] == "High" and v[1] == "protein_coding_gene"}
+			final_sets.append(hi_conf_pc)
+
+		jobs = [(final_metric_file, oddities, final_sets), (subloci_metric_file, oddities, [None]), (monoloci_metric_file, oddities, [None])]
+		if threads > 1:
+			with multiprocessing.Pool(min(threads, len(jobs))) as pool:
+				final_data, (sub_data,), (mono_data,) = pool.map(parse_metric_file, jobs)
+		else:
+			final_data, (sub_data,), (mono_data,) = map(parse_metric_file, jobs)
+
+		self.data = self.calc_stats(final_data[0])
+		self.header = ["metric", "final_set"]
+		if transcript_data is not None:
 			self.header.append("final_set_hiconf_protein_coding")
-			for metric, values in self.calc_stats(self.parse_metrics(final_metric_file, transcript_data=hi_conf_pc)).items():
+			for metric, values in self.calc_stats(final_data[1]).items():
 				self.data[metric].extend(values)
 
-		sub_data = self.parse_metrics(subloci_metric_file)
-		mono_data = self.parse_metrics(monoloci_metric_file)
 		combined = dict()
 		for tset in [sub_data, mono_data]:
 			for source, counts in tset.items():
@@ -0,0 +1,140 @@
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+# values of the metrics matrix are written as '%.4f', i.e. they are exact in units of 1e-4
+FIXED_POINT_SCALE = 10000
+INT32_MAX = np.iinfo(np.int32).max
+
+
+def write_npy_member(archive, name, dtype, n_rows, blocks):
+	""" Writes a 1-d npy array of n_rows values into an open zip archive from blocks of values. """
+	with archive.open(name + ".npy", "w", force_zip64=True) as member:
+		np.lib.format.write_array_header_1_0(member, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (n_rows,)})
+		for block in blocks:
+			member.write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+
+
+class MetricsMatrixWriter:
+	""" Streams the rows of the metrics matrix into typed columns and writes them to an
+	uncompressed npz (transcript ids + one column per metric), so that they can be memory mapped.
+	Columns are stored as 1e-4 fixed point int32, which restores the float values of the '%.4f' tsv
+	exactly (float32 would not). Columns with values that do not fit (nan, very large values, more
+	than four decimals) are stored as float64.
+	Each batch of rows is appended to one spool file per column (in tmpdir), the npz members
+	are then written from the spool files block by block, so the matrix is never held in memory. """
+	def __init__(self, header, batch_size=100000, tmpdir=None):
+		self.header = header
+		self.batch_size = batch_size
+		self.tids, self.batch = list(), list()
+		self.n_rows, self.tid_length = 0, 1
+		self.fixed_point = [True for col in header[1:]]
+		self._spool_dir = tempfile.TemporaryDirectory(dir=tmpdir, prefix="metrics_matrix.")
+		self._tid_spool = open(os.path.join(self._spool_dir.name, "tid"), "wb")
+		self._column_spools = [open(os.path.join(self._spool_dir.name, "c{}".format(i)), "wb") for i, col in enumerate(header[1:])]
+
+	def add(self, row):
+		self.tids.append(row[0])
+		self.batch.append("\t".join(map(str, row[1:])))
+		if len(self.batch) >= self.batch_size:
+			self.flush()
+
+	def flush(self):
+		if not self.batch:
+			return
+		ncols = len(self.header) - 1
+		values = "\t".join(self.batch).split("\t") if ncols else list()
+		if len(values) != len(self.batch) * ncols:
+			raise ValueError("Error: Metrics matrix rows do not match the header ({} columns)".format(ncols))
+		values = np.fromiter(map(float, values), dtype=float, count=len(values)).reshape(len(self.batch), ncols)
+
+		for i, (col, spool) in enumerate(zip(values.T, self._column_spools)):
+			if self.fixed_point[i]:
+				fixed = np.rint(col * FIXED_POINT_SCALE)
+				self.fixed_point[i] = bool(np.all(np.isfinite(fixed) & (np.abs(fixed) <= INT32_MAX)) and np.array_equal(fixed / FIXED_POINT_SCALE, col))
+			np.ascontiguousarray(col).tofile(spool)
+
+		tids = [tid.encode() for tid in self.tids]
+		self.tid_length = max([self.tid_length] + [len(tid) for tid in tids])
+		self._tid_spool.write(b"".join(tid + b"\n" for tid in tids))
+		self.n_rows += len(self.batch)
+		self.tids, self.batch = list(), list()
+
+	def _read_spool(self, i):
+		if not self.n_rows:
+			return np.zeros(0)
+		return np.memmap(self._column_spools[i].name, dtype=float, mode="r", shape=(self.n_rows,))
+
+	def write(self, path):
+		self.flush()
+		for spool in [self._tid_spool] + self._column_spools:
+			spool.close()
+
+		try:
+			with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive, open(self._tid_spool.name, "rb") as tids_in:
+				tid_blocks = iter(lambda: [tid.rstrip(b"\n") for tid in tids_in.readlines(1 << 22)], [])
+				write_npy_member(archive, "tid", np.dtype("S{}".format(self.tid_length)), self.n_rows, tid_blocks)
+				write_npy_member(archive, "columns", np.array(self.header[1:], dtype=str).dtype, len(self.header) - 1, [np.array(self.header[1:], dtype=str)])
+
+				for i, fixed_point in enumerate(self.fixed_point):
+					values = self._read_spool(i)
+					blocks = (values[start:start + self.batch_size] for start in range(0, len(values), self.batch_size))
+					if fixed_point:
+						blocks = (np.rint(block * FIXED_POINT_SCALE).astype(np.int32) for block in blocks)
+					write_npy_member(archive, "c{}".format(i), np.dtype(np.int32 if fixed_point else float), self.n_rows, blocks)
+					del values, blocks
+		finally:
+			self._spool_dir.cleanup()
+
+
+def load_npz(path, mmap_mode="r"):
+	""" np.load ignores mmap_mode for npz archives. The members of an uncompressed npz
+	are plain npy files though, so they can be memory mapped at their offset in the archive. """
+	arrays = dict()
+	with zipfile.ZipFile(path) as archive, open(path, "rb") as npz_in:
+		for member in archive.infolist():
+			name = member.filename[:-4] if member.filename.endswith(".npy") else member.filename
+			if member.compress_type != zipfile.ZIP_STORED:
+				with archive.open(member) as member_in:
+					arrays[name] = np.lib.format.read_array(member_in, allow_pickle=False)
+				continue
+
+			# skip the local file header, its name and extra field lengths can differ from the central directory
+			npz_in.seek(member.header_offset + 26)
+			name_length, extra_length = np.frombuffer(npz_in.read(4), dtype="<u2")
+			npz_in.seek(member.header_offset + 30 + int(name_length) + int(extra_length))
+			if np.lib.format.read_magic(npz_in) == (1, 0):
+				shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_in)
+			else:
+				shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_in)
+			if dtype.hasobject:
+				raise ValueError("Error: Cannot memory map object array {} in {}".format(name, path))
+			if not shape or 0 in shape:
+				arrays[name] = np.zeros(shape, dtype=dtype)
+			else:
+				arrays[name] = np.memmap(npz_in.name, dtype=dtype, mode=mmap_mode, offset=npz_in.tell(), shape=shape, order="F" if fortran_order else "C")
+	return arrays
+
+
+class MetricsMatrix:
+	""" Read access to the columnar metrics matrix written by MetricsMatrixWriter. """
+	def __init__(self, path):
+		arrays = load_npz(path)
+		self.tids = [tid.decode() for tid in arrays["tid"]]
+		self.columns = [str(col) for col in arrays["columns"]]
+		self._data = {col: arrays["c{}".format(i)] for i, col in enumerate(self.columns)}
+
+	def __len__(self):
+		return len(self.tids)
+
+	def column(self, col, rows=None):
+		""" Returns the float64 values of a metric column, or of the given rows (indices) only. """
+		data = self._data[col]
+		if rows is not None:
+			data = data[rows]
+		if data.dtype == np.int32:
+			return data / FIXED_POINT_SCALE
+		return np.asarray(data, dtype=float)
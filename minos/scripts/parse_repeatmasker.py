@@ -1,36 +1,104 @@
-import csv
+import itertools
+import math
+import multiprocessing
+import os
 import re
 
-#awk '$3 == "match_part"' {input[0]} | sed -e 's/\\tmatch_part\\t/\\texon\\t/' -e 's/\\t[+-]\\t/\\t.\\t/' > {output[0]}
-def parse_repeatmasker(_in, _out, _out2, runid):
+
+TARGET_QUOTED_REGEX = re.compile(r'Target\s+"([^"]+)')
+TARGET_ATTRIB_REGEX = re.compile(r"Target\s*=\s*([^;]+)")
+NAME_REGEX = re.compile(r"Name\s*=\s*([^;]+)")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+def get_chunks(_in, n_chunks):
+	""" Splits a file into n_chunks byte ranges that start and end at line boundaries. """
+	size = os.path.getsize(_in)
+	bounds = [0]
+	with open(_in, "rb") as f_in:
+		for k in range(1, n_chunks):
+			pos = max(bounds[-1], size * k // n_chunks)
+			if pos > 0:
+				f_in.seek(pos - 1)
+				f_in.readline()
+				pos = f_in.tell()
+			bounds.append(min(pos, size))
+	bounds.append(size)
+	return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def read_rows(_in, start, end):
+	with open(_in, "rb") as f_in:
+		f_in.seek(start)
+		data = f_in.read(end - start).decode()
+	for line in data.split("\n"):
+		line = line.rstrip("\r")
+		if line and not line.startswith("#"):
+			row = line.split("\t")
+			if len(row) > 1 and row[1] == "RepeatMasker":
+				yield row
+
+
+def count_repeats(job):
+	_in, start, end = job
+	return sum(1 for row in read_rows(_in, start, end))
+
+
+def convert_repeats(job):
+	""" Converts the RepeatMasker rows of a byte range, numbering them from offset + 1.
+	Returns the number of repeats, the converted gff and the unstranded exon gff blocks. """
+	_in, start, end, runid, offset = job
 	source = tag = runid
-	name_tag, rep_counter = "RM", 0
+	name_tag, rep_counter = "RM", offset
+	exons, exons_unstranded = list(), list()
+	for row in read_rows(_in, start, end):
+		rep_counter += 1
+		target = TARGET_QUOTED_REGEX.search(row[8]) or TARGET_ATTRIB_REGEX.search(row[8])
+		if target is None:
+			raise ValueError("Cannot parse Target from " + row[8])
+		target = WHITESPACE_REGEX.sub("_", target.group(1))
+		note = ";Note={}".format(target)
+		name = NAME_REGEX.search(row[8])
+		if name is not None:
+			name = WHITESPACE_REGEX.sub("_", name.group(1))
+		else:
+			name, note = target, ""
+		row[1] = source
+		row[5] = "{:0.0f}".format(float(row[5]))
+		row[2] = "match"
+		rep_id = "{tag}:{name_tag}{counter}".format(tag=tag, name_tag=name_tag, counter=rep_counter)
+		exons.append("\t".join(row[:8]) + "\tID={rep_id};Name={name}{note}\n".format(rep_id=rep_id, name=name, note=note))
+		attrib = "ID={rep_id}-exon1;Parent={rep_id}\n".format(rep_id=rep_id)
+		row[2] = "match_part"
+		exons.append("\t".join(row[:8]) + "\t" + attrib)
+		exons.append("###\n")
+		row[2] = "exon"
+		row[6] = "."
+		exons_unstranded.append("\t".join(row[:8]) + "\t" + attrib)
+	return rep_counter - offset, "".join(exons), "".join(exons_unstranded)
+
+
+#awk '$3 == "match_part"' {input[0]} | sed -e 's/\\tmatch_part\\t/\\texon\\t/' -e 's/\\t[+-]\\t/\\t.\\t/' > {output[0]}
+def parse_repeatmasker(_in, _out, _out2, runid, threads=1, chunk_size=1 << 26):
+	""" Converts RepeatMasker gff rows into match/match_part features (_out) and unstranded exons (_out2).
+	The input is processed in byte-range chunks of about chunk_size, in parallel with threads > 1.
+	Repeats are numbered (RM<n>) in input order, each chunk starts from the number of repeats before it. """
+	n_chunks = max(threads, math.ceil(os.path.getsize(_in) / chunk_size), 1)
+	chunks = get_chunks(_in, n_chunks)
+
 	with open(_out, "w") as out_exons, open(_out2, "w") as out_exons_unstranded:
-		for row in csv.reader(open(_in), delimiter="\t"):
-			if row and not row[0].startswith("#") and row[1] == "RepeatMasker":
-				rep_counter += 1
-				try:
-					target = re.search('Target\s+"([^"]+)', row[8]).group(1)
-				except:
-					try:
-			 			target = re.search('Target\s*=\s*([^;]+)', row[8]).group(1)
-					except:
-						raise ValueError("Cannot parse Target from " + row[8])
-				target = re.sub("\s+", "_", target)
-				note = ";Note={}".format(target)
-				try:
-					name = re.sub("\s+", "_", re.search('Name\s*=\s*([^;]+)', row[8]).group(1))
-				except:
-					name, note = target, ""
-				row[1] = source
-				row[5] = "{:0.0f}".format(float(row[5]))
-				row[2] = "match"
-				attrib = "ID={tag}:{name_tag}{counter};Name={name}{note}".format(tag=tag, name_tag=name_tag, counter=rep_counter, name=name, note=note)
-				print(*row[:8], attrib, sep="\t", file=out_exons, flush=True)	
-				row[2] = "match_part"
-				attrib = "ID={tag}:{name_tag}{counter}-exon1;Parent={tag}:{name_tag}{counter}".format(tag=tag, name_tag=name_tag, counter=rep_counter)
-				print(*row[:8], attrib, sep="\t", file=out_exons, flush=True)
-				print("###", file=out_exons, flush=True)
-				row[2] = "exon"
-				row[6] = "."
-				print(*row[:8], attrib, sep="\t", file=out_exons_unstranded, flush=True)
+		if threads > 1 and len(chunks) > 1:
+			with multiprocessing.Pool(min(threads, len(chunks))) as pool:
+				counts = pool.map(count_repeats, [(_in, start, end) for start, end in chunks])
+				offsets = itertools.accumulate([0] + counts[:-1])
+				jobs = [(_in, start, end, runid, offset) for (start, end), offset in zip(chunks, offsets)]
+				for n_repeats, exons, exons_unstranded in pool.imap(convert_repeats, jobs):
+					out_exons.write(exons)
+					out_exons_unstranded.write(exons_unstranded)
+		else:
+			offset = 0
+			for start, end in chunks:
+				n_repeats, exons, exons_unstranded = convert_repeats((_in, start, end, runid, offset))
+				out_exons.write(exons)
+				out_exons_unstranded.write(exons_unstranded)
+				offset += n_repeats
@@ -0,0 +1,51 @@
+from minos.scripts.gff_reader import parse_gtf_attributes
+
+
+TX2GENE_FEATURES = {"mrna", "ncrna", "transcript"}
+
+
+def format_coords(tid, seqid, start, end):
+	return "{tid}\t{seq}:{start}..{end}\n".format(tid=tid, seq=seqid, start=start, end=end)
+
+
+def prepare_fanout(_in, coords_out, exons_out, tx2gene_maps=None, buffer_size=1 << 20):
+	""" Reads the mikado prepare gtf once and writes the transcript coordinates (as extract_coords),
+	the exons with ID="<tid>.exon<n>";Parent="<tid>" attributes and the transcript->gene maps
+	({label: path}, transcripts are assigned by their source, which mikado prepare sets to the label
+	of their transcript model run). The maps only contain transcripts that passed mikado prepare,
+	the label prefix is removed from the gene ids. Outputs are written through buffered writers of buffer_size. """
+	outputs = [open(path, "w", buffering=buffer_size) for path in (coords_out, exons_out)]
+	tx2gene_files = {label: open(path, "w", buffering=buffer_size) for label, path in (tx2gene_maps or dict()).items()}
+
+	try:
+		coords_file, exons_file = outputs
+		exon = 1
+		with open(_in, buffering=buffer_size) as gtf_in:
+			for line in gtf_in:
+				if line[0] == "#":
+					continue
+				row = line.rstrip("\r\n").split("\t")
+				if len(row) < 9:
+					if line.strip():
+						raise ValueError("Error when parsing gff line:\n{}\n".format(line))
+					continue
+				ftype = row[2].lower()
+				if ftype == "exon":
+					tid = parse_gtf_attributes(row[8])["transcript_id"].strip('"')
+					row[8] = 'ID="{tid}.exon{exon}";Parent="{tid}";'.format(tid=tid, exon=exon)
+					exon += 1
+					exons_file.write("\t".join(row) + "\n")
+				elif "rna" in ftype or ftype in TX2GENE_FEATURES:
+					attrib = parse_gtf_attributes(row[8])
+					tid = attrib["transcript_id"].strip('"')
+					if "rna" in ftype:
+						coords_file.write(format_coords(tid, row[0], row[3], row[4]))
+					if tx2gene_files and ftype in TX2GENE_FEATURES:
+						tx2gene_out = tx2gene_files.get(row[1])
+						if tx2gene_out is None:
+							raise ValueError("Error: Transcript {} has source '{}', which is not a transcript model label ({})".format(tid, row[1], ", ".join(tx2gene_files)))
+						prefix, gid = row[1] + "_", attrib["gene_id"]
+						tx2gene_out.write("{}\t{}\n".format(tid, gid[len(prefix):] if gid.startswith(prefix) else gid))
+	finally:
+		for f in outputs + list(tx2gene_files.values()):
+			f.close()
@@ -0,0 +1,119 @@
+import re
+import warnings
+
+import numpy as np
+
+from minos.scripts.parse_cbed_stats import format_coverage_record
+
+
+# coordinates are offset by <scaffold index> * SCAFFOLD_OFFSET, so that the intervals
+# of all scaffolds can be sorted and searched together without crossing scaffold borders
+SCAFFOLD_OFFSET = 1 << 40
+PARENT_REGEX = re.compile(r"(?:^|;)\s*Parent\s*=([^;]*)")
+
+
+def read_intervals(gff, seqid_index, attributes=False):
+	""" Reads the (offset) closed intervals of a gff, with start <= end, in file order.
+	Scaffolds are numbered in seqid_index, which is extended by unseen scaffolds.
+	The file is streamed twice (coordinates, then scaffolds and attributes) instead of being held in memory.
+	Returns the scaffold indices, starts, ends and (if attributes is set) the attribute strings. """
+	with open(gff) as gff_in, warnings.catch_warnings():
+		# loadtxt warns about files without data rows
+		warnings.simplefilter("ignore", UserWarning)
+		coords = np.loadtxt(gff_in, delimiter="\t", usecols=(3, 4), dtype=np.int64, comments="#", ndmin=2).reshape(-1, 2)
+
+	attribs = list() if attributes else None
+	def iter_scaffolds(gff_in):
+		for line in gff_in:
+			if line[0] == "#" or not line.rstrip("\r\n"):
+				continue
+			seqid, *row = line.rstrip("\r\n").split("\t", 8)
+			if attribs is not None:
+				attribs.append(row[7])
+			yield seqid_index.setdefault(seqid, len(seqid_index))
+
+	with open(gff) as gff_in:
+		scaffolds = np.fromiter(iter_scaffolds(gff_in), dtype=np.int64)
+	if len(scaffolds) != len(coords):
+		raise ValueError("Error: Cannot parse the coordinates of all intervals in " + gff)
+	offsets = scaffolds * SCAFFOLD_OFFSET
+	return scaffolds, coords.min(axis=1) + offsets, coords.max(axis=1) + offsets, attribs
+
+
+def read_exons(exon_gff, seqid_index):
+	""" Reads the exons (prepare_fanout) in file order.
+	Returns the parent ids, the scaffold of the first exon of each parent and
+	the parent index, start and end of each exon. """
+	scaffolds, starts, ends, attributes = read_intervals(exon_gff, seqid_index, attributes=True)
+	seqids = list(seqid_index)
+	parents, parent_index, parent_scaffold = list(), dict(), list()
+	exon_parent = np.zeros(len(scaffolds), dtype=np.int64)
+	for i, (scaffold, attrib) in enumerate(zip(scaffolds.tolist(), attributes)):
+		parent = PARENT_REGEX.search(attrib)
+		if parent is None:
+			raise ValueError("Error: Exon without Parent in {}: {}".format(exon_gff, attrib))
+		parent = parent.group(1)
+		pid = parent_index.get(parent)
+		if pid is None:
+			pid = parent_index[parent] = len(parents)
+			parents.append(parent)
+			parent_scaffold.append(seqids[scaffold])
+		exon_parent[i] = pid
+	return parents, parent_scaffold, exon_parent, starts, ends
+
+
+def merge_intervals(starts, ends):
+	""" Returns the union of the closed intervals as sorted, non-overlapping intervals. """
+	if not len(starts):
+		return starts, ends
+	order = np.argsort(starts, kind="stable")
+	starts, ends = starts[order], np.maximum.accumulate(ends[order])
+	# a new block starts where an interval begins after the end of everything before it
+	first = np.flatnonzero(np.concatenate(([True], starts[1:] > ends[:-1])))
+	last = np.append(first[1:] - 1, len(starts) - 1)
+	return starts[first], ends[last]
+
+
+def covered_bases(starts, ends, block_starts, block_ends):
+	""" Number of bases of each closed interval (starts[i], ends[i]) covered by the sorted,
+	non-overlapping closed intervals (block_starts, block_ends). """
+	cumulative = np.concatenate(([0], np.cumsum(block_ends - block_starts + 1)))
+	# first block ending at/after the start and last block beginning at/before the end
+	first = np.searchsorted(block_ends, starts, side="left")
+	last = np.searchsorted(block_starts, ends, side="right") - 1
+	hit = first <= last
+	first, last = first[hit], last[hit]
+	covered = np.zeros(len(starts), dtype=np.int64)
+	covered[hit] = (
+		cumulative[last + 1] - cumulative[first]
+		- np.maximum(0, starts[hit] - block_starts[first])
+		- np.maximum(0, block_ends[last] - ends[hit])
+	)
+	return covered
+
+
+def repeat_coverage(exon_gff, repeat_gffs, outputs):
+	""" Computes the repeat coverage of each transcript for one or more repeat tracks
+	(no_strand.exon.gff from parse_repeatmasker) and writes the parse_cbed table per track.
+	The exons are read once, the coverage of an exon is the number of its bases overlapped
+	by any repeat of the track on the same scaffold (as reported by coverageBed). """
+	seqid_index = dict()
+	parents, parent_scaffold, exon_parent, exon_start, exon_end = read_exons(exon_gff, seqid_index)
+
+	trans_bps = np.bincount(exon_parent, weights=exon_end - exon_start + 1, minlength=len(parents)).astype(np.int64).tolist()
+	parent_start = np.full(len(parents), np.iinfo(np.int64).max, dtype=np.int64)
+	parent_end = np.zeros(len(parents), dtype=np.int64)
+	np.minimum.at(parent_start, exon_parent, exon_start % SCAFFOLD_OFFSET)
+	np.maximum.at(parent_end, exon_parent, exon_end % SCAFFOLD_OFFSET)
+	parent_start, parent_end = parent_start.tolist(), parent_end.tolist()
+
+	for repeat_gff, _out in zip(repeat_gffs, outputs):
+		_, starts, ends, _ = read_intervals(repeat_gff, seqid_index)
+		exon_covered = covered_bases(exon_start, exon_end, *merge_intervals(starts, ends))
+		covered_bps = np.bincount(exon_parent, weights=exon_covered, minlength=len(parents)).astype(np.int64).tolist()
+
+		with open(_out, "w") as cov_out:
+			cov_out.writelines(
+				format_coverage_record(parent, trans, covered, scaffold, start, end)
+				for parent, trans, covered, scaffold, start, end in zip(parents, trans_bps, covered_bps, parent_scaffold, parent_start, parent_end)
+			)
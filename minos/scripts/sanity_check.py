@@ -1,8 +1,8 @@
-import csv
 import os
 import argparse
 import sys
-import csv
+
+from minos.scripts.gff_reader import read_gff, read_gene_blocks
 
 
 class GffValidator():
@@ -16,62 +16,72 @@ class GffValidator():
 		except:
 			raise ValueError("Fatal Error: Cannot parse {} {} field.".format(feature, key))
 
-	def __init__(self, gff_input):
+	@staticmethod
+	def collect_gene_spans(features, gene_info=None):
+		gene_info = dict() if gene_info is None else gene_info
+		for feature in features:
+			if feature.type in {"mRNA", "ncRNA"}:
+				start, end = feature.get_coords()
+
+				gid = GffValidator.get_attrib("Parent", feature.attributes, feature.type).strip()
+				ginfo = gene_info.get(gid, None)
+				if ginfo is None:
+					gene_info[gid] = {
+						"start": start,
+						"end": end
+					}
+				else:
+					ginfo["start"] = min(start, ginfo["start"])
+					ginfo["end"] = max(end, ginfo["end"])
+		return gene_info
+
+	def __init__(self, gff_input, stream=False):
 		self.gene_info = dict()
 		self.gff_input = gff_input
-
-		for row in csv.DictReader(open(gff_input), fieldnames=self.gff_header, delimiter="\t"):
-			if not row["seqid"].startswith("#"):
-				if row["type"] in {"mRNA", "ncRNA"}:
-					start, end = int(row["start"]), int(row["end"])
-					start, end = (start, end) if start < end else (end, start)
-					attrib = dict(item.split("=") for item in row["attributes"].strip(";").split(";"))
-
-					gid = GffValidator.get_attrib("Parent", attrib, row["type"]).strip()
-					ginfo = self.gene_info.get(gid, None)
-					if ginfo is None:
-						self.gene_info[gid] = {
-							"start": start,
-							"end": end
-						}
-					else:
-						ginfo["start"] = min(start, ginfo["start"])
-						ginfo["end"] = max(end, ginfo["end"])
-	
+		self.stream = stream
+		self.print_guard = False
+
+		# in streaming mode gene spans are computed per gene block in process()
+		if not stream:
+			GffValidator.collect_gene_spans(read_gff(gff_input, feature_types={"mRNA", "ncRNA"}), gene_info=self.gene_info)
+
+	def write_features(self, features, gene_info):
+		for feature in features:
+			if feature.type == "gene":
+				start, end = feature.get_coords()
+				gid = GffValidator.get_attrib("ID", feature.attributes, feature.type).strip()
+				ginfo = gene_info.get(gid, None)
+				if ginfo is None:
+					raise ValueError("Error: Something is really wrong. Gene '{}' was not processed before.".format(gid))
+
+				start_changed, end_changed = start != ginfo["start"], end != ginfo["end"]
+				if start_changed or end_changed:
+					print("WARN:", gid, "start_changed({} => {})".format(start, ginfo["start"]), "end_changed({} => {})".format(end, ginfo["end"]), sep="\t", file=sys.stderr)
+				if self.print_guard:
+					print("###")
+				self.print_guard = True
+				feature.start, feature.end = str(start), str(end)
+
+			print(feature)
 
 	def process(self):
 		print("##gff-version 3")
-		print_guard = False
-		for row in csv.DictReader(open(self.gff_input), fieldnames=self.gff_header, delimiter="\t"):		
-			if not row["seqid"].startswith("#"):
-				start, end = int(row["start"]), int(row["end"])                                   				
-				start, end = (start, end) if start < end else (end, start)
-				attrib = dict(item.split("=") for item in row["attributes"].strip(";").split(";"))
-
-				if row["type"] == "gene":
-					gid = GffValidator.get_attrib("ID", attrib, row["type"]).strip()
-					ginfo = self.gene_info.get(gid, None)
-					if ginfo is None:
-						raise ValueError("Error: Something is really wrong. Gene '{}' was not processed before.".format(gid))
-
-					start_changed, end_changed = start != ginfo["start"], end != ginfo["end"]
-					if start_changed or end_changed:
-						print("WARN:", gid, "start_changed({} => {})".format(start, ginfo["start"]), "end_changed({} => {})".format(end, ginfo["end"]), sep="\t", file=sys.stderr)
-					if print_guard:
-						print("###")
-					print_guard = True
-					row["start"], row["end"] = start, end
-
-				print(*row.values(), sep="\t")
+		self.print_guard = False
+		if self.stream:
+			for block in read_gene_blocks(self.gff_input):
+				self.write_features(block, GffValidator.collect_gene_spans(block))
+		else:
+			self.write_features(read_gff(self.gff_input), self.gene_info)
 
 
 def main():
 	ap = argparse.ArgumentParser()
 	ap.add_argument("gff_input", type=str)
+	ap.add_argument("--stream", action="store_true", help="Process the input one gene block (### separated) at a time. Requires the input to be grouped by gene, e.g. genometools output.")
 
 	args = ap.parse_args()
 
-	GffValidator(args.gff_input).process()
+	GffValidator(args.gff_input, stream=args.stream).process()
 
 
 
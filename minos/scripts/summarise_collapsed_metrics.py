@@ -1,58 +1,129 @@
 import sys
 import csv
 from collections import Counter
+from itertools import islice
+from operator import itemgetter
 
+import numpy as np
 
 
+SUMMARY_LIMITS = (("==", 1), (">=", 0.9), (">=", 0.75), ("==", 0))
+SUMMARY_METRICS = ("protein_score", "transcript_score", "hom_acov_score", "protein_score_gene", "transcript_score_gene", "hom_acov_score_gene")
 
 
+class MetricSummary:
+	""" Fixed-size accumulator for one metric: count, sum, threshold counts (SUMMARY_LIMITS)
+	and an optional histogram over [0, 1] for approximate quantiles.
+	Summaries of separate chunks can be merged. """
+	def __init__(self, quantile_bins=0):
+		self.count, self.total = 0, 0.0
+		self.limit_counts = [0 for limit in SUMMARY_LIMITS]
+		self.histogram = np.zeros(quantile_bins, dtype=np.int64) if quantile_bins else None
+
+	def update(self, values):
+		values = np.asarray(values, dtype=float)
+		self.count += len(values)
+		# sequential sum, so that the mean does not depend on how the input is batched
+		self.total = sum(values.tolist(), self.total)
+		for i, (op, limit) in enumerate(SUMMARY_LIMITS):
+			self.limit_counts[i] += int(np.count_nonzero(values == limit if op == "==" else values >= limit))
+		if self.histogram is not None:
+			n_bins = len(self.histogram)
+			self.histogram += np.bincount(np.clip((values * n_bins).astype(np.int64), 0, n_bins - 1), minlength=n_bins)
+
+	def merge(self, other):
+		bins = [len(summary.histogram) if summary.histogram is not None else 0 for summary in (self, other)]
+		if bins[0] != bins[1]:
+			raise ValueError("Error: Cannot merge metric summaries with different quantile bins ({} / {})".format(*bins))
+		self.count += other.count
+		self.total += other.total
+		self.limit_counts = [a + b for a, b in zip(self.limit_counts, other.limit_counts)]
+		if self.histogram is not None:
+			self.histogram += other.histogram
+		return self
+
+	@property
+	def mean(self):
+		return self.total / self.count
+
+	def quantile(self, q):
+		""" Upper edge of the histogram bin holding the q-th quantile. """
+		cumulative = np.cumsum(self.histogram)
+		return (np.searchsorted(cumulative, q * cumulative[-1]) + 1) / len(self.histogram)
 
 
 class CollapsedMetricsSummariser:
-	def parse_metrics(self, metrics_file):
-		self.data = {
-			"protein_score": list(), 
-			"transcript_score": list(),
-			"hom_acov_score": list(),
-			"protein_score_gene": dict(),
-			"transcript_score_gene": dict(),
-			"hom_acov_score_gene": dict(),
-		}
-		for row in csv.DictReader(open(metrics_file), delimiter="\t"):
-			for metric in self.data:
-				if metric.endswith("_gene"):
-					existing = self.data[metric].get(row["gene"], None)
-					value = float(row[metric])
-					if existing is None:
-						self.data[metric][row["gene"]] = value
-					elif existing != value:
-						raise ValueError("Ambiguous value found for {metric}: {gene} ({existing}/{value})".format(
-							metric=metric, gene=row["gene"], existing=existing, value=value
-						))
-				else:
-					self.data[metric].append(float(row[metric]))
-		for metric, counts in self.data.items():
-			if metric.endswith("_gene"):
-				self.data[metric] = list(counts.values())
-
-	def write_summary(self, stream=sys.stdout):
+	quantiles = (0.25, 0.5, 0.75)
+
+	def parse_metrics(self, metrics_file, chunk_size=100000):
+		""" Reads the collapsed metrics table column-wise in chunks of rows.
+		Gene level metrics are only counted for the first transcript of a gene. """
+		self.data = {metric: MetricSummary(quantile_bins=self.quantile_bins) for metric in SUMMARY_METRICS}
+		gene_values = {metric: dict() for metric in SUMMARY_METRICS if metric.endswith("_gene")}
+
+		with open(metrics_file) as metrics_in:
+			reader = csv.reader(metrics_in, delimiter="\t")
+			header = next(reader)
+			columns = ("gene",) + SUMMARY_METRICS
+			get_columns = itemgetter(*(header.index(col) for col in columns))
+
+			while True:
+				rows = [get_columns(row) for row in islice(reader, chunk_size)]
+				if not rows:
+					break
+				chunk = dict(zip(columns, zip(*rows)))
+
+				for metric, summary in self.data.items():
+					values = np.array(chunk[metric], dtype=float)
+					if metric.endswith("_gene"):
+						seen, new_genes = gene_values[metric], list()
+						for i, (gene, value) in enumerate(zip(chunk["gene"], values.tolist())):
+							existing = seen.get(gene, None)
+							if existing is None:
+								seen[gene] = value
+								new_genes.append(i)
+							elif existing != value:
+								raise ValueError("Ambiguous value found for {metric}: {gene} ({existing}/{value})".format(
+									metric=metric, gene=gene, existing=existing, value=value
+								))
+						values = values[new_genes]
+					summary.update(values)
+
+	def merge(self, other):
+		""" Merges the summary of another chunk of the collapsed metrics. Genes must not span chunks. """
+		for metric, summary in self.data.items():
+			summary.merge(other.data[metric])
+		return self
+
+	def write_summary(self, stream=sys.stdout, quantile_columns=False):
 		"""
-		Average (mean), Count =1, Count >=0.9, Count >=0.75, Count =0, Percentage =1, Percentage >=0.9, Percentage >=0.75, Percentage =0		
+		Average (mean), Count =1, Count >=0.9, Count >=0.75, Count =0, Percentage =1, Percentage >=0.9, Percentage >=0.75, Percentage =0
+		With quantile_columns (and quantile_bins), the approximate quartiles are added as q25, q50, q75.
 		"""
-		def average(L):
-			return sum(L)/len(L)
-
-		limits = ["{} == 1", "{} >= 0.9", "{} >= 0.75", "{} == 0"]
+		quantile_columns = quantile_columns and self.quantile_bins
 		header = ["metric", "mean", "count = 1", "count >= 0.9", "count >= 0.75", "count = 0", "frac = 1", "frac >= 0.9", "frac >= 0.75", "frac = 0"]
+		if quantile_columns:
+			header.extend("q{:g}".format(q * 100) for q in self.quantiles)
 		print(*header, sep="\t", file=stream, flush=True)
-		for metric, counts in self.data.items():
-			row = [metric, average(counts)]
-			mlimits = dict()
-			for limit in limits:
-				mlimits[limit] = sum(eval(limit.format(value)) for value in counts)
-			row.extend(mlimits.values())
-			row.extend(v/len(counts) for v in mlimits.values())
+		for metric, summary in self.data.items():
+			row = [metric, summary.mean]
+			row.extend(summary.limit_counts)
+			row.extend(v/summary.count for v in summary.limit_counts)
+			if quantile_columns:
+				row.extend(summary.quantile(q) for q in self.quantiles)
 			print(*row, sep="\t", file=stream, flush=True)
-		
-	def __init__(self, metrics_file, stats=None):
+
+	def write_bins(self, stream=sys.stdout):
+		""" Writes the quantile histograms (metric, bin start, bin end, count). Bin counts of
+		summaries of separate shards can be added up to merge them. Nothing is written without quantile_bins. """
+		if not self.quantile_bins:
+			return
+		print("metric", "bin_start", "bin_end", "count", sep="\t", file=stream)
+		edges = ["{:g}".format(i / self.quantile_bins) for i in range(self.quantile_bins + 1)]
+		for metric, summary in self.data.items():
+			for start, end, count in zip(edges[:-1], edges[1:], summary.histogram.tolist()):
+				print(metric, start, end, count, sep="\t", file=stream)
+
+	def __init__(self, metrics_file, stats=None, quantile_bins=0):
+		self.quantile_bins = quantile_bins
 		self.parse_metrics(metrics_file)
@@ -0,0 +1,115 @@
+import multiprocessing
+import warnings
+
+import numpy as np
+
+
+def to_float(x):
+	try:
+		return float(x)
+	except:
+		return 0.0
+
+
+def read_tpm_column(tsv):
+	""" Reads the target_id and tpm columns of a kallisto abundance.tsv.
+	tpm values that cannot be read as numbers are set to 0.0, comment lines are skipped. """
+	with open(tsv) as tsv_in:
+		header = next(tsv_in, "").rstrip("\r\n").split("\t")
+		try:
+			tpm_col = header.index("tpm")
+		except ValueError:
+			raise ValueError("Error: Cannot find tpm column in kallisto output " + tsv)
+		lines = tsv_in.read().splitlines()
+
+	if any(line[:1] == "#" for line in lines):
+		lines = [line for line in lines if line[:1] != "#"]
+	target_ids = [line.partition("\t")[0] for line in lines]
+	try:
+		with warnings.catch_warnings():
+			# loadtxt warns about files without data rows
+			warnings.simplefilter("ignore", UserWarning)
+			tpm = np.loadtxt(lines, delimiter="\t", usecols=(tpm_col,), dtype=np.float64, comments=None, ndmin=1)
+	except ValueError:
+		tpm = np.fromiter((to_float(line.split("\t")[tpm_col]) for line in lines), dtype=np.float64, count=len(lines))
+	return target_ids, tpm
+
+
+def _read_run(tsv):
+	try:
+		return read_tpm_column(tsv)
+	except FileNotFoundError:
+		return None
+
+
+class TpmMatrix:
+	""" transcripts x runs matrix (float32) of the kallisto tpm values of several expression runs.
+	Transcripts without a value in a run are set to 0. The runs are read in parallel,
+	only target_id and tpm are parsed. Each run is written into the matrix as it is read. """
+	def __init__(self, *tsv_files, threads=1):
+		self.runs, self.missing = list(), list()
+		self.target_ids, self._index = list(), dict()
+		self._max = np.zeros(0)
+		self.matrix = np.zeros((0, len(tsv_files)), dtype=np.float32)
+		self._last_ids, self._last_rows, self._has_duplicates = None, None, False
+
+		if threads > 1 and len(tsv_files) > 1:
+			with multiprocessing.Pool(min(threads, len(tsv_files))) as pool:
+				for tsv, result in zip(tsv_files, pool.imap(_read_run, tsv_files)):
+					self._add_run(tsv, result)
+		else:
+			for tsv in tsv_files:
+				self._add_run(tsv, _read_run(tsv))
+
+		if len(self.runs) < self.matrix.shape[1]:
+			self.matrix = np.ascontiguousarray(self.matrix[:, :len(self.runs)])
+		del self._last_ids, self._last_rows
+
+	def _add_run(self, tsv, result):
+		if result is None:
+			self.missing.append(tsv)
+			return
+		target_ids, tpm = result
+		# runs quantified against the same transcriptome share the target order
+		if target_ids != self._last_ids:
+			self._last_ids = target_ids
+			self._last_rows = np.fromiter((self._index.setdefault(tid, len(self._index)) for tid in target_ids), dtype=np.int64, count=len(target_ids))
+			self._has_duplicates = len(np.unique(self._last_rows)) != len(self._last_rows)
+			if len(self._index) > len(self.target_ids):
+				self.target_ids = list(self._index)
+				# new transcripts: grow the matrix (usually only for the first run)
+				grown = np.zeros((len(self.target_ids), self.matrix.shape[1]), dtype=np.float32)
+				grown[:len(self.matrix)] = self.matrix
+				self.matrix = grown
+				self._max = np.append(self._max, np.zeros(len(self.target_ids) - len(self._max)))
+
+		# like max(0.0, tpm) per transcript: nan and negative values do not count
+		rows = self._last_rows
+		if self._has_duplicates:
+			rows = np.unique(rows)
+			values = np.zeros(len(self.target_ids))
+			np.fmax.at(values, self._last_rows, tpm)
+			values = values[rows]
+		else:
+			values = np.fmax(0.0, tpm)
+
+		self.matrix[rows, len(self.runs)] = values
+		self._max[rows] = np.fmax(self._max[rows], values)
+		self.runs.append(tsv)
+
+	def __len__(self):
+		return len(self.target_ids)
+
+	def max(self):
+		""" Highest tpm per transcript over all runs (exact, taken from the float64 input values). """
+		return self._max
+
+	def mean(self):
+		""" Mean tpm per transcript over all runs. """
+		if not self.runs:
+			return np.zeros(len(self.target_ids))
+		return self.matrix.mean(axis=1, dtype=np.float64)
+
+	def count_over(self, threshold):
+		""" Number of runs in which a transcript has a tpm above threshold. """
+		return np.count_nonzero(self.matrix > threshold, axis=1)
@@ -0,0 +1,162 @@
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from minos.scripts.fasta_index import FastaFile
+
+
+# NCBI genetic codes (https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi),
+# amino acids of the codons in TCAG order (TTT, TTC, TTA, TTG, TCT, ...)
+NCBI_CODON_TABLES = {
+	1: "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	2: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSS**VVVVAAAADDEEGGGG",
+	3: "FFLLSSSSYY**CCWWTTTTPPPPHHQQRRRRIIMMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	4: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	5: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSSSVVVVAAAADDEEGGGG",
+	6: "FFLLSSSSYYQQCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	9: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+	10: "FFLLSSSSYY**CCCWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	11: "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	12: "FFLLSSSSYY**CC*WLLLSPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	13: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNKKSSGGVVVVAAAADDEEGGGG",
+	14: "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+	15: "FFLLSSSSYY*QCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	16: "FFLLSSSSYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	21: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIMMTTTTNNNKSSSSVVVVAAAADDEEGGGG",
+	22: "FFLLSS*SYY*LCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	23: "FF*LSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	24: "FFLLSSSSYY**CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+	25: "FFLLSSSSYY**CCGWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	26: "FFLLSSSSYY**CC*WLLLAPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	27: "FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	28: "FFLLSSSSYYQQCCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	29: "FFLLSSSSYYYYCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	30: "FFLLSSSSYYEECC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	31: "FFLLSSSSYYEECCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	32: "FFLLSSSSYY*WCC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG",
+	33: "FFLLSSSSYYY*CCWWLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSSKVVVVAAAADDEEGGGG",
+}
+
+BASES = "TCAG"
+IUPAC_BASES = {
+	"A": "A", "C": "C", "G": "G", "T": "T", "U": "T",
+	"R": "AG", "Y": "CT", "S": "CG", "W": "AT", "K": "GT", "M": "AC",
+	"B": "CGT", "D": "AGT", "H": "ACT", "V": "ACG", "N": "ACGT",
+}
+
+
+def get_codon_table(table_id):
+	""" Returns {codon: amino acid} for an NCBI genetic code. Codons with ambiguous bases
+	are included if all codons they stand for code for the same amino acid. """
+	try:
+		amino_acids = NCBI_CODON_TABLES[table_id]
+	except KeyError:
+		raise ValueError("Error: Unknown codon table {}. Available tables: {}".format(table_id, ",".join(map(str, NCBI_CODON_TABLES))))
+	codons = {"".join(codon): aa for codon, aa in zip(itertools.product(BASES, repeat=3), amino_acids)}
+	table = dict()
+	for codon in itertools.product(IUPAC_BASES, repeat=3):
+		translations = {codons["".join(bases)] for bases in itertools.product(*(IUPAC_BASES[b] for b in codon))}
+		if len(translations) == 1:
+			table["".join(codon)] = translations.pop()
+	return table
+
+
+class CdsTranslator:
+	""" Translates CDS in the first frame, codons are looked up as indices (16 * b1 + 4 * b2 + b3) of the table.
+	Codons with other than TCAG(U) bases are looked up in the full table and translated to X if they are ambiguous.
+	Incomplete codons at the end are ignored. """
+	def __init__(self, table_id=1):
+		self.codon_table = get_codon_table(table_id)
+		self.amino_acids = np.frombuffer(NCBI_CODON_TABLES[table_id].encode(), dtype=np.uint8)
+		self.base_codes = np.full(256, 64, dtype=np.uint16)
+		for code, bases in enumerate((b"Tt", b"Cc", b"Aa", b"Gg")):
+			self.base_codes[list(bases)] = code
+		self.base_codes[list(b"Uu")] = 0
+
+	def translate(self, seqs):
+		""" Translates a batch of sequences (str). """
+		lengths = [len(seq) // 3 * 3 for seq in seqs]
+		bases = np.frombuffer("".join(seq[:length] for seq, length in zip(seqs, lengths)).encode("ascii", "replace"), dtype=np.uint8)
+		codes = self.base_codes[bases].reshape(-1, 3)
+		index = (codes[:, 0] << 4) + (codes[:, 1] << 2) + codes[:, 2]
+		known = index < 64
+		peptides = np.full(len(index), ord("X"), dtype=np.uint8)
+		peptides[known] = self.amino_acids[index[known]]
+		for i in np.flatnonzero(~known).tolist():
+			codon = bases[3 * i:3 * i + 3].tobytes().decode().upper()
+			peptides[i] = ord(self.codon_table.get(codon, "X"))
+		peptides = peptides.tobytes().decode()
+		bounds = list(itertools.accumulate(length // 3 for length in lengths))
+		return [peptides[end - length // 3:end] for length, end in zip(lengths, bounds)]
+
+
+def make_header_cleaner(add_fields=None):
+	""" Keeps the first word of a header plus the words starting with one of add_fields
+	(comma-separated, case-insensitive), as clean_fasta_header --add_fields. """
+	fields = [field.strip().lower() for field in add_fields.split(",")] if add_fields else None
+	def clean_header(header):
+		words = (">" + header).rstrip().split(" ")
+		if fields is None:
+			return words[0][1:]
+		lowered = [word.lower() for word in words]
+		return words[0][1:] + " " + " ".join(word for field in fields for word, low in zip(words, lowered) if low.startswith(field))
+	return clean_header
+
+
+def format_fasta(header, seq, line_width=70):
+	return ">" + header + "\n" + "".join(seq[i:i + line_width] + "\n" for i in range(0, len(seq), line_width))
+
+
+# worker state for the parallel mode, set once per process by _init_worker
+_worker_fasta = None
+_worker_translator = None
+_worker_clean_header = None
+_worker_line_width = None
+
+
+def _init_worker(fasta, table_id, add_fields, line_width):
+	global _worker_fasta, _worker_translator, _worker_clean_header, _worker_line_width
+	_worker_fasta = fasta
+	_worker_translator = CdsTranslator(table_id)
+	_worker_clean_header = make_header_cleaner(add_fields)
+	_worker_line_width = line_width
+
+
+def _translate_batch(batch):
+	first, last = batch
+	headers = [_worker_clean_header(_worker_fasta.header(i)) for i in range(first, last)]
+	peptides = _worker_translator.translate([_worker_fasta.sequence(i) for i in range(first, last)])
+	return "".join(format_fasta(header, peptide, line_width=_worker_line_width) for header, peptide in zip(headers, peptides))
+
+
+def translate_cds(_in, _out, table_id=1, add_fields=None, line_width=70, threads=1, batch_size=5000):
+	""" Translates a CDS fasta into proteins, the headers are reduced to the sequence id (plus add_fields).
+	Batches of sequences are translated in a process pool with threads > 1, the output keeps the input order. """
+	get_codon_table(table_id)
+	with FastaFile(_in) as fasta, open(_out, "w") as pep_out:
+		batches = [(first, min(first + batch_size, len(fasta))) for first in range(0, len(fasta), batch_size)]
+		if threads > 1 and len(batches) > 1:
+			with multiprocessing.Pool(min(threads, len(batches)), initializer=_init_worker, initargs=(fasta, table_id, add_fields, line_width)) as pool:
+				pep_out.writelines(pool.imap(_translate_batch, batches))
+		else:
+			_init_worker(fasta, table_id, add_fields, line_width)
+			pep_out.writelines(map(_translate_batch, batches))
+
+
+def main():
+	ap = argparse.ArgumentParser(description="Translates CDS sequences into proteins (first frame) and cleans the fasta headers.")
+	ap.add_argument("cds_fasta", type=str)
+	ap.add_argument("protein_fasta", type=str)
+	ap.add_argument("--codon-table", "-T", type=int, default=1, help="NCBI genetic code (default: %(default)s).")
+	ap.add_argument("--add-fields", type=str, help="Keep the header fields starting with these (comma-separated, case-insensitive), as clean_fasta_header --add_fields.")
+	ap.add_argument("--line-width", type=int, default=70)
+	ap.add_argument("--threads", type=int, default=1)
+	args = ap.parse_args()
+
+	translate_cds(args.cds_fasta, args.protein_fasta, table_id=args.codon_table, add_fields=args.add_fields, line_width=args.line_width, threads=args.threads)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,12 +1,35 @@
 import argparse
 import sys
-import csv
+
+from minos.scripts.gff_reader import read_gff, read_gene_blocks
+
+def sweep_containing_exons(exons, features):
+	""" Sweeps over sorted exon and feature (CDS/UTR) coordinates and yields
+	each feature together with the exons that contain it. """
+	active, i, n_exons = list(), 0, len(exons)
+	for start, end in features:
+		while i < n_exons and exons[i][0] <= start:
+			active.append(exons[i])
+			i += 1
+		# features are sorted by start, exons ending before this one cannot contain any later feature
+		active = [exon for exon in active if exon[1] >= start]
+		yield start, end, [exon for exon in active if exon[1] >= end]
+
 
 class TranscriptDataValidator():
 	gff_header = ["seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes"]
 	valid_feature_types = {"gene", "mRNA", "exon", "CDS", "five_prime_UTR", "three_prime_UTR"}
 
-	def __init__(self, gff):
+	def __init__(self, gff, stream=False):
+		self.gff = gff
+		self.stream = stream
+		self.__reset()
+
+		# in streaming mode the data is collected per gene block in validate()
+		if not stream:
+			self.__read_features(read_gff(gff, feature_types=self.valid_feature_types))
+
+	def __reset(self):
 		self.genes_info = dict()
 		self.transcripts_info = dict()
 		self.transcript_gene_info = dict()
@@ -18,9 +41,7 @@ class TranscriptDataValidator():
 		self.utr5_info = dict()
 		self.utr3_info = dict()
 
-		self.__read_gff(gff)
-
-	def __read_gff(self, gff):
+	def __read_features(self, features):
 		def get_attrib(key, attributes, feature):
 			try:
 				return attributes[key]
@@ -28,110 +49,106 @@ class TranscriptDataValidator():
 				raise ValueError("Fatal Error: Cannot parse {} {} field.".format(feature, key))
 
 		try:
-			with open(gff) as gff_in:
-				for row in csv.DictReader(open(gff), fieldnames=self.gff_header, delimiter="\t"):
-					if not row["seqid"].startswith("#"):
-						if row["type"] in self.valid_feature_types:
-							start, end = int(row["start"]), int(row["end"])
-							if start > end:
-								print("WARN: start coordinate is greater than end coordinate [{} > {}], swapping them")
-								row["start"], row["end"] = end, start
-							else:
-								row["start"], row["end"] = start, end
-			
-							if row["strand"] not in {"+", "-"}:
-								# if a strand is a dot, then assume it is a positive one
-								print("WARN: strand is not defined as + or -, assuming it is +, plus strand")
-								row["strand"] = "+"				
-			
-							# make sure phase is an integer	
-							row["phase"] = int(row["phase"]) if row["phase"] in {"0", "1", "2"} else 0
-			
-							attrib = dict(item.split("=") for item in row["attributes"].strip(";").split(";"))
-			
-			
-							if row["type"] == "gene":
-								gid = get_attrib("ID", attrib, row["type"])
-			
-								if self.genes_info.get(gid, None) is not None:
-									raise ValueError("Fatal error: Duplicate gene ID '{}' in input file {}".format(gid, gff))
-		
-								self.genes_info[gid] = {
-									"start": row["start"],
-									"end": row["end"]
-								}
-			
-							elif row["type"] == "mRNA":
-								tid = get_attrib("ID", attrib, row["type"])
-								gid = get_attrib("Parent", attrib, row["type"])
-			
-								if self.transcripts_info.get(tid, None) is not None:
-									raise ValueError("Fatal error: Duplicate mRNA ID '{}' in input file {}".format(tid, gff))
-			
-								self.transcripts_info[tid] = {
-									"start": row["start"],
-									"end": row["end"],
-									"strand": row["strand"],
-									"gene": gid
-								}
-			
-								ginfo = self.transcript_gene_info.get(gid, None)
-								if ginfo is None:
-									self.transcript_gene_info[gid] = {
-										"start": row["start"],
-										"end": row["end"]
-									}
-								else:
-									ginfo.update({
-										"start": min(ginfo["start"], row["start"]),
-										"end": max(ginfo["end"], row["end"])
-									})
-			
-							elif row["type"] == "exon":
-								eid = get_attrib("Parent", attrib, row["type"])
-								self.exons_info.setdefault(eid, list()).append((row["start"], row["end"]))
-			
-								einfo = self.exon_coords.get(eid, None)
-								if einfo is None:
-									self.exon_coords[eid] = {
-										"start": row["start"],
-										"end": row["end"]
-									}
-								else:
-									einfo.update({
-										"start": min(einfo["start"], row["start"]),
-										"end": max(einfo["end"], row["end"])
-									})
-			
-							elif row["type"] == "CDS":
-								cid = get_attrib("Parent", attrib, row["type"])
-								self.cds_info.setdefault(cid, list()).append((row["start"], row["end"]))
-			
-								cinfo = self.cds_coords.get(cid, None)
-								if cinfo is None:
-									self.cds_coords[cid] = {
-										"start": row["start"],
-										"end": row["end"]
-									}
-								else:
-									cinfo.update({
-										"start": min(cinfo["start"], row["start"]),
-										"end": max(cinfo["end"], row["end"])
-									})
-			
-								# deduct the phase from the end
-								# and add to the hash cds_length_info when calculating CDS length				
-								self.cds_length.setdefault(cid, list()).append((row["start"], row["end"] - row["phase"]))
-			
-							elif row["type"] == "five_prime_UTR" or row["type"] == "three_prime_UTR":
-								uid = get_attrib("Parent", attrib, row["type"].split("_")[-1])
-								if row["type"] == "five_prime_UTR":
-									self.utr5_info.setdefault(uid, list()).append((row["start"], row["end"]))
-								if row["type"] == "three_prime_UTR":
-									self.utr3_info.setdefault(uid, list()).append((row["start"], row["end"]))
+			for feature in features:
+				ftype = feature.type
+				start, end = int(feature.start), int(feature.end)
+				if start > end:
+					print("WARN: start coordinate is greater than end coordinate [{} > {}], swapping them")
+					start, end = end, start
+
+				strand = feature.strand
+				if strand not in {"+", "-"}:
+					# if a strand is a dot, then assume it is a positive one
+					print("WARN: strand is not defined as + or -, assuming it is +, plus strand")
+					strand = "+"
+
+				# make sure phase is an integer
+				phase = int(feature.phase) if feature.phase in {"0", "1", "2"} else 0
+
+				attrib = feature.attributes
+
+				if ftype == "gene":
+					gid = get_attrib("ID", attrib, ftype)
+
+					if self.genes_info.get(gid, None) is not None:
+						raise ValueError("Fatal error: Duplicate gene ID '{}' in input file {}".format(gid, self.gff))
+
+					self.genes_info[gid] = {
+						"start": start,
+						"end": end
+					}
+
+				elif ftype == "mRNA":
+					tid = get_attrib("ID", attrib, ftype)
+					gid = get_attrib("Parent", attrib, ftype)
+
+					if self.transcripts_info.get(tid, None) is not None:
+						raise ValueError("Fatal error: Duplicate mRNA ID '{}' in input file {}".format(tid, self.gff))
+
+					self.transcripts_info[tid] = {
+						"start": start,
+						"end": end,
+						"strand": strand,
+						"gene": gid
+					}
+
+					ginfo = self.transcript_gene_info.get(gid, None)
+					if ginfo is None:
+						self.transcript_gene_info[gid] = {
+							"start": start,
+							"end": end
+						}
+					else:
+						ginfo.update({
+							"start": min(ginfo["start"], start),
+							"end": max(ginfo["end"], end)
+						})
+
+				elif ftype == "exon":
+					eid = get_attrib("Parent", attrib, ftype)
+					self.exons_info.setdefault(eid, list()).append((start, end))
+
+					einfo = self.exon_coords.get(eid, None)
+					if einfo is None:
+						self.exon_coords[eid] = {
+							"start": start,
+							"end": end
+						}
+					else:
+						einfo.update({
+							"start": min(einfo["start"], start),
+							"end": max(einfo["end"], end)
+						})
+
+				elif ftype == "CDS":
+					cid = get_attrib("Parent", attrib, ftype)
+					self.cds_info.setdefault(cid, list()).append((start, end))
+
+					cinfo = self.cds_coords.get(cid, None)
+					if cinfo is None:
+						self.cds_coords[cid] = {
+							"start": start,
+							"end": end
+						}
+					else:
+						cinfo.update({
+							"start": min(cinfo["start"], start),
+							"end": max(cinfo["end"], end)
+						})
+
+					# deduct the phase from the end
+					# and add to the hash cds_length_info when calculating CDS length
+					self.cds_length.setdefault(cid, list()).append((start, end - phase))
+
+				elif ftype == "five_prime_UTR" or ftype == "three_prime_UTR":
+					uid = get_attrib("Parent", attrib, ftype.split("_")[-1])
+					if ftype == "five_prime_UTR":
+						self.utr5_info.setdefault(uid, list()).append((start, end))
+					if ftype == "three_prime_UTR":
+						self.utr3_info.setdefault(uid, list()).append((start, end))
 
 		except FileNotFoundError:
-			raise FileNotFoundError("Error: Cannot find input gff at " + gff)
+			raise FileNotFoundError("Error: Cannot find input gff at " + self.gff)
 	
 		for d in [self.utr5_info, self.utr3_info, self.exons_info, self.cds_info, self.cds_length]:
 			for v in d.values():
@@ -168,15 +185,17 @@ class TranscriptDataValidator():
 				if tinfo["exon_end"] == 0 or end > tinfo["exon_end"]:
 					tinfo["exon_end"] = end 
 				
-			for start, end in self.cds_info.get(tid, list()):
+			exons = self.exons_info.get(tid, list())
+			for start, end, containing_exons in sweep_containing_exons(exons, self.cds_info.get(tid, list())):
 				span = end - start + 1
 				tinfo["cds_count"] += 1
 				tinfo["cds_len_standard"] += span
 	
-				for e_start, e_end in self.exons_info.get(tid, list()):
+				# every containing exon is either a complete or a partial match
+				for e_start, e_end in containing_exons:
 					if e_start == start and e_end == end:
 						tinfo["cds_complete_match"] += 1
-					elif (e_start < start and end == e_end) or (e_start == start and end < e_end) or (e_start < start and end < e_end):
+					else:
 						tinfo["cds_partial_match"] += 1
 	
 				total_cds_count = tinfo["cds_complete_match"] + tinfo["cds_partial_match"]
@@ -188,12 +207,12 @@ class TranscriptDataValidator():
 				tinfo["cds_len"] += span
 	
 			for utr, utr_info in [(5, self.utr5_info), (3, self.utr3_info)]:
-				for start, end in utr_info.get(tid, list()):
+				for start, end, containing_exons in sweep_containing_exons(exons, utr_info.get(tid, list())):
 					span = end - start + 1
 					tinfo["utr{}_count".format(utr)] += 1
 					tinfo["utr{}_len".format(utr)] += span
 					
-					for e_start, e_end in self.exons_info.get(tid, list()):
+					for e_start, e_end in containing_exons:
 						if e_start == start and end == e_end:
 							tinfo["utr{}_complete_match".format(utr)] += 1
 						elif utr == 5 and tinfo["strand"] == "+" and e_start == start and end < e_end:
@@ -232,17 +251,28 @@ class TranscriptDataValidator():
 			if tinfo["end"] != tinfo["exon_end"]:
 				print("WARN: Transcript end is not consistent with all exon spans for transcript '{}'.".format(tid))
 
-
+	def validate(self):
+		if self.stream:
+			try:
+				for block in read_gene_blocks(self.gff):
+					self.__reset()
+					self.__read_features(feature for feature in block if feature.type in self.valid_feature_types)
+					self.validate_gene_spans()
+					self.validate_transcripts()
+			except FileNotFoundError:
+				raise FileNotFoundError("Error: Cannot find input gff at " + self.gff)
+		else:
+			self.validate_gene_spans()
+			self.validate_transcripts()
 
 
 def main():
 	ap = argparse.ArgumentParser()
 	ap.add_argument("input_gff", type=str)
+	ap.add_argument("--stream", action="store_true", help="Validate the input one gene block (### separated) at a time. Requires the input to be grouped by gene, e.g. genometools output. Duplicate IDs are only detected within a gene block.")
 	args = ap.parse_args()
 
-	tdv = TranscriptDataValidator(args.input_gff)
-	tdv.validate_gene_spans()
-	tdv.validate_transcripts()
+	TranscriptDataValidator(args.input_gff, stream=args.stream).validate()
 
 
 if __name__ == "__main__":
@@ -37,6 +37,9 @@ POST_PICK_PREFIX = "mikado.annotation"
 RELEASE_PREFIX = config.get("genus_identifier", "XYZ") + "_" + config.get("annotation_version", "EIv1")
 RESULTS_DIR = os.path.join(config["outdir"], "results")
 
+# codon table for translate_cds, configs of older versions keep it under params.seqkit
+CODON_TABLE = config["params"].get("translate_cds", config["params"].get("seqkit", {})).get("codon_table", 1)
+
 OUTPUTS = [
 	os.path.join(config["outdir"], "mikado_prepared.fasta"),
 	os.path.join(config["outdir"], "mikado_prepared.exon.gff"),
@@ -59,7 +62,6 @@ for run in config.get("data", dict()).get("protein-seqs", dict()):
 	OUTPUTS.append(os.path.join(EXTERNAL_METRICS_DIR, config["blast-mode"], run, run + ".DIAMOND.{}.tsv.tophit".format(config["blast-mode"]) if config["use-diamond"] else run + ".BLAST.{}.tsv.tophit".format(config["blast-mode"])))
 for run in config.get("data", dict()).get("repeat-data", dict()):
 	OUTPUTS.append(os.path.join(EXTERNAL_METRICS_DIR, "repeats", "{}.no_strand.exon.gff".format(run)))
-	OUTPUTS.append(os.path.join(EXTERNAL_METRICS_DIR, "repeats", "{}.no_strand.exon.gff.cbed".format(run)))
 	OUTPUTS.append(os.path.join(EXTERNAL_METRICS_DIR, "repeats", "{}.no_strand.exon.gff.cbed.parsed.txt".format(run)))
 
 
@@ -149,27 +151,20 @@ CONFIG_COPY_TARGETS = [dest for src, dest in CONFIG_COPY]
 
 localrules:
 	all,
-	minos_extract_exons,
-	minos_metrics_repeats_convert,
-	minos_mikado_prepare_extract_coords,
+	minos_mikado_prepare_fanout,
 	minos_mikado_pick_extract_coords,
-	minos_metrics_parse_repeat_coverage,
 	minos_metrics_blastp_combine,
+	minos_metrics_cpc2,
 	minos_metrics_generate_metrics_info,
 	minos_parse_mikado_pick,
-	minos_gffread_extract_sequences_post_pick,
-	minos_gffread_extract_sequences,
 	minos_gff_genometools_check_post_pick,
 	minos_calculate_cds_lengths_post_pick,
-	minos_extract_final_sequences,
 	split_proteins_prepare,
 	split_transcripts_prepare,
 	busco_copy_results,
 	config_copy_results,
 	busco_concat_protein_metrics,
-	busco_summary,
 	minos_create_release_metrics,
-	minos_collate_metric_oddities,
 	minos_summarise_collapsed_metrics
 
 
@@ -195,6 +190,7 @@ rule all:
 			for suffix in {".gt_checked.gff", ".collapsed_metrics.tsv", ".gt_checked.validation_report.txt", ".release.unsorted.gff3", ".release_browser.unsorted.gff3"}
 		],
 		os.path.join(RESULTS_DIR, RELEASE_PREFIX + ".release.collapsed_metrics.summary.tsv"),
+		os.path.join(RESULTS_DIR, RELEASE_PREFIX + ".release.collapsed_metrics.summary.bins.tsv"),
 		[
 			os.path.join(RESULTS_DIR, RELEASE_PREFIX + suffix)
 			for suffix in {".release.gff3", ".release.browser.gff3", ".release.gff3.mikado_stats.txt", ".release.gff3.mikado_stats.tsv"}
@@ -231,38 +227,24 @@ rule minos_mikado_prepare:
 	shell:
 		"{params.program_call} {params.program_params} --json-conf {input[0]} --procs {threads} -od {params.outdir} &> {log}"
 
-rule minos_mikado_prepare_extract_coords:
+rule minos_mikado_prepare_fanout:
 	input:
 		rules.minos_mikado_prepare.output[1]
 	output:
-		rules.minos_mikado_prepare.output[1] + ".coords"
-	run:
-		from minos.scripts.extract_coords import extract_coords
-		extract_coords(input[0], output[0], filetype="gtf")
-
-rule minos_generate_tx2gene_maps:
-	input:
-		get_transcript_models
-	output:
-		os.path.join(config["outdir"], "tx2gene", os.path.basename("{run}") + ".tx2gene")
+		coords = rules.minos_mikado_prepare.output[1] + ".coords",
+		exons = rules.minos_mikado_prepare.output[1].replace(".gtf", ".exon.gff"),
+		tx2gene = TX2GENE_MAPS
 	threads:
-		HPC_CONFIG.get_cores("minos_generate_tx2gene_maps")
+		HPC_CONFIG.get_cores("minos_mikado_prepare_fanout")
 	resources:
-		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_generate_tx2gene_maps")
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_mikado_prepare_fanout") * attempt
 	run:
-		from minos.scripts.generate_tx2gene_maps import Gxf8Parser
-		with open(output[0], "w") as _out:
-			for tid, gid in Gxf8Parser(input[0]).parse_file(input[0], wildcards.run):
-				print(tid, gid, sep="\t", flush=True, file=_out)
-
-rule minos_extract_exons:
-	input:
-		rules.minos_mikado_prepare.output[1]
-	output:
-		rules.minos_mikado_prepare.output[1].replace(".gtf", ".exon.gff")
-	run:
-		from minos.scripts.extract_exons import extract_exons
-		extract_exons(input[0], output[0])
+		# coords, exons and tx2gene maps are written in one pass over the prepared gtf
+		from minos.scripts.prepare_fanout import prepare_fanout
+		prepare_fanout(
+			input[0], output.coords, output.exons,
+			{tm: os.path.join(config["outdir"], "tx2gene", tm + ".tx2gene") for tm in config["data"]["transcript_models"]}
+		)
 
 rule minos_mikado_compare_index_reference:
 	input:
@@ -294,12 +276,14 @@ rule minos_gffread_extract_sequences:
 		os.path.join(LOG_DIR, config["prefix"] + ".gffread_extract.log")
 	params:
 		program_call_gffread = config["program_calls"]["gffread"],
-		program_call_seqkit = config["program_calls"]["seqkit"],
 		program_params_gffread = config["params"]["gffread"][config["blast-mode"]],
-		program_params_translate = config["params"]["seqkit"]["translate"],
-		codon_table = config["params"]["seqkit"]["codon_table"]
+		codon_table = CODON_TABLE
+	threads:
+		HPC_CONFIG.get_cores("minos_gffread_extract_sequences")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_gffread_extract_sequences") * attempt
 	shell:
-		"({params.program_call_gffread} {input.gtf} -g {input.refseq} {params.program_params_gffread} -W -w {output.cdna} -x {output.cds} -y {output.pep_temp} && {params.program_call_seqkit} {params.program_params_translate} -T {params.codon_table} {output.cds} | clean_fasta_header > {output.pep}) > {log} 2>&1"
+		"({params.program_call_gffread} {input.gtf} -g {input.refseq} {params.program_params_gffread} -W -w {output.cdna} -x {output.cds} -y {output.pep_temp} && translate_cds {output.cds} {output.pep} --codon-table {params.codon_table} --threads {threads}) > {log} 2>&1"
 
 rule minos_metrics_repeats_convert:
 	input:
@@ -307,58 +291,90 @@ rule minos_metrics_repeats_convert:
 	output:
 		os.path.join(EXTERNAL_METRICS_DIR, "repeats", "{run}.converted.gff"),
 		os.path.join(EXTERNAL_METRICS_DIR, "repeats", "{run}.no_strand.exon.gff")
+	threads:
+		HPC_CONFIG.get_cores("minos_metrics_repeats_convert")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_repeats_convert") * attempt
 	run:
 		from minos.scripts.parse_repeatmasker import parse_repeatmasker
-		parse_repeatmasker(input[0], output[0], output[1], wildcards.run)
+		parse_repeatmasker(input[0], output[0], output[1], wildcards.run, threads=threads)
+
+REPEAT_RUNS = list(config.get("data", dict()).get("repeat-data", dict()))
 
-rule minos_metrics_bedtools_repeat_coverage:
+rule minos_metrics_repeat_coverage:
 	input:
-		rules.minos_metrics_repeats_convert.output[1],
-		rules.minos_extract_exons.output[0]
+		exons = rules.minos_mikado_prepare_fanout.output.exons,
+		repeats = expand(rules.minos_metrics_repeats_convert.output[1], run=REPEAT_RUNS)
 	output:
-		rules.minos_metrics_repeats_convert.output[1] + ".cbed",
-	params:
-		program_call = config["program_calls"]["bedtools"]["coverageBed"]
+		expand(rules.minos_metrics_repeats_convert.output[1] + ".cbed.parsed.txt", run=REPEAT_RUNS)
 	threads:
-		HPC_CONFIG.get_cores("minos_metrics_bedtools_repeat_coverage")
+		HPC_CONFIG.get_cores("minos_metrics_repeat_coverage")
 	resources:
-		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_bedtools_repeat_coverage") * attempt
-	shell:
-		"""
-		{params.program_call} -a {input[1]} -b {input[0]} > {output[0]}.tmp
-		&& cut -f 9 {output[0]}.tmp | cut -d ';' -f 1 | paste - {output[0]}.tmp | sort -k1,1V | cut -f 2- > {output[0]}
-		&& rm {output[0]}.tmp
-		""".strip().replace("\n\t", " ")
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_repeat_coverage") * attempt
+	run:
+		# all repeat runs are scored against the exons in one pass
+		from minos.scripts.repeat_coverage import repeat_coverage
+		repeat_coverage(input.exons, input.repeats, output)
 
 
-rule minos_metrics_parse_repeat_coverage:
+checkpoint minos_chunk_transcripts:
 	input:
-		rules.minos_metrics_bedtools_repeat_coverage.output[0],
+		rules.minos_mikado_prepare.output[0]
 	output:
-		rules.minos_metrics_bedtools_repeat_coverage.output[0] + ".parsed.txt",
-	run:
-		from minos.scripts.parse_cbed_stats import parse_cbed
-		with open(output[0], "w") as outstream, open(input[0]) as instream:
-			parse_cbed(instream, outstream=outstream)
-
+		chunk_dir = directory(os.path.join(TEMP_DIR, "chunked_transcripts"))
+	log:
+		os.path.join(LOG_DIR, os.path.basename(rules.minos_mikado_prepare.output[0]) + ".chunk.log")
+	params:
+		outdir = os.path.join(TEMP_DIR, "chunked_transcripts"),
+		n_chunks = config["params"].get("chunk_transcripts", {}).get("n_chunks", 0),
+		residues_per_chunk = config["params"].get("chunk_transcripts", {}).get("residues_per_chunk", 20000000)
+	threads:
+		HPC_CONFIG.get_cores("minos_chunk_transcripts")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_chunk_transcripts") * attempt
+	shell:
+		"chunk_fasta {input[0]} {params.outdir} --n-chunks {params.n_chunks} --residues-per-chunk {params.residues_per_chunk} &> {log}"
 
-rule minos_metrics_cpc2:
+rule minos_metrics_cpc2_chunked:
 	input:
-		rules.minos_mikado_prepare.output[0]
+		os.path.join(TEMP_DIR, "chunked_transcripts", "chunk-{chunk}.txt")
 	output:
-		os.path.join(EXTERNAL_METRICS_DIR, "CPC-2.0_beta", os.path.basename(rules.minos_mikado_prepare.output[0]) + ".cpc2output.txt")
+		os.path.join(TEMP_DIR, "chunked_transcripts", "cpc2", "chunk-{chunk}.cpc2output.txt")
 	params:
 		program_call = config["program_calls"]["cpc2"],
 		program_params = config["params"]["cpc2"]
 	log:
-		os.path.join(LOG_DIR, config["prefix"] + ".CPC2.log")
+		os.path.join(LOG_DIR, "cpc2_logs", "chunk-{chunk}.CPC2.log")
 	threads:
-		HPC_CONFIG.get_cores("minos_metrics_cpc2")
+		HPC_CONFIG.get_cores("minos_metrics_cpc2_chunked")
 	resources:
-		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_cpc2") * attempt
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_cpc2_chunked") * attempt
 	shell:
 		"{params.program_call} {params.program_params} -i {input[0]} -o {output[0]} &> {log}"
 
+def aggregate_cpc2_input(wildcards):
+	from minos.scripts.chunk_fasta import read_chunk_manifest
+	checkpoint_output = checkpoints.minos_chunk_transcripts.get(**wildcards).output.chunk_dir
+	return expand(
+		os.path.join(TEMP_DIR, "chunked_transcripts", "cpc2", "chunk-{chunk}.cpc2output.txt"),
+		chunk=read_chunk_manifest(os.path.join(checkpoint_output, "manifest.tsv"))
+	)
+
+
+rule minos_metrics_cpc2:
+	input:
+		aggregate_cpc2_input
+	output:
+		os.path.join(EXTERNAL_METRICS_DIR, "CPC-2.0_beta", os.path.basename(rules.minos_mikado_prepare.output[0]) + ".cpc2output.txt")
+	threads:
+		HPC_CONFIG.get_cores("minos_metrics_cpc2")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_cpc2") * attempt
+	run:
+		# CPC2 scores each transcript independently, the chunk outputs only differ in their header lines
+		from minos.scripts.chunk_fasta import concatenate_files
+		concatenate_files(input, output[0], remove_input=True, keep_header=True)
+
 
 rule minos_metrics_kallisto_index:
 	input:
@@ -473,46 +489,54 @@ checkpoint minos_chunk_proteins:
 	log:
 		os.path.join(LOG_DIR, os.path.basename(rules.minos_gffread_extract_sequences.output.pep if config["blast-mode"] == "blastp" else rules.minos_gffread_extract_sequences.output.cds) + ".chunk.log")
 	params:
-		chunksize = 1000,
-		outdir = os.path.join(TEMP_DIR, "chunked_proteins")
+		outdir = os.path.join(TEMP_DIR, "chunked_proteins"),
+		n_chunks = config["params"].get("chunk_proteins", {}).get("n_chunks", 0),
+		# chunks are sized to run for about target_runtime minutes on the cores of a blast/diamond chunk job
+		residues_per_chunk = int(config["params"].get("chunk_proteins", {}).get("target_runtime", 30) * config["params"].get("chunk_proteins", {}).get("residues_per_core_minute", 1600) * HPC_CONFIG.get_cores("minos_metrics_blastp_chunked"))
 	threads:
 		HPC_CONFIG.get_cores("minos_chunk_proteins")
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_chunk_proteins") * attempt
 	shell:
-		"mkdir -p {params.outdir}" + \
-		# awk script by Pierre Lindenbaum https://www.biostars.org/p/13270/
-		" && awk 'BEGIN {{n=0;m=1;}} /^>/ {{ if (n%{params.chunksize}==0) {{f=sprintf(\"{params.outdir}/chunk-%d.txt\",m); m++;}}; n++; }} {{ print >> f }}' {input[0]} &> {log}"
+		"chunk_fasta {input[0]} {params.outdir} --deduplicate --n-chunks {params.n_chunks} --residues-per-chunk {params.residues_per_chunk} &> {log}"
 
-BLAST_CMD = "{params.program_call} {params.program_params} -query {input.chunk} -out {output[0]} -num_threads {threads} " + \
+BLAST_CMD = "{params.program_call} {params.program_params} -query {input.chunk} -out {params.hits} -num_threads {threads} " + \
 			"-db {input.db} -outfmt \"6 qseqid sseqid pident qstart qend sstart send qlen slen length nident mismatch positive gapopen gaps evalue bitscore\" &> {log}"
-DIAMOND_CMD = "{params.program_call} {params.program_params} --query {input.chunk} --out {output[0]} --threads {threads} " + \
+DIAMOND_CMD = "{params.program_call} {params.program_params} --query {input.chunk} --out {params.hits} --threads {threads} " + \
 			"--db {input.db} --outfmt 6 qseqid sseqid pident qstart qend sstart send qlen slen length nident mismatch positive gapopen gaps evalue bitscore &> {log}"
+# chunks do not share queries, so each chunk job reduces its hits to the top hits
+# identical sequences are only searched once (chunk_fasta --deduplicate), their duplicates get a copy of the top hit
+TOPHIT_CMD = "get_blast_tophit {params.hits} {output[0]} --pident-threshold {params.pident_threshold} --qcov-threshold {params.qcov_threshold} --duplicates {input.duplicates} 2>> {log} && rm {params.hits}"
 
 rule minos_metrics_blastp_chunked:
 	input:
 		chunk = os.path.join(TEMP_DIR, "chunked_proteins", "chunk-{chunk}.txt"),
+		duplicates = os.path.join(TEMP_DIR, "chunked_proteins", "chunk-{chunk}.duplicates.tsv"),
 		db = rules.minos_metrics_blastp_mkdb.output[0]
 	output:
-		os.path.join(TEMP_DIR, "chunked_proteins", "{run}", "chunk-{chunk}.DIAMOND." + config["blast-mode"] + ".tsv" if config["use-diamond"] else "chunk-{chunk}.BLAST." + config["blast-mode"] + ".tsv")
+		os.path.join(TEMP_DIR, "chunked_proteins", "{run}", "chunk-{chunk}.DIAMOND." + config["blast-mode"] + ".tsv.tophit" if config["use-diamond"] else "chunk-{chunk}.BLAST." + config["blast-mode"] + ".tsv.tophit")
 	log:
 		os.path.join(LOG_DIR, "blast_logs", "chunk-{chunk}.{run}.DIAMOND." + config["blast-mode"] + ".log" if config["use-diamond"] else "chunk-{chunk}.{run}.BLAST." + config["blast-mode"] + ".log")
 	params:
 		program_call = config["program_calls"]["diamond" if config["use-diamond"] else "blast"].format(program=config["blast-mode"]),
-		program_params = config["params"]["diamond" if config["use-diamond"] else "blast"][config["blast-mode"]]
+		program_params = config["params"]["diamond" if config["use-diamond"] else "blast"][config["blast-mode"]],
+		hits = lambda wildcards, output: output[0][:-len(".tophit")],
+		pident_threshold = config["params"]["diamond" if config["use-diamond"] else "blast"]["tophit"]["pident_threshold"],
+		qcov_threshold = config["params"]["diamond" if config["use-diamond"] else "blast"]["tophit"]["qcov_threshold"]
 	threads:
 		HPC_CONFIG.get_cores("minos_metrics_blastp_chunked")
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_blastp_chunked") * attempt
 	shell:
-		"{cmd}".format(cmd=DIAMOND_CMD if config["use-diamond"] else BLAST_CMD)
+		"{cmd} && {tophit_cmd}".format(cmd=DIAMOND_CMD if config["use-diamond"] else BLAST_CMD, tophit_cmd=TOPHIT_CMD)
 
 def aggregate_blastp_input(wildcards):
+	from minos.scripts.chunk_fasta import read_chunk_manifest
 	checkpoint_output = checkpoints.minos_chunk_proteins.get(**wildcards).output.chunk_dir
 	return expand(
-		os.path.join(TEMP_DIR, "chunked_proteins", "{run}", "chunk-{chunk}.DIAMOND." + config["blast-mode"] + ".tsv" if config["use-diamond"] else "chunk-{chunk}.BLAST." + config["blast-mode"] + ".tsv"),
+		os.path.join(TEMP_DIR, "chunked_proteins", "{run}", "chunk-{chunk}.DIAMOND." + config["blast-mode"] + ".tsv.tophit" if config["use-diamond"] else "chunk-{chunk}.BLAST." + config["blast-mode"] + ".tsv.tophit"),
 		run=wildcards.run,
-		chunk=glob_wildcards(os.path.join(checkpoint_output, "chunk-{chunk}.txt")).chunk
+		chunk=read_chunk_manifest(os.path.join(checkpoint_output, "manifest.tsv"))
 	)
 
 
@@ -520,33 +544,14 @@ rule minos_metrics_blastp_combine:
 	input:
 		aggregate_blastp_input
 	output:
-		os.path.join(EXTERNAL_METRICS_DIR, config["blast-mode"], "{run}", "{run}.DIAMOND." + config["blast-mode"] + ".tsv" if config["use-diamond"] else "{run}.BLAST." + config["blast-mode"] + ".tsv")
+		os.path.join(EXTERNAL_METRICS_DIR, config["blast-mode"], "{run}", "{run}.DIAMOND." + config["blast-mode"] + ".tsv.tophit" if config["use-diamond"] else "{run}.BLAST." + config["blast-mode"] + ".tsv.tophit")
 	threads:
 		HPC_CONFIG.get_cores("minos_metrics_blastp_combine")
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_blastp_combine") * attempt
 	run:
-		with open(output[0], "w") as blast_out:
-			for f in input:
-				print(open(f).read(), end="", flush=True, file=blast_out)
-				os.remove(f)
-
-
-rule minos_metrics_blastp_tophit:
-	input:
-		rules.minos_metrics_blastp_combine.output[0]
-	output:
-		rules.minos_metrics_blastp_combine.output[0] + ".tophit"
-	params:
-		pident_threshold = config["params"]["diamond" if config["use-diamond"] else "blast"]["tophit"]["pident_threshold"],
-		qcov_threshold = config["params"]["diamond" if config["use-diamond"] else "blast"]["tophit"]["qcov_threshold"]
-	threads:
-		HPC_CONFIG.get_cores("minos_metrics_blastp_tophit")
-	resources:
-		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_blastp_tophit") * attempt
-	run:
-		from minos.scripts.get_blast_tophit import get_blast_tophit
-		get_blast_tophit(input[0], output[0], params.pident_threshold, params.qcov_threshold)
+		from minos.scripts.chunk_fasta import concatenate_files
+		concatenate_files(input, output[0], remove_input=True)
 
 rule busco_concat_protein_metrics:
 	input:
@@ -577,13 +582,16 @@ rule minos_metrics_generate_metrics_matrix:
 	input:
 		rules.minos_metrics_generate_metrics_info.output[0]
 	output:
-		os.path.join(EXTERNAL_METRICS_DIR, "metrics_matrix.txt")
+		os.path.join(EXTERNAL_METRICS_DIR, "metrics_matrix.txt"),
+		os.path.join(EXTERNAL_METRICS_DIR, "metrics_matrix.npz")
 	log:
 		os.path.join(LOG_DIR, "generate_metrics_matrix.log")
+	threads:
+		HPC_CONFIG.get_cores("minos_metrics_generate_metrics_matrix")
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_metrics_generate_metrics_matrix") * attempt
 	shell:
-		"generate_metrics {input[0]} > {output[0]} 2> {log}"
+		"generate_metrics --low-memory --threads {threads} --tmpdir {EXTERNAL_METRICS_DIR} --npz {output[1]} {input[0]} > {output[0]} 2> {log}"
 
 rule minos_mikado_serialise:
 	input:
@@ -655,13 +663,15 @@ rule minos_gffread_extract_sequences_post_pick:
 		pep_temp = os.path.join(config["outdir"], POST_PICK_PREFIX + ".proteins.fasta.temp")
 	params:
 		program_call_gffread = config["program_calls"]["gffread"],
-		program_call_seqkit = config["program_calls"]["seqkit"],
 		table_format = "--table @chr,@start,@end,@strand,@numexons,@covlen,@cdslen,ID,Note,confidence,representative,biotype,InFrameStop,partialness",
-		program_params_translate = config["params"]["seqkit"]["translate"],
-		codon_table = config["params"]["seqkit"]["codon_table"],
+		codon_table = CODON_TABLE,
 		add_fields = config["misc"]["add_fields"]
+	threads:
+		HPC_CONFIG.get_cores("minos_gffread_extract_sequences_post_pick")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_gffread_extract_sequences_post_pick") * attempt
 	shell:
-		"{params.program_call_gffread} {input.gff} -g {input.refseq} -P {params.table_format} -W -w {output.cdna} -x {output.cds} -y {output.pep_temp} -o {output.tbl} && {params.program_call_seqkit} {params.program_params_translate} -T {params.codon_table} {output.cds} | clean_fasta_header --add_fields {params.add_fields} > {output.pep}"
+		"{params.program_call_gffread} {input.gff} -g {input.refseq} -P {params.table_format} -W -w {output.cdna} -x {output.cds} -y {output.pep_temp} -o {output.tbl} && translate_cds {output.cds} {output.pep} --codon-table {params.codon_table} --add-fields {params.add_fields} --threads {threads}"
 
 
 rule minos_calculate_cds_lengths_post_pick:
@@ -700,7 +710,7 @@ rule minos_gff_validate_post_gt:
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_gff_validate_post_gt") * attempt
 	shell:
-		"validate_gff3 {input} > {output}"
+		"validate_gff3 --stream {input} > {output}"
 
 rule minos_kallisto_index_post_pick:
 	input:
@@ -742,7 +752,7 @@ rule minos_kallisto_quant_post_pick:
 rule minos_collapse_metrics:
 	input:
 		gff = rules.minos_parse_mikado_pick.output[0],
-		ext_scores = rules.minos_metrics_generate_metrics_matrix.output[0],
+		ext_scores = rules.minos_metrics_generate_metrics_matrix.output[1],
 		metrics_info = rules.minos_metrics_generate_metrics_info.output[0],
 		expression = expand(rules.minos_kallisto_quant_post_pick.output, run=config["data"]["expression-runs"].keys()),
 		cds_lengths = rules.minos_calculate_cds_lengths_post_pick.output[0]
@@ -757,7 +767,7 @@ rule minos_collapse_metrics:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_collapse_metrics") * attempt
 	run:
 		from minos.scripts.collapse_metrics import MetricCollapser
-		mc = MetricCollapser(input.gff, input.metrics_info, input.ext_scores, input.cds_lengths, input.expression)
+		mc = MetricCollapser(input.gff, input.metrics_info, input.ext_scores, input.cds_lengths, input.expression, engine="numpy", threads=threads)
 		with open(output[0], "w") as out:
 			mc.write_scores(config["collapse_metrics_thresholds"], stream=out)
 		open(output[1], "w").close()
@@ -766,11 +776,15 @@ rule minos_summarise_collapsed_metrics:
 	input:
 		rules.minos_collapse_metrics.output[0]
 	output:
-		os.path.join(RESULTS_DIR, RELEASE_PREFIX + ".release.collapsed_metrics.summary.tsv")
+		os.path.join(RESULTS_DIR, RELEASE_PREFIX + ".release.collapsed_metrics.summary.tsv"),
+		os.path.join(RESULTS_DIR, RELEASE_PREFIX + ".release.collapsed_metrics.summary.bins.tsv")
 	run:
 		from minos.scripts.summarise_collapsed_metrics import CollapsedMetricsSummariser
+		summariser = CollapsedMetricsSummariser(input[0], quantile_bins=config["misc"].get("summary_quantile_bins", 100))
 		with open(output[0], "w") as out:
-			CollapsedMetricsSummariser(input[0]).write_summary(stream=out)
+			summariser.write_summary(stream=out, quantile_columns=config["misc"].get("summary_quantile_columns", False))
+		with open(output[1], "w") as out:
+			summariser.write_bins(stream=out)
 
 
 rule minos_create_release_gffs:
@@ -790,7 +804,7 @@ rule minos_create_release_gffs:
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_create_release_gffs") * attempt
 	shell:
-		"create_release_gff3 {input.gff} {input.metrics_info} --annotation-version {params.annotation_version} --genus-identifier {params.genus_identifier} 2> {LOG_DIR}/create_release_gff.log"
+		"create_release_gff3 {input.gff} {input.metrics_info} --annotation-version {params.annotation_version} --genus-identifier {params.genus_identifier} --threads {threads} 2> {LOG_DIR}/create_release_gff.log"
 
 rule minos_create_release_metrics:
 	input:
@@ -845,7 +859,7 @@ rule minos_final_sanity_check:
 	resources:
 		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_final_sanity_check") * attempt
 	shell:
-		"sanity_check {input[0]} > {output[0]} 2> {log}"
+		"sanity_check --stream {input[0]} > {output[0]} 2> {log}"
 
 rule minos_mikado_pick_extract_coords:
 	input:
@@ -884,13 +898,15 @@ rule minos_extract_final_sequences:
 		pep_temp = rules.minos_sort_release_gffs.output[0] + ".pep.raw.fasta.temp"
 	params:
 		program_call_gffread = config["program_calls"]["gffread"],
-		program_call_seqkit = config["program_calls"]["seqkit"],
 		table_format = "--table @chr,@start,@end,@strand,@numexons,@covlen,@cdslen,ID,Note,confidence,representative,biotype,InFrameStop,partialness",
-		program_params_translate = config["params"]["seqkit"]["translate"],
-		codon_table = config["params"]["seqkit"]["codon_table"],
+		codon_table = CODON_TABLE,
 		add_fields = config["misc"]["add_fields"]
+	threads:
+		HPC_CONFIG.get_cores("minos_extract_final_sequences")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_extract_final_sequences") * attempt
 	shell:
-		"{params.program_call_gffread} {input.gff} -g {input.refseq} -P {params.table_format} -W -w {output.cdna} -x {output.cds} -y {output.pep_temp} -o {output.tbl} && {params.program_call_seqkit} {params.program_params_translate} -T {params.codon_table} {output.cds} | clean_fasta_header --add_fields {params.add_fields} > {output.pep}"
+		"{params.program_call_gffread} {input.gff} -g {input.refseq} -P {params.table_format} -W -w {output.cdna} -x {output.cds} -y {output.pep_temp} -o {output.tbl} && translate_cds {output.cds} {output.pep} --codon-table {params.codon_table} --add-fields {params.add_fields} --threads {threads}"
 
 rule minos_cleanup_final_proteins:
 	input:
@@ -935,6 +951,10 @@ rule minos_collate_metric_oddities:
 		final_table = rules.minos_generate_final_table.output.final_table,
 	output:
 		os.path.join(config["outdir"], "results", RELEASE_PREFIX + ".release.metrics_oddities.tsv"),
+	threads:
+		HPC_CONFIG.get_cores("minos_collate_metric_oddities")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("minos_collate_metric_oddities") * attempt
 	run:
 		import csv
 		from minos.scripts.metric_oddities import MetricOddityParser
@@ -944,7 +964,7 @@ rule minos_collate_metric_oddities:
 			for row in csv.reader(open(input.old_new_rel), delimiter="\t") if not row[0].startswith("#") and row[1] in release_transcripts
 		}
 		with open(output[0], "w") as loci_oddities_out:
-			MetricOddityParser(input[0], input[1], input[2], config["report_metric_oddities"], transcript_data=transcript_data).write_table(stream=loci_oddities_out)
+			MetricOddityParser(input[0], input[1], input[2], config["report_metric_oddities"], transcript_data=transcript_data, threads=threads).write_table(stream=loci_oddities_out)
 
 rule config_copy_results:
 	input:
@@ -1130,11 +1150,18 @@ rule busco_copy_results:
 
 rule busco_summary:
 	input:
-		rules.minos_mikado_prepare_extract_coords.output[0],
+		rules.minos_mikado_prepare_fanout.output.coords,
 		rules.minos_mikado_pick_extract_coords.output[0],
 		BUSCO_ANALYSES + BUSCO_PROTEIN_PREPARE_RUNS
 	output:
 		BUSCO_TABLE
+	params:
+		# parsed full tables, reused for the busco runs that did not change since the last summary
+		cache = os.path.join(BUSCO_PATH, "busco_full_tables.cache")
+	threads:
+		HPC_CONFIG.get_cores("busco_summary")
+	resources:
+		mem_mb = lambda wildcards, attempt: HPC_CONFIG.get_memory("busco_summary") * attempt
 	run:
 		from minos.scripts.generate_busco_tables import BuscoTableGenerator
 
@@ -1142,7 +1169,9 @@ rule busco_summary:
 			os.path.join(config["outdir"], "tx2gene"),
 			input[0],
 			input[1],
-			os.path.join(BUSCO_PATH, "runs")
+			os.path.join(BUSCO_PATH, "runs"),
+			threads=threads,
+			cache_file=params.cache
 		)
 		btg.write_review_table(output[0])
 		btg.write_raw_data(output[0])
@@ -52,15 +52,21 @@ setup(
         "console_scripts": [
             "minos=minos.__main__:main",
             "generate_metrics=minos.scripts.generate_metrics:main",
+            "get_blast_tophit=minos.scripts.get_blast_tophit:main",
+            "chunk_fasta=minos.scripts.chunk_fasta:main",
             "parse_mikado_gff=minos.scripts.parse_mikado_gff:main",
             "protein_completeness=minos.scripts.protein_completeness:main",
             "collapse_metrics=minos.scripts.collapse_metrics:main",
             "validate_gff3=minos.scripts.validate_gff3:main",
             "create_release_gff3=minos.scripts.create_release_gff:main",
+            "index_gff3=minos.scripts.gff_index:main",
+            "index_fasta=minos.scripts.fasta_index:main",
             "sanity_check=minos.scripts.sanity_check:main",
             "parse_mikado_stats=minos.scripts.parse_mikado_stats:main",
             "analyse_busco=minos.scripts.analyse_busco:main",
+            "busco_split_fasta=minos.scripts.busco_splitter:main",
             "clean_fasta_header=minos.scripts.clean_fasta_header:main",
+            "translate_cds=minos.scripts.translate_cds:main",
             "install_cpc2=minos.scripts.install_cpc2:main"
         ]
     },